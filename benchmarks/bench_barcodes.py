@@ -0,0 +1,63 @@
+# benchmarks/bench_barcodes.py
+# مقارنة الرسم المتتابع القديم للباركود بمحرك utils.barcode_engine
+#   python benchmarks/bench_barcodes.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import shutil
+import tempfile
+import time
+
+import barcode
+from barcode.writer import ImageWriter
+from PIL import Image, ImageDraw
+import arabic_reshaper
+from bidi.algorithm import get_display
+
+from utils.barcode_engine import (
+    NAME_FONT_SIZE, WRITER_OPTIONS, barcode_value, load_name_font, render_barcodes,
+)
+
+def _render_legacy(code, student_name, out_dir):
+    # نفس خطوات الإصدار السابق: البحث عن الفئة والخط لكل طالب، وحفظ الصورة ثم فتحها وحفظها مرة أخرى
+    EAN = barcode.get_barcode_class("ean13")
+    base_path = os.path.join(out_dir, str(code))
+    EAN(barcode_value(code), writer=ImageWriter()).save(base_path, WRITER_OPTIONS)
+    img = Image.open(base_path + ".png").convert("RGB")
+    font = load_name_font()
+    bidi_text = get_display(arabic_reshaper.reshape(student_name))
+    text_height = ImageDraw.Draw(img).textbbox((0, 0), bidi_text, font=font)[3]
+    new_img = Image.new("RGB", (img.width, img.height + NAME_FONT_SIZE + 20), "white")
+    ImageDraw.Draw(new_img).text((3, 10), bidi_text, font=font, fill="black")
+    new_img.paste(img, (0, text_height + 20))
+    new_img.save(base_path + ".png")
+
+
+def benchmark_barcodes(sizes=(1000, 10000), workers=None):
+    """مقارنة الرسم المتتابع القديم بالمحرك على أعداد مختلفة من الطلاب"""
+    workers = workers or os.cpu_count() or 1
+    for size in sizes:
+        students = [(i, 1000 + i, f"طالب{i} احمد محمد") for i in range(size)]
+        out_dir = tempfile.mkdtemp(prefix="barcodes_")
+        try:
+            start = time.perf_counter()
+            for _, code, name in students:
+                _render_legacy(code, name, out_dir)
+            legacy = time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = render_barcodes(
+                [(i, code, name, os.path.join(out_dir, f"{code}.png")) for i, code, name in students],
+                workers
+            )
+            engine = time.perf_counter() - start
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+        failed = sum(1 for r in results if r[2])
+        print(f"{size:>6} طالب | القديم {legacy:7.2f} s | المحرك {engine:7.2f} s "
+              f"({workers} عملية) | تسريع {legacy / engine:4.1f}x | أخطاء {failed}")
+
+
+if __name__ == "__main__":
+    benchmark_barcodes()
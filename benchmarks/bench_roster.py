@@ -0,0 +1,110 @@
+# benchmarks/bench_roster.py
+# قياس استعلامات قائمة الطلاب وتفاصيل المجموعة على قاعدة بيانات مؤقتة في الذاكرة
+#   python benchmarks/bench_roster.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sqlite3
+import time
+from datetime import datetime
+
+from utils.roster import fetch_roster, fetch_group_details
+
+
+def _build_benchmark_db(students_count, groups_count=20, sessions=24, exams_per_student=6):
+    # قاعدة بيانات مؤقتة في الذاكرة بنفس أعمدة الجداول المستخدمة في الاستعلام
+    conn = sqlite3.connect(":memory:")
+    c = conn.cursor()
+    c.executescript('''
+        CREATE TABLE groups (id INTEGER PRIMARY KEY, name TEXT, days TEXT, students_count INTEGER, stage TEXT);
+        CREATE TABLE students (id INTEGER PRIMARY KEY, first_name TEXT, father_name TEXT, family_name TEXT,
+                               phone TEXT, guardian_phone TEXT, grade TEXT, group_id INTEGER, code TEXT);
+        CREATE TABLE exams (id INTEGER PRIMARY KEY, student_id INTEGER, exam_date TEXT,
+                            total_score INTEGER, student_score INTEGER);
+        CREATE TABLE attendance (id INTEGER PRIMARY KEY, student_id INTEGER, attendance_date TEXT, status TEXT,
+                                 UNIQUE(student_id, attendance_date));
+        CREATE TABLE payments (id INTEGER PRIMARY KEY, student_id INTEGER, month TEXT, status TEXT,
+                               UNIQUE(student_id, month));
+        CREATE INDEX idx_exams_student ON exams(student_id);
+        CREATE INDEX idx_students_group ON students(group_id);
+        CREATE INDEX idx_attendance_student_status ON attendance(student_id, status);
+        CREATE INDEX idx_payments_student_month_status ON payments(student_id, month, status);
+    ''')
+    month = datetime.now().strftime('%Y-%m')
+    c.executemany("INSERT INTO groups (id, name) VALUES (?, ?)",
+                  [(g, f"مجموعة {g}") for g in range(1, groups_count + 1)])
+    c.executemany(
+        "INSERT INTO students (id, first_name, father_name, family_name, grade, group_id, code) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(i, f"طالب{i}", "احمد", "محمد", "الصف الأول الثانوي", i % groups_count + 1, str(1000 + i))
+         for i in range(1, students_count + 1)]
+    )
+    c.executemany(
+        "INSERT INTO exams (student_id, exam_date, total_score, student_score) VALUES (?, ?, 20, 15)",
+        [(i, f"2025-01-{e + 1:02d}") for i in range(1, students_count + 1) for e in range(exams_per_student)]
+    )
+    c.executemany(
+        "INSERT INTO attendance (student_id, attendance_date, status) VALUES (?, ?, ?)",
+        [(i, f"2025-01-{d + 1:02d}", "حاضر" if (i + d) % 4 else "غائب")
+         for i in range(1, students_count + 1) for d in range(sessions)]
+    )
+    c.executemany(
+        "INSERT INTO payments (student_id, month, status) VALUES (?, ?, 'دفع')",
+        [(i, month) for i in range(1, students_count + 1, 2)]
+    )
+    conn.commit()
+    return conn
+
+
+def benchmark_roster(sizes=(250, 1000, 2000, 4000), repeats=3):
+    """
+    قياس زمن fetch_roster على أحجام مختلفة من الطلاب.
+    زمن الطالب الواحد يجب أن يبقى ثابتاً تقريباً مهما زاد العدد.
+    """
+    results = []
+    for size in sizes:
+        conn = _build_benchmark_db(size)
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            rows = fetch_roster(conn)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        conn.close()
+        per_student_us = best / max(len(rows), 1) * 1_000_000
+        results.append((size, best, per_student_us))
+        print(f"{size:>6} طالب | {best * 1000:8.1f} ms | {per_student_us:6.1f} µs/طالب")
+    return results
+
+
+def _group_details_per_student(conn, group_id):
+    # الطريقة السابقة (أربعة استعلامات لكل طالب) للمقارنة
+    c = conn.cursor()
+    c.execute('''SELECT id FROM students WHERE group_id=?''', (group_id,))
+    result = []
+    for (student_id,) in c.fetchall():
+        c.execute('SELECT status FROM payments WHERE student_id=? ORDER BY month DESC LIMIT 1', (student_id,))
+        c.fetchone()
+        c.execute('SELECT COUNT(*) FROM exams WHERE student_id=?', (student_id,))
+        c.fetchone()
+        c.execute("SELECT COUNT(*) FROM attendance WHERE student_id=? AND status='حاضر'", (student_id,))
+        c.fetchone()
+        c.execute('SELECT COUNT(*) FROM attendance WHERE student_id=?', (student_id,))
+        result.append(c.fetchone())
+    return result
+
+
+def benchmark_group_details(group_size=150, groups_count=20, repeats=20):
+    """قياس زمن fetch_group_details مقارنة بأربعة استعلامات لكل طالب لمجموعة بحجم group_size"""
+    conn = _build_benchmark_db(group_size * groups_count, groups_count=groups_count)
+    for name, fetch in (("استعلام واحد", fetch_group_details), ("استعلامات لكل طالب", _group_details_per_student)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            rows = fetch(conn, 1)
+        elapsed_ms = (time.perf_counter() - start) / repeats * 1000
+        print(f"{name:>20} | {len(rows)} طالب | {elapsed_ms:7.2f} ms")
+    conn.close()
+
+
+if __name__ == "__main__":
+    benchmark_roster()
+    benchmark_group_details()
@@ -0,0 +1,53 @@
+# benchmarks/bench_search.py
+# قياس بحث الطلاب بفهرس FTS5 مقارنة بـ LIKE على قاعدة بيانات مؤقتة في الذاكرة
+#   python benchmarks/bench_search.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sqlite3
+import time
+
+from utils.database import FULL_NAME_EXPR
+from utils.student_search import create_search_index, search_students
+
+
+def benchmark_search(students_count=50000, repeats=200):
+    """قياس زمن search_students مقارنة بـ LIKE على قاعدة بيانات مؤقتة في الذاكرة"""
+    conn = sqlite3.connect(":memory:")
+    c = conn.cursor()
+    c.execute(f'''CREATE TABLE students (id INTEGER PRIMARY KEY, first_name TEXT, father_name TEXT, family_name TEXT,
+                 phone TEXT, guardian_phone TEXT, grade TEXT, group_id INTEGER, code TEXT,
+                 full_name TEXT GENERATED ALWAYS AS ({FULL_NAME_EXPR}) VIRTUAL)''')
+    create_search_index(c)
+    first_names = ["أحمد", "محمد", "محمود", "إسلام", "يوسف", "مصطفى", "عمر", "آية", "فاطمة", "مريم"]
+    family_names = ["السيد", "إبراهيم", "عبدالله", "حسن", "علي", "عثمان", "سلامة", "عطية"]
+    c.executemany(
+        "INSERT INTO students (id, first_name, father_name, family_name, phone, guardian_phone, grade, group_id, code) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(i, f"{first_names[i % 10]}{i}", first_names[(i // 10) % 10], family_names[i % 8],
+          f"010{i:08d}", f"011{i:08d}", "الصف الأول", i % 40, str(1000 + i))
+         for i in range(1, students_count + 1)]
+    )
+    conn.commit()
+
+    terms = ["احمد12", "محمود ابراهيم", "مصطفي", "1234", "01000012"]
+    for term in terms:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            ids = search_students(conn, term)
+        fts_ms = (time.perf_counter() - start) / repeats * 1000
+
+        val = f"%{term}%"
+        start = time.perf_counter()
+        conn.execute(
+            "SELECT id FROM students WHERE first_name LIKE ? OR father_name LIKE ? OR family_name LIKE ? OR code LIKE ? "
+            "ORDER BY first_name, father_name, family_name",
+            (val, val, val, val)
+        ).fetchall()
+        like_ms = (time.perf_counter() - start) * 1000
+        print(f"{term:>16} | FTS {fts_ms:7.3f} ms ({len(ids)} نتيجة) | LIKE {like_ms:7.1f} ms")
+    conn.close()
+
+
+if __name__ == "__main__":
+    benchmark_search()
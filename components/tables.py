@@ -1,14 +1,24 @@
 import flet as ft
 import sqlite3
-import asyncio
-import threading
 from datetime import datetime
-from utils.database import students_db_path
+from utils.database import students_db_path, get_connection, cached_fetchall
 from utils.helpers import show_error_dialog
-from utils.date_utils import normalize_date_format
+from utils.date_utils import to_display_date, today_storage
+from utils.telegram_outbox import enqueue_message
+
+
+def patch_text(text: ft.Text, value, color=None):
+    """تعديل نص خلية واحدة وإرسال هذا العنصر وحده للواجهة بدلاً من إعادة رسم الجدول"""
+    text.value = value
+    if color is not None:
+        text.color = color
+    if text.page:
+        text.update()
 
 
 class PaymentTable(ft.Column):
+    QUERY_CHUNK = 500  # حد متغيرات SQLite في استعلام IN الواحد
+
     MONTHS_AR = [
         "يناير", "فبراير", "مارس", "أبريل", "مايو", "يونيو",
         "يوليو", "أغسطس", "سبتمبر", "أكتوبر", "نوفمبر", "ديسمبر"
@@ -19,6 +29,8 @@ class PaymentTable(ft.Column):
         self.data = data
         self.page = page
         self.rows = []
+        self.row_cells = {}  # student_id -> عناصر النص القابلة للتعديل في الصف
+        self.row_index = {}  # student_id -> موقع الصف في self.data
         self.expand = True
         self.horizontal_alignment = ft.CrossAxisAlignment.STRETCH
         self.alignment = ft.MainAxisAlignment.START
@@ -78,69 +90,81 @@ class PaymentTable(ft.Column):
     def did_mount(self):
         self.load_data()
 
+    def load_payment_statuses(self, student_ids, month):
+        """حالات الدفع لكل الطلاب المعروضين في الشهر المحدد: {student_id: status}"""
+        statuses = {}
+        conn = get_connection()
+        try:
+            for start in range(0, len(student_ids), self.QUERY_CHUNK):
+                chunk = student_ids[start:start + self.QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                # الطلاب بدون سجل في الشهر لا يظهرون هنا ويُعرضون "لم يدفع"
+                rows = cached_fetchall(conn, f'''SELECT student_id, status FROM payments
+                                       WHERE month = ? AND student_id IN ({placeholders})''', [month, *chunk],
+                                       tables=("payments",))
+                statuses.update(rows)
+        finally:
+            conn.close()
+        return statuses
+
     def load_data(self):
         self.rows.clear()
+        self.row_cells.clear()
+        self.row_index.clear()
         current_month = self.selected_month if self.selected_month else self.get_current_month()  # YYYY-MM
-        conn = None
+        month_ar = self.numeric_month_to_arabic(current_month)
 
+        # كل صف: [الاسم، الكود، حالة الدفع، الشهر، معرف الطالب]
         try:
-            conn = sqlite3.connect(students_db_path)
-            c = conn.cursor()
+            statuses = self.load_payment_statuses([row[4] for row in self.data], current_month)
+        except Exception as e:
+            show_error_dialog(self.page, f"خطأ في تحميل البيانات: {str(e)}")
+            statuses = {}
 
-            for index, row in enumerate(self.data):
-                name = row[0]  # الاسم
-                code = row[1]  # الكود
-                status = "لم يدفع"  # الحالة الافتراضية
-
-                c.execute('''SELECT id FROM students 
-                           WHERE first_name || " " || father_name || " " || family_name = ?''', (name,))
-                student = c.fetchone()
-
-                if student:
-                    c.execute('''SELECT status FROM payments 
-                               WHERE student_id = ? AND month = ?
-                               ORDER BY payment_date DESC LIMIT 1''', (student[0], current_month))
-                    payment = c.fetchone()
-                    if payment:
-                        status = payment[0]
-
-                if len(row) >= 3:
-                    row[2] = status
-                else:
-                    row.append(status)
+        for index, row in enumerate(self.data):
+            name, code, student_id = row[0], row[1], row[4]
+            row[2] = statuses.get(student_id) or "لم يدفع"
+            row[3] = month_ar
 
-                if len(row) >= 4:
-                    row[3] = self.numeric_month_to_arabic(current_month)
-                else:
-                    row.append(self.numeric_month_to_arabic(current_month))
-
-                color = "green" if status.strip() == "دفع" else "red"
-
-                self.rows.append(
-                    ft.DataRow(
-                        cells=[
-                            ft.DataCell(ft.Text(str(index+1), text_align="center", weight="bold", color="#1E3A8A")),
-                            ft.DataCell(ft.Text(str(code), text_align="center", weight="bold", color="#000000")),
-                            ft.DataCell(
-                                ft.Text(name, text_align="center", weight="bold", color="#000000"),
-                                on_tap=lambda e, idx=index, n=name: self.show_edit_dialog(idx, n, status, current_month)
-                            ),
-                            ft.DataCell(ft.Text(status, color=color, text_align="center", weight="bold")),
-                            ft.DataCell(ft.Text(self.numeric_month_to_arabic(current_month), text_align="center", weight="bold", color="#000000"))
-                        ]
-                    )
-                )
+            status_text = ft.Text(row[2], color=self.get_status_color(row[2]), text_align="center", weight="bold")
+            month_text = ft.Text(month_ar, text_align="center", weight="bold", color="#000000")
+            self.row_cells[student_id] = {"status": status_text, "month": month_text}
+            self.row_index[student_id] = index
 
-        except Exception as e:
-            show_error_dialog(self.page, f"خطأ في تحميل البيانات: {str(e)}")
-        finally:
-            if conn:
-                conn.close()
+            self.rows.append(
+                ft.DataRow(
+                    cells=[
+                        ft.DataCell(ft.Text(str(index+1), text_align="center", weight="bold", color="#1E3A8A")),
+                        ft.DataCell(ft.Text(str(code), text_align="center", weight="bold", color="#000000")),
+                        ft.DataCell(
+                            ft.Text(name, text_align="center", weight="bold", color="#000000"),
+                            # الحالة تُقرأ وقت الضغط لأن الخلية قد تتغير بعد البناء
+                            on_tap=lambda e, sid=student_id, n=name: self.show_edit_dialog(
+                                sid, n, self.data[self.row_index[sid]][2], current_month)
+                        ),
+                        ft.DataCell(status_text),
+                        ft.DataCell(month_text)
+                    ]
+                )
+            )
 
         self.table.rows = self.rows
         self.update()
 
-    def show_edit_dialog(self, index, name, current_status, current_month):
+    @staticmethod
+    def get_status_color(status):
+        return "green" if status.strip() == "دفع" else "red"
+
+    def update_row(self, student_id):
+        """تحديث خلايا صف طالب واحد من self.data بدون إعادة بناء الجدول"""
+        cells = self.row_cells.get(student_id)
+        if cells is None:
+            return
+        row = self.data[self.row_index[student_id]]
+        patch_text(cells["status"], row[2], self.get_status_color(row[2]))
+        patch_text(cells["month"], row[3])
+
+    def show_edit_dialog(self, student_id, name, current_status, current_month):
         status_dropdown = ft.Dropdown(
             label="حالة الدفع",
             value=current_status,
@@ -168,47 +192,30 @@ class PaymentTable(ft.Column):
                 horizontal_alignment=ft.CrossAxisAlignment.CENTER
             ),
             actions=[
-                ft.TextButton("حفظ", on_click=lambda e: self._sync_save_payment_status(index, status_dropdown.value, month_dropdown.value, edit_dialog)),
+                ft.TextButton("حفظ", on_click=lambda e: self._save_payment_status(student_id, status_dropdown.value, month_dropdown.value, edit_dialog)),
                 ft.TextButton("إلغاء", on_click=lambda e: self.page.close(edit_dialog))
             ],
             actions_alignment=ft.MainAxisAlignment.END
         )
         self.page.open(edit_dialog)
 
-    def get_or_create_eventloop(self):
-        try:
-            return asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            return loop
-
-    def _sync_save_payment_status(self, index, new_status, new_month_ar, dialog):
-        try:
-            loop = self.get_or_create_eventloop()
-            loop.run_until_complete(self._async_save_payment_status(index, new_status, new_month_ar, dialog))
-        except Exception as e:
-            show_error_dialog(self.page, f"خطأ في حفظ حالة الدفع: {str(e)}")
-        finally:
-            self.page.close(dialog)
-
-    async def _async_save_payment_status(self, index, new_status, new_month_ar, dialog):
+    def _save_payment_status(self, student_id, new_status, new_month_ar, dialog):
         conn = None
         try:
             new_month = self.arabic_month_to_numeric(new_month_ar)
-            conn = sqlite3.connect(students_db_path)
+            conn = get_connection()
             c = conn.cursor()
-            name = self.data[index][0]
 
-            c.execute('SELECT id, first_name || " " || father_name || " " || family_name, guardian_chat_id FROM students WHERE first_name || " " || father_name || " " || family_name = ?', (name,))
+            c.execute('SELECT full_name, guardian_chat_id FROM students WHERE id = ?', (student_id,))
             student = c.fetchone()
 
             if student:
-                student_id, student_name, guardian_chat_id = student
+                student_name, guardian_chat_id = student
+                index = self.row_index[student_id]
                 c.execute('SELECT id, status FROM payments WHERE student_id=? AND month=?', (student_id, new_month))
                 payment = c.fetchone()
 
-                payment_date = normalize_date_format(datetime.now().strftime('%Y-%m-%d')) if new_status == "دفع" else ""
+                payment_date = today_storage() if new_status == "دفع" else ""
 
                 if payment:
                     if payment[1] != new_status:
@@ -227,23 +234,25 @@ class PaymentTable(ft.Column):
                 # تحديث البيانات المحلية
                 self.data[index][2] = new_status
                 self.data[index][3] = self.numeric_month_to_arabic(new_month)
+                displayed_month = self.selected_month or self.get_current_month()
                 self.selected_month = new_month
-                self.load_data()
+                if new_month == displayed_month:
+                    # نفس الشهر المعروض: يكفي تعديل خلايا هذا الصف
+                    self.update_row(student_id)
+                else:
+                    # تغيير الشهر يغير حالة كل الصفوف
+                    self.load_data()
 
                 # إرسال إشعار
                 if guardian_chat_id and guardian_chat_id != "None":
-                    from utils.telegram_bot import send_telegram_message
                     message = f"💰 تحديث حالة الدفع\n"
                     message += f"الطالب: {student_name}\n"
                     message += f"الشهر: {new_month_ar}\n"
-                    message += f"التاريخ: {payment_date}\n"
+                    message += f"التاريخ: {to_display_date(payment_date)}\n"
                     message += f"الحالة: {new_status}\n"
-                    success, error_msg = await send_telegram_message(guardian_chat_id, message)
-                    if success:
-                        print(f" تم إرسال إشعار لولي أمر {student_name}")
-                    else:
-                        print(f" فشل إرسال الإشعار لولي أمر {student_name}: {error_msg}")
-                        show_error_dialog(self.page, f"فشل إرسال الإشعار لولي أمر {student_name}: {error_msg}")
+                    # الإرسال يتم في الخلفية عبر صندوق الصادر
+                    enqueue_message(guardian_chat_id, message)
+                    print(f" تمت جدولة إشعار لولي أمر {student_name}")
                 else:
                     print(f" لا يوجد guardian_chat_id صالح للطالب {student_name}")
                     show_error_dialog(self.page, f"لا يوجد guardian_chat_id صالح للطالب {student_name}")
@@ -269,6 +278,7 @@ class AttendanceTable(ft.Column):
         self.data = data
         self.page = page
         self.rows = []
+        self.row_cells = {}  # index -> عنصر نص الحالة الحالية في الصف
         self.expand = True  # Ensure AttendanceTable fills available space
         self.horizontal_alignment = ft.CrossAxisAlignment.STRETCH  # Stretch children horizontally
         self.alignment = ft.MainAxisAlignment.START  # Align content to start vertically
@@ -328,6 +338,7 @@ class AttendanceTable(ft.Column):
 
     def load_data(self):
         self.rows.clear()
+        self.row_cells.clear()
         for index, row in enumerate(self.data):
             # Expect row = [name, code, last_status, current_status]
             if len(row) == 4:
@@ -338,7 +349,8 @@ class AttendanceTable(ft.Column):
                 last_status = row[2] if len(row) > 2 else "غير محدد"
                 current_status = row[3] if len(row) > 3 else "غير محدد"
             last_color = self.get_status_color(last_status)
-            current_color = self.get_status_color(current_status)
+            current_text = ft.Text(current_status, color=self.get_status_color(current_status), text_align="center", weight="bold")
+            self.row_cells[index] = current_text
             self.rows.append(
                 ft.DataRow(
                     cells=[
@@ -350,14 +362,12 @@ class AttendanceTable(ft.Column):
                         ),
                         ft.DataCell(
                             ft.Text(name, text_align="center", weight="bold", color="#000000"),
-                            on_tap=lambda e, idx=index, n=name: self.show_edit_dialog(idx, n, current_status)
+                            on_tap=lambda e, idx=index, n=name: self.show_edit_dialog(idx, n, self.data[idx][3])
                         ),
                         ft.DataCell(
                             ft.Text(last_status, color=last_color, text_align="center", weight="bold")
                         ),
-                        ft.DataCell(
-                            ft.Text(current_status, color=current_color, text_align="center", weight="bold")
-                        ),
+                        ft.DataCell(current_text),
                     ]
                 )
             )
@@ -413,10 +423,17 @@ class AttendanceTable(ft.Column):
         # تحديث الحالة في البيانات المحلية
         self.data[index][3] = new_status
         
-        # تحديث الجدول مباشرة
-        self.load_data()
+        # تحديث خلية الحالة في هذا الصف فقط
+        self.update_row(index)
         self.page.close(dialog)
-        self.page.update()
+
+    def update_row(self, index):
+        """تحديث خلية الحالة الحالية لصف واحد من self.data بدون إعادة بناء الجدول"""
+        current_text = self.row_cells.get(index)
+        if current_text is None:
+            return
+        status = self.data[index][3]
+        patch_text(current_text, status, self.get_status_color(status))
 
     def refresh(self, new_data):
         self.data = new_data
@@ -431,6 +448,7 @@ class ExamTable(ft.Column):
         self.page = page
         self.students_db_path = students_db_path
         self.rows = []
+        self.row_cells = {}  # index -> عناصر النص القابلة للتعديل في الصف
         self.expand = True
         self.horizontal_alignment = ft.CrossAxisAlignment.STRETCH
         self.alignment = ft.MainAxisAlignment.START
@@ -482,8 +500,11 @@ class ExamTable(ft.Column):
 
     def load_data(self):
         self.rows.clear()
+        self.row_cells.clear()
         for index, (student_code, name, last_grade, num_exams) in enumerate(self.data):
-            color = self.get_grade_color(last_grade)
+            grade_text = ft.Text(last_grade, color=self.get_grade_color(last_grade), text_align="center", weight="bold")
+            count_text = ft.Text(str(num_exams), text_align="center", weight="bold", color="#000000")
+            self.row_cells[index] = {"grade": grade_text, "count": count_text}
             self.rows.append(
                 ft.DataRow(
                     cells=[
@@ -493,8 +514,8 @@ class ExamTable(ft.Column):
                             ft.Text(name, text_align="center", weight="bold", color="#000000"),
                             on_tap=lambda e, idx=index, n=name: self.show_add_exam_dialog(idx, n)
                         ),
-                        ft.DataCell(ft.Text(last_grade, color=color, text_align="center", weight="bold")),
-                        ft.DataCell(ft.Text(str(num_exams), text_align="center", weight="bold", color="#000000")),
+                        ft.DataCell(grade_text),
+                        ft.DataCell(count_text),
                     ]
                 )
             )
@@ -510,13 +531,14 @@ class ExamTable(ft.Column):
         except ValueError:
             return "gray"
 
-    def get_or_create_eventloop(self):
-        try:
-            return asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            return loop
+    def update_row(self, index):
+        """تحديث خلايا الدرجة وعدد الاختبارات لصف واحد بدون إعادة بناء الجدول"""
+        cells = self.row_cells.get(index)
+        if cells is None:
+            return
+        last_grade, num_exams = self.data[index][2], self.data[index][3]
+        patch_text(cells["grade"], last_grade, self.get_grade_color(last_grade))
+        patch_text(cells["count"], str(num_exams))
 
     def show_add_exam_dialog(self, index, name):
         student_grade = ft.TextField(label="درجة الطالب", keyboard_type=ft.KeyboardType.NUMBER, text_align=ft.TextAlign.RIGHT)
@@ -555,99 +577,10 @@ class ExamTable(ft.Column):
             self.page.close(dialog)
             return
 
-        def async_callback():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                success = loop.run_until_complete(self._async_save_exam_grade(index, student_grade, total_grade, dialog))
-                if success:
-                    self.page.close(dialog)
-            except Exception as e:
-                print(f" خطأ في حفظ درجة الامتحان: {str(e)}")
-                show_error_dialog(self.page, f"خطأ في حفظ درجة الامتحان: {str(e)}")
-                self.page.close(dialog)
-            finally:
-                loop.close()
-
-        # تشغيل العملية في خيط منفصل
-        threading.Thread(target=async_callback).start()
-
-    async def _async_save_exam_grade(self, index, student_grade, total_grade, dialog):
-        if not student_grade or not total_grade:
-            show_error_dialog(self.page, "يرجى ملء الحقول")
+        if self._save_exam_grade(index, student_grade, total_grade):
             self.page.close(dialog)
-            return
-        
-        try:
-            student_g = int(student_grade)
-            total_g = int(total_grade)
-            if not (0 <= student_g <= total_g):
-                show_error_dialog(self.page, "درجة الطالب يجب أن تكون بين 0 والدرجة النهائية")
-                self.page.close(dialog)
-                return
-        except ValueError:
-            show_error_dialog(self.page, "يرجى إدخال أرقام صحيحة")
-            self.page.close(dialog)
-            return
-
-        try:
-            # Note: Removed recursive call that was causing infinite loop
-            student_g = int(student_grade)
-            total_g = int(total_grade)
-            new_grade_str = f"{student_g}/{total_g}"
-            print(f" جاري تسجيل درجة جديدة للطالب {self.data[index][1]}: {new_grade_str}")
-
-            conn = sqlite3.connect(self.students_db_path)
-            c = conn.cursor()
-            student_code = self.data[index][0]
-
-            c.execute('SELECT id, guardian_chat_id FROM students WHERE code = ?', (student_code,))
-            student = c.fetchone()
-            if student:
-                student_id, guardian_chat_id = student
-                today = datetime.now().strftime('%Y-%m-%d')
-                c.execute('''INSERT INTO exams (student_id, exam_date, total_score, student_score) VALUES (?, ?, ?, ?)''',
-                          (student_id, today, total_g, student_g))
-                conn.commit()
 
-                c.execute('''SELECT 
-                            (SELECT student_score || '/' || total_score FROM exams WHERE student_id = ? ORDER BY date(exam_date) DESC, id DESC LIMIT 1) as last_grade,
-                            (SELECT COUNT(*) FROM exams WHERE student_id = ?) as num_exams''', 
-                        (student_id, student_id))
-                last_grade, num_exams = c.fetchone()
-                
-                self.data[index][2] = last_grade if last_grade else "غير متوفر"
-                self.data[index][3] = num_exams
-                
-                if guardian_chat_id and guardian_chat_id != "None":
-                    from utils.telegram_bot import send_telegram_message
-                    message = f"📝 تحديث درجة الامتحان\n"
-                    message += f"الطالب: {self.data[index][1]}\n"
-                    message += f"الدرجة: {new_grade_str}\n"
-                    message += f"التاريخ: {today}\n"
-                    success, error_msg = await send_telegram_message(guardian_chat_id, message)
-                    if not success:
-                        c.execute('''INSERT INTO pending_notifications (chat_id, message, created_at) VALUES (?, ?, ?)''',
-                                  (guardian_chat_id, message, today))
-                        conn.commit()
-                
-                self.load_data()
-                self.page.update()
-                return True
-            else:
-                show_error_dialog(self.page, "لم يتم العثور على الطالب")
-                return False
-
-        except Exception as e:
-            print(f" خطأ في حفظ درجة الامتحان: {str(e)}")
-            show_error_dialog(self.page, f"خطأ في حفظ درجة الامتحان: {str(e)}")
-            return False
-        finally:
-            if 'conn' in locals() and conn:
-                conn.close()
-            self.page.close(dialog)
-
-    async def _async_save_exam_grade(self, index, student_grade, total_grade, dialog):
+    def _save_exam_grade(self, index, student_grade, total_grade):
         """تحديث درجة الامتحان للطالب"""
         try:
             student_g = int(student_grade)
@@ -655,7 +588,7 @@ class ExamTable(ft.Column):
             new_grade_str = f"{student_g}/{total_g}"
             print(f" جاري تسجيل درجة جديدة للطالب {self.data[index][1]}: {new_grade_str}")
 
-            conn = sqlite3.connect(self.students_db_path)
+            conn = get_connection(self.students_db_path)
             c = conn.cursor()
             student_code = self.data[index][0]
 
@@ -663,13 +596,13 @@ class ExamTable(ft.Column):
             student = c.fetchone()
             if student:
                 student_id, guardian_chat_id = student
-                today = datetime.now().strftime('%Y-%m-%d')
+                today = today_storage()
                 c.execute('''INSERT INTO exams (student_id, exam_date, total_score, student_score) VALUES (?, ?, ?, ?)''',
                           (student_id, today, total_g, student_g))
                 conn.commit()
 
                 c.execute('''SELECT 
-                            (SELECT student_score || '/' || total_score FROM exams WHERE student_id = ? ORDER BY date(exam_date) DESC, id DESC LIMIT 1) as last_grade,
+                            (SELECT student_score || '/' || total_score FROM exams WHERE student_id = ? ORDER BY exam_date DESC, id DESC LIMIT 1) as last_grade,
                             (SELECT COUNT(*) FROM exams WHERE student_id = ?) as num_exams''', 
                         (student_id, student_id))
                 last_grade, num_exams = c.fetchone()
@@ -679,27 +612,18 @@ class ExamTable(ft.Column):
                 print(f" تم تحديث بيانات الطالب {self.data[index][1]}: آخر درجة = {self.data[index][2]}, عدد الاختبارات = {self.data[index][3]}")
 
                 if guardian_chat_id and guardian_chat_id != "None":
-                    from utils.telegram_bot import send_telegram_message
                     message = f"📝 تحديث درجة الامتحان\n"
                     message += f"الطالب: {self.data[index][1]}\n"
                     message += f"الدرجة: {new_grade_str}\n"
-                    message += f"التاريخ: {today}\n"
-                    success, error_msg = await send_telegram_message(guardian_chat_id, message)
-                    if success:
-                        print(f" تم إرسال إشعار لولي أمر {self.data[index][1]}")
-                    else:
-                        print(f" فشل إرسال الإشعار لولي أمر {self.data[index][1]}: {error_msg}")
-                        c.execute('''INSERT INTO pending_notifications (chat_id, message, created_at) VALUES (?, ?, ?)''',
-                                  (guardian_chat_id, message, today))
-                        conn.commit()
-                        print(f" تم حفظ الإشعار المؤجل للطالب {self.data[index][1]}")
-                        show_error_dialog(self.page, f"فشل إرسال الإشعار لولي أمر {self.data[index][1]} بسبب انقطاع الإنترنت. سيتم إعادة المحاولة لاحقاً.")
+                    message += f"التاريخ: {to_display_date(today)}\n"
+                    # الإرسال وإعادة المحاولة عند انقطاع الإنترنت يتمان في الخلفية عبر صندوق الصادر
+                    enqueue_message(guardian_chat_id, message)
+                    print(f" تمت جدولة إشعار لولي أمر {self.data[index][1]}")
                 else:
                     print(f"لا يوجد guardian_chat_id صالح للطالب {self.data[index][1]}")
                     show_error_dialog(self.page, f"لا يوجد guardian_chat_id صالح للطالب {self.data[index][1]}")
                 
-                self.load_data()
-                self.page.update()
+                self.update_row(index)
                 return True
             else:
                 print(f"لم يتم العثور على الطالب بكود {student_code}")
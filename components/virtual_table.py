@@ -0,0 +1,212 @@
+import flet as ft
+
+
+class VirtualTable(ft.Column):
+    """
+    جدول لا يرسل للواجهة إلا الصفوف التي يحتاجها، مهما كان عدد السجلات.
+
+    وضعان:
+    - MODE_PAGED: صفحات من قاعدة البيانات بأسلوب keyset (WHERE key > آخر مفتاح LIMIT n)،
+      فلا يبقى في الذاكرة إلا الصفحة الحالية ومفاتيح بدايات الصفحات السابقة.
+      يُغذى بـ set_query(fetch_page, key_of).
+    - MODE_WINDOWED: قائمة سجلات في الذاكرة تُعرض في ListView، ولا تُبنى عناصر
+      إلا للصفوف القريبة من منطقة العرض، ومسافات فارغة بارتفاع الباقي قبلها وبعدها.
+      يُغذى بـ set_records(records).
+
+    columns: [(العنوان، العرض)...]
+    render_cells(index, record): عناصر خلايا الصف بنفس ترتيب الأعمدة
+    """
+
+    MODE_PAGED = "paged"
+    MODE_WINDOWED = "windowed"
+
+    HEADER_COLOR = "#1E3A8A"
+    ROW_COLORS = ("#FFFFFF", "#F3F4F6")
+
+    def __init__(self, columns, render_cells, page: ft.Page, mode=MODE_WINDOWED,
+                 page_size=50, row_height=50, empty_text="لا يوجد بيانات لعرضها"):
+        super().__init__()
+        self.columns = columns
+        self.render_cells = render_cells
+        self.page = page
+        self.mode = mode
+        self.page_size = page_size
+        self.row_height = row_height
+        self.empty_text = empty_text
+        self.expand = True
+        self.spacing = 5
+
+        self.total_width = sum(width for _, width in columns)
+
+        # وضع الصفحات
+        self._fetch_page = None
+        self._key_of = None
+        self._page_starts = [None]   # مفتاح ما قبل بداية كل صفحة تمت زيارتها
+        self._has_next = False
+        self._last_key = None
+
+        # وضع النافذة
+        self._records = []
+        self._start = 0
+        self._end = 0
+
+        self.header = ft.Container(
+            bgcolor=self.HEADER_COLOR,
+            height=self.row_height,
+            content=ft.Row(
+                spacing=0,
+                controls=[
+                    ft.Container(
+                        width=width,
+                        alignment=ft.alignment.center,
+                        content=ft.Text(title, weight="bold", color="white", text_align="center")
+                    )
+                    for title, width in columns
+                ]
+            )
+        )
+
+        self.top_spacer = ft.Container(height=0)
+        self.bottom_spacer = ft.Container(height=0)
+        self.body = ft.ListView(
+            expand=True,
+            spacing=0,
+            controls=[],
+            on_scroll=self._on_scroll if mode == self.MODE_WINDOWED else None,
+            on_scroll_interval=100,
+        )
+
+        self.page_label = ft.Text("", color="#1E3A8A", weight="bold")
+        self.prev_button = ft.IconButton(icon=ft.Icons.CHEVRON_RIGHT, tooltip="الصفحة السابقة",
+                                         on_click=lambda e: self.previous_page(), disabled=True)
+        self.next_button = ft.IconButton(icon=ft.Icons.CHEVRON_LEFT, tooltip="الصفحة التالية",
+                                         on_click=lambda e: self.next_page(), disabled=True)
+        self.pager = ft.Row(
+            [self.prev_button, self.page_label, self.next_button],
+            alignment=ft.MainAxisAlignment.CENTER,
+            visible=mode == self.MODE_PAGED,
+        )
+
+        self.controls = [
+            ft.Row(
+                expand=True,
+                scroll=ft.ScrollMode.AUTO,
+                controls=[
+                    ft.Column(
+                        width=self.total_width,
+                        spacing=0,
+                        controls=[self.header, self.body],
+                    )
+                ],
+            ),
+            self.pager,
+        ]
+
+    # ================= بناء الصفوف =================
+    def _build_row(self, index, record):
+        return ft.Container(
+            height=self.row_height,
+            bgcolor=self.ROW_COLORS[index % 2],
+            border=ft.border.only(bottom=ft.border.BorderSide(1, "#CBD5E1")),
+            content=ft.Row(
+                spacing=0,
+                controls=[
+                    ft.Container(width=width, alignment=ft.alignment.center, content=cell)
+                    for (_, width), cell in zip(self.columns, self.render_cells(index, record))
+                ]
+            )
+        )
+
+    def _empty_row(self):
+        return ft.Container(
+            height=self.row_height,
+            alignment=ft.alignment.center,
+            content=ft.Text(self.empty_text, text_align="center", color="red", weight="bold")
+        )
+
+    def _update(self):
+        if self.page:
+            self.page.update()
+
+    # ================= وضع الصفحات =================
+    def set_query(self, fetch_page, key_of):
+        """
+        fetch_page(after_key, limit): سجلات مرتبة بالمفتاح تبدأ بعد after_key (None للبداية)
+        key_of(record): مفتاح السجل بنفس ترتيب الاستعلام
+        """
+        self._fetch_page = fetch_page
+        self._key_of = key_of
+        self._page_starts = [None]
+        self._load_page()
+
+    def next_page(self):
+        if self._has_next and self._last_key is not None:
+            self._page_starts.append(self._last_key)
+            self._load_page()
+
+    def previous_page(self):
+        if len(self._page_starts) > 1:
+            self._page_starts.pop()
+            self._load_page()
+
+    def _load_page(self):
+        # سجل إضافي واحد لمعرفة وجود صفحة تالية بدون COUNT(*)
+        records = self._fetch_page(self._page_starts[-1], self.page_size + 1) if self._fetch_page else []
+        self._has_next = len(records) > self.page_size
+        records = records[:self.page_size]
+        self._last_key = self._key_of(records[-1]) if records else None
+
+        offset = (len(self._page_starts) - 1) * self.page_size
+        self.body.controls = (
+            [self._build_row(offset + i, record) for i, record in enumerate(records)]
+            if records else [self._empty_row()]
+        )
+        self.page_label.value = f"صفحة {len(self._page_starts)}"
+        self.prev_button.disabled = len(self._page_starts) <= 1
+        self.next_button.disabled = not self._has_next
+        self._update()
+
+    # ================= وضع النافذة =================
+    def set_records(self, records):
+        """عرض قائمة سجلات في الذاكرة مع بناء الصفوف القريبة من منطقة العرض فقط"""
+        self._records = list(records)
+        self._start = self._end = 0
+        if not self._records:
+            self.body.controls = [self._empty_row()]
+            self._update()
+            return
+        self._render_window(0, min(len(self._records), self.page_size))
+        self._update()
+
+    def _render_window(self, start, end):
+        self._start, self._end = start, end
+        self.top_spacer.height = start * self.row_height
+        self.bottom_spacer.height = (len(self._records) - end) * self.row_height
+        self.body.controls = (
+            [self.top_spacer]
+            + [self._build_row(i, self._records[i]) for i in range(start, end)]
+            + [self.bottom_spacer]
+        )
+
+    def _on_scroll(self, e):
+        if not self._records:
+            return
+        first = int(max(0, e.pixels) // self.row_height)
+        visible = int(e.viewport_dimension // self.row_height) + 1
+        margin = self.page_size // 4
+
+        # إعادة البناء فقط عندما تقترب منطقة العرض من حافة النافذة الحالية
+        near_top = self._start > 0 and first < self._start + margin
+        near_bottom = self._end < len(self._records) and first + visible > self._end - margin
+        if not (near_top or near_bottom):
+            return
+
+        overscan = self.page_size // 2
+        start = max(0, first - overscan)
+        end = min(len(self._records), first + visible + overscan)
+        self._render_window(start, end)
+        self._update()
+
+    @property
+    def records(self):
+        return self._records
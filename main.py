@@ -1,10 +1,9 @@
-import flet as ft
 import os
 import logging
 import asyncio
 import multiprocessing
 
-# إعداد الـ logging
+# إعداد الـ logging (يسري أيضاً في عمليات البوت والباركود الفرعية لأنها تعيد تحميل هذا الملف)
 logging.basicConfig(
     filename="app.log",
     level=logging.INFO,
@@ -12,33 +11,8 @@ logging.basicConfig(
     encoding="utf-8"
 )
 
-# استيراد الصفحات من مجلد pages
-from pages.student_page import student_page
-from pages.group_page import group_page
-from pages.send_mails_page import send_mails_page
-from pages.barcode_page import barcode_page
-
-# استيراد الدوال المساعدة
-from utils.helpers import show_error_dialog, show_success_dialog, show_under_development_dialog
-from utils.add_code import init_codes
-from utils.telegram_bot import run_telegram_bot
-
-# تعريف المسارات الرئيسية للملفات
-try:
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    assets_dir = os.path.join(base_dir, "assets")
-    logging.info(f"Assets path configured: {assets_dir}")
-
-    app_icon = os.path.join(assets_dir, "icon.ico")
-    facebook = os.path.join(assets_dir, "facebook.png")
-    whatsapp = os.path.join(assets_dir, "whatsapp.png")
-    linkedin = os.path.join(assets_dir, "linkedin.png")
-    gmail = os.path.join(assets_dir, "gmail.png")
-    home_gif = os.path.join(assets_dir, "home1.gif")
-    logging.info("Asset paths loaded successfully")
-except Exception as e:
-    logging.error(f"Error loading asset paths: {e}")
-    print(f"Error loading asset paths: {e}")
+# استيراد الواجهة والصفحات وإعداد المسارات يتم داخل __main__ فقط: العمليات الفرعية
+# (spawn) تعيد تحميل هذا الملف، ومحرك الباركود يحتاج utils.barcode_engine وحده
 
 def start_bot_later():
     """تشغيل بوت التليجرام في عملية منفصلة بعد تحميل الـ UI"""
@@ -48,7 +22,7 @@ def start_bot_later():
     bot_process.start()
     logging.info("Telegram bot process started")
 
-def main(page: ft.Page):
+def main(page: "ft.Page"):
     logging.info("Starting main function")
     added_count = init_codes()
     if added_count:
@@ -141,12 +115,52 @@ def main(page: ft.Page):
     page.run_task(start_bot_async)
     logging.info("Scheduled Telegram bot to start after UI load")
 
+    # صندوق صادر تيليجرام: يرسل الإشعارات المؤجلة والجديدة في الخلفية
+    TelegramOutbox().start()
+
     page.add(main_content)
     page.update()
     logging.info("Main content added to page")
 
 if __name__ == "__main__":
+    # مطلوب في النسخة المجمعة على ويندوز لعمليات البوت ومحرك الباركود
+    multiprocessing.freeze_support()
+
+    import flet as ft
+
+    # استيراد الصفحات من مجلد pages
+    from pages.student_page import student_page
+    from pages.group_page import group_page
+    from pages.send_mails_page import send_mails_page
+    from pages.barcode_page import barcode_page
+
+    # استيراد الدوال المساعدة
+    from utils.helpers import show_error_dialog, show_success_dialog, show_under_development_dialog
+    from utils.add_code import init_codes
+    from utils.telegram_bot import run_telegram_bot
+    from utils.database import close_all_connections
+    from utils.telegram_outbox import TelegramOutbox
+
+    # تعريف المسارات الرئيسية للملفات
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        assets_dir = os.path.join(base_dir, "assets")
+        logging.info(f"Assets path configured: {assets_dir}")
+
+        app_icon = os.path.join(assets_dir, "icon.ico")
+        facebook = os.path.join(assets_dir, "facebook.png")
+        whatsapp = os.path.join(assets_dir, "whatsapp.png")
+        linkedin = os.path.join(assets_dir, "linkedin.png")
+        gmail = os.path.join(assets_dir, "gmail.png")
+        home_gif = os.path.join(assets_dir, "home1.gif")
+        logging.info("Asset paths loaded successfully")
+    except Exception as e:
+        logging.error(f"Error loading asset paths: {e}")
+        print(f"Error loading asset paths: {e}")
+
     logging.info("Starting application")
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    assets_dir = os.path.join(base_dir, "assets")
-    ft.app(target=main, assets_dir=assets_dir)
\ No newline at end of file
+    try:
+        ft.app(target=main, assets_dir=assets_dir)
+    finally:
+        TelegramOutbox().stop()
+        close_all_connections()
\ No newline at end of file
@@ -2,11 +2,7 @@ import flet as ft
 import sqlite3
 import os
 import platform
-import barcode
-from barcode.writer import ImageWriter
-from PIL import Image, ImageDraw, ImageFont
-import arabic_reshaper
-from bidi.algorithm import get_display
+import threading
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 
@@ -18,8 +14,16 @@ except ImportError:
     win32api = None
 
 # استيراد من الوحدات الأخرى في المشروع
-from utils.database import students_db_path
-from utils.helpers import show_error_dialog, show_success_dialog, search_bar, get_groups, extract_unique_code
+from utils.database import students_db_path, get_connection
+from utils.helpers import show_error_dialog, show_success_dialog, search_bar, get_groups
+from utils.barcode_engine import sync_barcodes, get_thumbnail
+from components.virtual_table import VirtualTable
+from utils.barcode_pdf import draw_student_barcode, export_all_groups, fetch_group_students, write_group_pdf
+from utils.student_search import search_students, order_by_ids
+from utils.scan_lookup import looks_like_barcode, resolve_scan
+
+# ارتفاع ثابت لصفوف جدول الباركود حتى يمكن حساب الصفوف الظاهرة من موضع التمرير
+TABLE_ROW_HEIGHT = 50
 
 def barcode_page(page):
     # حاوية العرض الجانبية
@@ -44,52 +48,47 @@ def barcode_page(page):
 
         def fetch_students(filter_level, filter_search, filter_group):
             try:
-                with sqlite3.connect(students_db_path) as conn:
+                with get_connection() as conn:
                     c = conn.cursor()
-                    query = '''SELECT s.id, s.code, s.first_name, s.father_name, s.family_name, s.barcode_path FROM students s'''
+                    query = '''SELECT s.id, s.code, s.full_name, s.barcode_path FROM students s'''
                     params = []
                     where = []
-
-                    if filter_level["value"]:
-                        where.append("s.grade = ?")
-                        params.append(filter_level["value"])
-
-                    if filter_group["value"]:
-                        where.append("s.group_id = ?")
-                        params.append(filter_group["value"])
-
-                    if filter_search["value"]:
-                        search_val = filter_search["value"].strip()
-                        if search_val.isdigit():
-                            filtered_code = extract_unique_code(search_val)
-                            if filtered_code:
-                                where.append("CAST(s.code AS TEXT) LIKE ?")
-                                params.append(f"%{filtered_code}%")
-                            else:
-                                search_val = search_val[-4:]
-                                where.append("CAST(s.code AS TEXT) LIKE ?")
-                                params.append(f"%{search_val}%")
+                    student_ids = None
+
+                    search_val = filter_search["value"].strip()
+                    if search_val:
+                        if looks_like_barcode(search_val):
+                            # باركود ممسوح: مطابقة تامة للكود من الذاكرة
+                            student = resolve_scan(search_val)
+                            student_ids = [student["id"]] if student else []
                         else:
-                            val = f"%{search_val}%"
-                            where.append("(s.first_name LIKE ? OR s.father_name LIKE ? OR s.family_name LIKE ? OR CAST(s.code AS TEXT) LIKE ?)")
-                            params += [val, val, val, val]
+                            student_ids = search_students(
+                                conn, search_val, grade=filter_level["value"], group_id=filter_group["value"]
+                            )
+                        if not student_ids:
+                            return []
+                        where.append(f"s.id IN ({','.join('?' * len(student_ids))})")
+                        params += student_ids
+                    else:
+                        if filter_level["value"]:
+                            where.append("s.grade = ?")
+                            params.append(filter_level["value"])
+
+                        if filter_group["value"]:
+                            where.append("s.group_id = ?")
+                            params.append(filter_group["value"])
 
                     if where:
                         query += " WHERE " + " AND ".join(where)
 
                     query += " ORDER BY s.first_name, s.father_name, s.family_name"
                     c.execute(query, params)
-                    students = c.fetchall()
-                    result = []
-                    for s in students:
-                        student_id, code, first_name, father_name, family_name, barcode_path = s
-                        full_name = f"{first_name} {father_name} {family_name}"
-                        result.append({
-                            "id": student_id,
-                            "code": code,
-                            "name": full_name,
-                            "barcode_path": barcode_path
-                        })
+                    result = [
+                        {"id": student_id, "code": code, "name": full_name, "barcode_path": barcode_path}
+                        for student_id, code, full_name, barcode_path in c.fetchall()
+                    ]
+                    if student_ids is not None:
+                        result = order_by_ids(result, student_ids)
                     return result
             except Exception as e:
                 show_error_dialog(page, f"خطأ في جلب الطلاب: {e}")
@@ -125,8 +124,7 @@ def barcode_page(page):
                     if fp_event.path:
                         try:
                             c = canvas.Canvas(fp_event.path, pagesize=A4)
-                            c.setFont("Helvetica-Bold", 14)
-                            c.drawImage(barcode_path, 150, 600, width=300, height=120)
+                            draw_student_barcode(c, student["code"], student_name, 150, 600, 300, 120)
                             c.save()
                             show_success_dialog(page, f"تم حفظ PDF في {fp_event.path}")
                         except Exception as ex:
@@ -194,43 +192,30 @@ def barcode_page(page):
             dlg.open = True
             page.update()
 
+        def render_barcode_cells(idx, s):
+            # الصفوف تُبنى عند اقترابها من منطقة العرض فقط، فالصور المصغرة تُحمل عند الحاجة
+            thumb = get_thumbnail(s["barcode_path"]) if s["barcode_path"] else None
+            if thumb:
+                image_cell = ft.Image(src=thumb, width=120, height=40, fit=ft.ImageFit.CONTAIN)
+            elif s["barcode_path"]:
+                image_cell = ft.Text("الملف غير موجود", text_align="center", color="red")
+            else:
+                image_cell = ft.Text("لا يوجد باركود", text_align="center", color="red")
+            return [
+                ft.Text(str(idx + 1), text_align="center", color="#1E3A8A", weight="bold"),
+                ft.Text(str(s["code"]), text_align="center", color="#000000", weight="bold"),
+                ft.TextButton(
+                    text=s["name"],
+                    on_click=lambda e, student=s: show_barcode_dialog(student),
+                    style=ft.ButtonStyle(color="#0059DF"),
+                    tooltip="عرض الباركود"
+                ),
+                image_cell,
+            ]
+
         def refresh_table():
             try:
-                students_data = fetch_students(filter_level, filter_search, filter_group)
-                if not students_data:
-                    student_table.rows = [
-                        ft.DataRow(
-                            cells=[
-                                ft.DataCell(ft.Text("اختر مستوى أو مجموعة أو ابحث لعرض الطلاب", text_align="center", color="red", weight="bold")),
-                                ft.DataCell(ft.Text("")),
-                                ft.DataCell(ft.Text("")),
-                                ft.DataCell(ft.Text(""))
-                            ]
-                        )
-                    ]
-                else:
-                    student_table.rows = [
-                        ft.DataRow(
-                            cells=[
-                                ft.DataCell(ft.Text(str(idx + 1), text_align="center", color="#1E3A8A", weight="bold")),
-                                ft.DataCell(ft.Text(str(s["code"]), text_align="center", color="#000000", weight="bold")),
-                                ft.DataCell(
-                                    ft.TextButton(
-                                        text=s["name"],
-                                        on_click=lambda e, student=s: show_barcode_dialog(student),
-                                        style=ft.ButtonStyle(color="#0059DF"),
-                                        tooltip="عرض الباركود"
-                                    )
-                                ),
-                                ft.DataCell(
-                                    ft.Image(src=s["barcode_path"] if s["barcode_path"] else None, width=120, height=40, fit=ft.ImageFit.CONTAIN)
-                                    if s["barcode_path"] else ft.Text("لا يوجد باركود", text_align="center", color="red")
-                                ),
-                            ]
-                        )
-                        for idx, s in enumerate(students_data)
-                    ]
-                page.update()
+                student_table.set_records(fetch_students(filter_level, filter_search, filter_group))
             except Exception as e:
                 show_error_dialog(page, f"حدث خطأ أثناء جلب الطلاب: {e}")
 
@@ -284,20 +269,18 @@ def barcode_page(page):
             on_change=on_level_change
         )
 
-        student_table = ft.DataTable(
-            expand=True,
-            column_spacing=30,
-            data_row_min_height=50,
-            heading_row_color="#1E3A8A",
-            border=ft.border.all(1, "#1E3A8A"),
-            divider_thickness=1,
+        student_table = VirtualTable(
             columns=[
-                ft.DataColumn(ft.Text("#", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("كود الطالب", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("الاسم الثلاثي", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("الباركود", weight="bold", color="white", text_align="center")),
+                ("#", 60),
+                ("كود الطالب", 110),
+                ("الاسم الثلاثي", 260),
+                ("الباركود", 150),
             ],
-            rows=[],
+            render_cells=render_barcode_cells,
+            page=page,
+            mode=VirtualTable.MODE_WINDOWED,
+            row_height=TABLE_ROW_HEIGHT,
+            empty_text="اختر مستوى أو مجموعة أو ابحث لعرض الطلاب",
         )
 
         return ft.Container(
@@ -334,17 +317,7 @@ def barcode_page(page):
                         border_radius=10,
                         padding=10,
                         border=ft.border.all(1, "#CBD5E1"),
-                        content=ft.Column(
-                            expand=True,
-                            scroll=ft.ScrollMode.ADAPTIVE,
-                            controls=[
-                                ft.Row(
-                                    controls=[student_table],
-                                    scroll=ft.ScrollMode.ADAPTIVE,
-                                    expand=True,
-                                )
-                            ]
-                        )
+                        content=student_table
                     )
                 ],
                 spacing=25,
@@ -358,100 +331,79 @@ def barcode_page(page):
         selected_group = {"value": None}
         students_count_text = ft.Text("", size=16, color="yellow", weight="bold")
 
+        def get_layout_values():
+            num_rows = int(number_of_row.value) if number_of_row.value else 6
+            num_columns = int(number_of_col.value) if number_of_col.value else 3
+            return num_rows, num_columns
+
         def export_pdf_for_group(group_id, group_name):
             try:
-                with sqlite3.connect(students_db_path) as conn:
-                    c = conn.cursor()
-                    c.execute("""
-                        SELECT s.code, s.first_name, s.father_name, s.family_name, s.barcode_path 
-                        FROM students s 
-                        WHERE s.group_id = ? AND s.barcode_path IS NOT NULL
-                        ORDER BY s.first_name, s.father_name, s.family_name
-                    """, (group_id,))
-                    students = c.fetchall()
-
-                    if not students:
-                        show_error_dialog(page, f"لا يوجد طلاب لديهم باركود في المجموعة: {group_name}")
-                        return
-
-                    file_picker = ft.FilePicker()
-                    def on_result(fp_event):
-                        num_rows = int(number_of_row.value) if number_of_row.value else 6
-                        num_columns = int(number_of_col.value) if number_of_col.value else 3
-
-                        if fp_event.path:
-                            try:
-                                cpdf = canvas.Canvas(fp_event.path, pagesize=A4)
-                                page_width, page_height = A4
-
-                                # ---------------- إعدادات التخطيط المحسنة ----------------
-                                margin_x = 40
-                                margin_y = 40
-                                base_barcode_width = 150  # العرض الأساسي
-                                base_col_gap = 30  # مسافة أصغر لتوفير المساحة
-                                barcode_height = 80
-                                row_gap = 50
-
-                                # حساب العرض المتاح وتعديل barcode_width ديناميكيًا
-                                available_width = page_width - 2 * margin_x
-                                required_width = num_columns * base_barcode_width + (num_columns - 1) * base_col_gap
-                                if required_width > available_width:
-                                    # تقليل العرض ليتناسب
-                                    barcode_width = max(80, (available_width - (num_columns - 1) * base_col_gap) / num_columns)
-                                    col_gap = base_col_gap
-                                    print(f"تم تعديل العرض: {barcode_width:.1f} (لـ {num_columns} أعمدة)")  # للاختبار، أزل بعد
-                                else:
-                                    barcode_width = base_barcode_width
-                                    col_gap = base_col_gap
-
-                                x_positions = [margin_x + col * (barcode_width + col_gap) for col in range(num_columns)]
-                                y_start = page_height - margin_y - barcode_height
-                                row_height = barcode_height + row_gap
-                                row_count = 0
-
-                                print(f"عدد الأعمدة: {num_columns}, مواقع X: {x_positions}")  # للاختبار، أزل بعد
-
-                                # ---------------- إدراج الباركودات ----------------
-                                for idx, (code, fn, father, family, barcode_path) in enumerate(students):
-                                    if os.path.exists(barcode_path):
-                                        # رسم الباركود num_columns مرات (تكرار لكل طالب)
-                                        for col in range(num_columns):
-                                            x = x_positions[col]
-                                            y = y_start - (row_count * row_height)
-                                            cpdf.drawImage(barcode_path, x, y, width=barcode_width, height=barcode_height)
-                                            print(f"رسم باركود طالب {code} في العمود {col}: x={x:.1f}, y={y:.1f}")  # للاختبار
-
-                                    # الانتقال إلى الصف التالي بعد كل طالب
-                                    row_count += 1
-
-                                    # صفحة جديدة إذا وصلنا num_rows
-                                    if row_count == num_rows:
-                                        cpdf.showPage()
-                                        row_count = 0
-
-                                cpdf.save()
-                                show_success_dialog(page, f"تم تصدير باركودات {len(students)} طالب إلى PDF (مع {num_columns} تكرارات لكل طالب)")
-                            except Exception as ex:
-                                show_error_dialog(page, f"خطأ أثناء إنشاء PDF: {ex}")
-                    file_picker.on_result = on_result
-                    page.overlay.append(file_picker)
-                    page.update()
-                    file_picker.save_file(
-                        dialog_title="اختر مكان حفظ ملف PDF",
-                        file_name=f"group_{group_name}_barcodes.pdf",
-                        allowed_extensions=["pdf"]
-                    )
+                group = fetch_group_students([group_id]).get(int(group_id))
+                if not group:
+                    show_error_dialog(page, f"لا يوجد طلاب لديهم كود في المجموعة: {group_name}")
+                    return
+                students = group["students"]
+
+                file_picker = ft.FilePicker()
+                def on_result(fp_event):
+                    num_rows, num_columns = get_layout_values()
+
+                    if fp_event.path:
+                        try:
+                            write_group_pdf(fp_event.path, students, num_rows, num_columns)
+                            show_success_dialog(page, f"تم تصدير باركودات {len(students)} طالب إلى PDF (مع {num_columns} تكرارات لكل طالب)")
+                        except Exception as ex:
+                            show_error_dialog(page, f"خطأ أثناء إنشاء PDF: {ex}")
+                file_picker.on_result = on_result
+                page.overlay.append(file_picker)
+                page.update()
+                file_picker.save_file(
+                    dialog_title="اختر مكان حفظ ملف PDF",
+                    file_name=f"group_{group_name}_barcodes.pdf",
+                    allowed_extensions=["pdf"]
+                )
             except Exception as e:
                 show_error_dialog(page, f"خطأ أثناء التصدير: {e}")
 
+        def export_all_groups_pdf(e):
+            file_picker = ft.FilePicker()
+            def on_result(fp_event):
+                if not fp_event.path:
+                    return
+                num_rows, num_columns = get_layout_values()
+                merged_path = os.path.join(fp_event.path, "all_groups_barcodes.pdf") if merge_files.value else None
+                export_all_btn.disabled = True
+                page.update()
+
+                def run():
+                    try:
+                        paths = export_all_groups(fp_event.path, num_rows, num_columns, merged_path)
+                        if paths:
+                            show_success_dialog(page, f"تم تصدير {len(paths)} ملف PDF إلى {fp_event.path}")
+                        else:
+                            show_error_dialog(page, "لا يوجد طلاب لديهم كود في أي مجموعة")
+                    except Exception as ex:
+                        show_error_dialog(page, f"خطأ أثناء التصدير: {ex}")
+                    finally:
+                        export_all_btn.disabled = False
+                        page.update()
+
+                # كل مجموعة تُرسم في عملية منفصلة، والخيط يبقي الواجهة متجاوبة
+                threading.Thread(target=run, daemon=True).start()
+            file_picker.on_result = on_result
+            page.overlay.append(file_picker)
+            page.update()
+            file_picker.get_directory_path(dialog_title="اختر مجلد حفظ ملفات PDF")
+
         def on_group_change(e):
             try:
                 selected_group["value"] = std_group.value
                 if std_group.value:
-                    with sqlite3.connect(students_db_path) as conn:
+                    with get_connection() as conn:
                         c = conn.cursor()
-                        c.execute("SELECT COUNT(*) FROM students WHERE group_id = ?", (std_group.value,))
-                        count = c.fetchone()[0]
+                        c.execute("SELECT students_count FROM groups WHERE id = ?", (std_group.value,))
+                        row = c.fetchone()
+                        count = row[0] if row else 0
                         students_count_text.value = f"عدد طلاب المجموعة: {count}"
                 else:
                     students_count_text.value = ""
@@ -479,6 +431,16 @@ def barcode_page(page):
             )
         )
 
+        merge_files = ft.Checkbox(label="دمج كل المجموعات في ملف واحد", value=False)
+
+        export_all_btn = ft.ElevatedButton(
+            "تصدير باركودات كل المجموعات",
+            icon=ft.Icons.LIBRARY_BOOKS,
+            bgcolor="#0059DF",
+            color="white",
+            on_click=export_all_groups_pdf
+        )
+
         number_of_col = ft.Dropdown(
             label="عدد مرات تكرار الباركود لكل طالب",
             hint_text="اختر عدد التكرارات",
@@ -506,7 +468,10 @@ def barcode_page(page):
                     std_group,
                     students_count_text,
                     ft.Row([number_of_row, number_of_col]),
-                    export_btn
+                    export_btn,
+                    ft.Divider(height=20, color="white"),
+                    merge_files,
+                    export_all_btn
                 ],
                 spacing=20,
                 horizontal_alignment=ft.CrossAxisAlignment.CENTER,
@@ -516,105 +481,30 @@ def barcode_page(page):
 
     def generate_and_save_student_barcodes(page):
         barcodes_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'assets', 'barcodes'))
-        os.makedirs(barcodes_dir, exist_ok=True)
-
-        writer = ImageWriter()
-        writer.set_options({
-            "module_width": 0.35,
-            "module_height": 20.0,
-            "font_size": 12,
-            "text_distance": 2,
-            "quiet_zone": 1.0,
-            "write_text": True,
-        })
-
-        try:
-            with sqlite3.connect(students_db_path) as conn:
-                c = conn.cursor()
-                c.execute('SELECT id, code, first_name, father_name, family_name, barcode_path FROM students WHERE code IS NOT NULL')
-                students = c.fetchall()
-                generated_count = 0
-
-                for student_id, code, first_name, father_name, family_name, barcode_path in students:
-                    file_missing = True
-                    if barcode_path and os.path.exists(barcode_path):
-                        file_missing = False
-
-                    if not code or not file_missing:
-                        continue
-
-                    try:
-                        student_name = f"{first_name} {father_name} {family_name}"
-                        padded_code = str(code).zfill(4)
-                        barcode_value = padded_code.rjust(12, "0")
-
-                        EAN = barcode.get_barcode_class('ean13')
-                        my_code = EAN(barcode_value, writer=writer)
-                        barcode_file_path = os.path.join(barcodes_dir, str(code))
-                        my_code.save(barcode_file_path)
-                        barcode_path_in_db = barcode_file_path + ".png"
+        update_side_content(ft.Container(content=ft.Text("جاري إنشاء الباركودات...", size=20, color="white")))
 
-                        img = Image.open(barcode_path_in_db).convert("RGB")
-                        img_width, img_height = img.size
-
-                        try:
-                            reshaped = arabic_reshaper.reshape(student_name)
-                            bidi_text = get_display(reshaped)
-                        except Exception:
-                            bidi_text = student_name
-
-                        font_size = 22
-                        font_paths = [
-                            "Amiri-Bold.ttf",
-                            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-                            "arialbd.ttf",
-                            "NotoNaskhArabic-Bold.ttf",
-                        ]
-                        font = None
-                        for p in font_paths:
-                            try:
-                                font = ImageFont.truetype(p, font_size)
-                                break
-                            except:
-                                continue
-
-                        if font is None:
-                            font = ImageFont.load_default()
-
-                        draw = ImageDraw.Draw(img)
-                        bbox = draw.textbbox((0, 0), bidi_text, font=font)
-                        text_width = bbox[2] - bbox[0]
-                        text_height = bbox[3] - bbox[1]
-
-                        extra = font_size + 20
-                        new_height = img_height + extra
-                        new_img = Image.new("RGB", (img_width, new_height), "white")
-                        draw_new = ImageDraw.Draw(new_img)
-
-                        x = max(3, (img_width - text_width) / 2)
-                        y = 10
-                        draw_new.text((x, y), bidi_text, font=font, fill="black")
-                        new_img.paste(img, (0, text_height + 20))
-                        new_img.save(barcode_path_in_db)
-
-                        c.execute('UPDATE students SET barcode_path = ? WHERE id = ?', (barcode_path_in_db, student_id))
-                        generated_count += 1
-
-                    except Exception as e:
-                        show_error_dialog(page, f"خطأ في إنشاء الباركود للطالب {code}: {e}")
-
-                try:
-                    conn.commit()
-                    if generated_count > 0:
-                        show_success_dialog(page, f"تم إنشاء {generated_count} باركود بنجاح")
-                        update_side_content(ft.Container(content=ft.Text(f"تم إنشاء {generated_count} باركود بنجاح", size=20, color="white")))
-                    else:
-                        show_success_dialog(page, "جميع الباركودات موجودة بالفعل")
-                        update_side_content(ft.Container(content=ft.Text("جميع الباركودات موجودة بالفعل", size=20, color="white")))
-                except Exception as e:
-                    show_error_dialog(page, f"خطأ في حفظ البيانات: {e}")
-        except Exception as e:
-            show_error_dialog(page, f"خطأ في الوصول لقاعدة البيانات: {e}")
+        def run():
+            try:
+                stats = sync_barcodes(barcodes_dir)
+            except Exception as e:
+                show_error_dialog(page, f"خطأ في الوصول لقاعدة البيانات: {e}")
+                return
+
+            for error in stats["errors"][:5]:
+                show_error_dialog(page, f"خطأ في إنشاء الباركود للطالب {error}")
+
+            generated_count = stats["generated"]
+            if generated_count > 0:
+                message = f"تم إنشاء {generated_count} باركود بنجاح"
+            else:
+                message = "جميع الباركودات موجودة بالفعل"
+            if stats["removed"]:
+                message += f"\nتم حذف {stats['removed']} باركود قديم"
+            show_success_dialog(page, message)
+            update_side_content(ft.Container(content=ft.Text(message, size=20, color="white")))
+
+        # الرسم يتم في عمليات منفصلة، والخيط يبقي الواجهة متجاوبة حتى الانتهاء
+        threading.Thread(target=run, daemon=True).start()
 
     return ft.Row(
         controls=[
@@ -3,8 +3,10 @@ import flet as ft
 import sqlite3
 
 # استيراد من الوحدات الأخرى في المشروع
-from utils.database import students_db_path
+from utils.database import students_db_path, get_connection, cached_fetchall
 from utils.helpers import show_error_dialog, show_success_dialog, search_bar, get_groups
+from utils.roster import fetch_group_details
+from utils.lookups import LookupCache, STAGES
 
 def group_page(page):
     # حاوية العرض الجانبية
@@ -41,7 +43,7 @@ def group_page(page):
         group_stage = ft.Dropdown(
             label="مرحلة المجموعة",
             hint_text="اختر المرحلة",
-            options=[ft.dropdown.Option(s) for s in ["ابتدائي", "إعدادي", "ثانوي"]],
+            options=[ft.dropdown.Option(s) for s in STAGES],
             text_align=ft.TextAlign.RIGHT,
             expand=True
         )
@@ -51,7 +53,7 @@ def group_page(page):
                 show_error_dialog(page, "يرجى ملء جميع الحقول")
                 return
             days = f"{group_day_1.value} و {group_day_2.value}"
-            with sqlite3.connect(students_db_path) as conn:
+            with get_connection() as conn:
                 c = conn.cursor()
                 c.execute('SELECT COUNT(*) FROM groups WHERE name=?', (group_name.value.strip(),))
                 if c.fetchone()[0] > 0:
@@ -155,13 +157,13 @@ def group_page(page):
         group_stage = ft.Dropdown(
             label="مرحلة المجموعة",
             hint_text="اختر المرحلة",
-            options=[ft.dropdown.Option(s) for s in ["ابتدائي", "إعدادي", "ثانوي"]],
+            options=[ft.dropdown.Option(s) for s in STAGES],
             text_align=ft.TextAlign.RIGHT,
             expand=True
         )
 
         def search_group(name):
-            with sqlite3.connect(students_db_path) as conn:
+            with get_connection() as conn:
                 c = conn.cursor()
                 c.execute('SELECT id, name, days, stage FROM groups WHERE name = ?', (name.strip(),))
                 return c.fetchone()
@@ -190,7 +192,7 @@ def group_page(page):
                 show_error_dialog(e.page, "يرجى ملء جميع الحقول")
                 return
             days = f"{group_day_1.value} و {group_day_2.value}"
-            with sqlite3.connect(students_db_path) as conn:
+            with get_connection() as conn:
                 c = conn.cursor()
                 group_id = getattr(group_name, 'group_id', None)
                 c.execute('SELECT COUNT(*) FROM groups WHERE name=? AND id<>?', (group_name.value.strip(), group_id))
@@ -211,19 +213,13 @@ def group_page(page):
                     show_error_dialog(e.page, f"خطأ: {ex}")
 
         def on_delete_click(e):
-            with sqlite3.connect(students_db_path) as conn:
+            with get_connection() as conn:
                 c = conn.cursor()
                 c.execute('SELECT id FROM groups WHERE name=?', (group_name.value.strip(),))
                 group_row = c.fetchone()
                 if group_row:
                     group_id = group_row[0]
-                    c.execute('SELECT id FROM students WHERE group_id=?', (group_id,))
-                    students = c.fetchall()
-                    for s in students:
-                        c.execute('DELETE FROM payments WHERE student_id=?', (s[0],))
-                        c.execute('DELETE FROM attendance WHERE student_id=?', (s[0],))
-                        c.execute('DELETE FROM exams WHERE student_id=?', (s[0],))
-                    c.execute('DELETE FROM students WHERE group_id=?', (group_id,))
+                    # الطلاب وحضورهم واختباراتهم ومدفوعاتهم تُحذف تلقائياً (ON DELETE CASCADE)
                     c.execute('DELETE FROM groups WHERE id=?', (group_id,))
                     conn.commit()
                     show_success_dialog(e.page, "تم حذف المجموعة وجميع بيانات الطلاب المرتبطين بها")
@@ -311,11 +307,8 @@ def group_page(page):
         def on_edit_click(e):
             student_id = e.control.data["id"]
             student_name = e.control.data["name"]
-            # جلب كل المجموعات
-            with sqlite3.connect(students_db_path) as conn:
-                c = conn.cursor()
-                c.execute('SELECT id, name FROM groups')
-                all_groups = c.fetchall()
+            # كل المجموعات من الذاكرة
+            all_groups = LookupCache().groups()
             group_dropdown = ft.Dropdown(
                 label="المجموعة الجديدة",
                 hint_text="اختر مجموعة جديدة",
@@ -323,12 +316,9 @@ def group_page(page):
                 expand=True
             )
             def on_delete_student(ev):
-                with sqlite3.connect(students_db_path) as conn:
+                with get_connection() as conn:
                     c = conn.cursor()
-                    # حذف الطالب وبياناته المرتبطة
-                    c.execute('DELETE FROM payments WHERE student_id=?', (student_id,))
-                    c.execute('DELETE FROM attendance WHERE student_id=?', (student_id,))
-                    c.execute('DELETE FROM exams WHERE student_id=?', (student_id,))
+                    # حذف الطالب، وبياناته المرتبطة تُحذف تلقائياً (ON DELETE CASCADE)
                     c.execute('DELETE FROM students WHERE id=?', (student_id,))
                     conn.commit()
                 show_success_dialog(page, "تم حذف الطالب")
@@ -343,7 +333,7 @@ def group_page(page):
                 if str(new_group_id) == str(e.control.data.get("group_id")):
                     show_error_dialog(page, "لا يمكن نقل الطالب لنفس مجموعته الحالية")
                     return
-                with sqlite3.connect(students_db_path) as conn:
+                with get_connection() as conn:
                     c = conn.cursor()
                     c.execute('UPDATE students SET group_id=? WHERE id=?', (new_group_id, student_id))
                     conn.commit()
@@ -383,9 +373,9 @@ def group_page(page):
             return dlg_modal
 
         # جلب بيانات المجموعة وطلابها من قاعدة البيانات
-        with sqlite3.connect(students_db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
-            c.execute('SELECT id, name, days, stage FROM groups WHERE name=?', (name,))
+            c.execute('SELECT id, name, days, stage, students_count FROM groups WHERE name=?', (name,))
             group_row = c.fetchone()
             if not group_row:
                 return ft.Container(
@@ -399,43 +389,12 @@ def group_page(page):
                         ft.Text("المجموعة غير موجودة", size=20, color="white", text_align=ft.TextAlign.CENTER),
                     ], spacing=25, expand=True, alignment=ft.MainAxisAlignment.CENTER, horizontal_alignment=ft.CrossAxisAlignment.CENTER, rtl=True)
                 )
-            group_id, group_name, group_days, group_stage = group_row
-            c.execute('SELECT COUNT(*) FROM students WHERE group_id=?', (group_id,))
-            group_count = c.fetchone()[0]
+            group_id, group_name, group_days, group_stage, group_count = group_row
             group_count_text = f"عدد طلاب المجموعة : {group_count}"
             group_stage_text = f"مرحلة المجموعة : {group_stage}"
             group_days_text = f"أيام المجموعة: {group_days}"
-            # جلب الطلاب
-            c.execute('''SELECT id, first_name, father_name, family_name, phone, guardian_phone, grade FROM students WHERE group_id=?''', (group_id,))
-            students = c.fetchall()
-            students_data = []
-            for s in students:
-                student_id, first_name, father_name, family_name, phone, guardian_phone, grade = s
-                full_name = f"{first_name} {father_name} {family_name}"
-                # جلب حالة الدفع
-                c.execute('SELECT status FROM payments WHERE student_id=? ORDER BY month DESC LIMIT 1', (student_id,))
-                payment_status = c.fetchone()
-                payment_status = payment_status[0] if payment_status else "-"
-                # جلب عدد الاختبارات
-                c.execute('SELECT COUNT(*) FROM exams WHERE student_id=?', (student_id,))
-                tests_count = c.fetchone()[0]
-                # جلب الحضور
-                c.execute('SELECT COUNT(*) FROM attendance WHERE student_id=? AND status="حاضر"', (student_id,))
-                attended = c.fetchone()[0]
-                c.execute('SELECT COUNT(*) FROM attendance WHERE student_id=?', (student_id,))
-                total_att = c.fetchone()[0]
-                attendance = f"{attended}/{total_att}" if total_att else "-"
-                students_data.append({
-                    "id": student_id,
-                    "name": full_name,
-                    "student_phone": phone,
-                    "parent_phone": guardian_phone,
-                    "grade": grade,
-                    "payment_status": payment_status,
-                    "tests_count": tests_count,
-                    "attendance": attendance,
-                    "group_id": group_id
-                })
+            # جلب الطلاب مع الدفع والاختبارات والحضور في استعلام واحد
+            students_data = fetch_group_details(conn, group_id)
 
         if not students_data:
             return ft.Container(
@@ -613,22 +572,21 @@ def group_page(page):
                 on_click=on_card_click
             )
 
-        # جلب المجموعات من قاعدة البيانات
-        def fetch_groups_by_stage(stage):
-            with sqlite3.connect(students_db_path) as conn:
-                c = conn.cursor()
-                c.execute('SELECT id, name FROM groups WHERE stage=?', (stage,))
-                groups = c.fetchall()
-                result = []
-                for group_id, name in groups:
-                    c.execute('SELECT COUNT(*) FROM students WHERE group_id=?', (group_id,))
-                    count = c.fetchone()[0]
-                    result.append((name, count))
-                return result
-
-        primary_groups = fetch_groups_by_stage("ابتدائي")
-        prep_groups = fetch_groups_by_stage("إعدادي")
-        secondary_groups = fetch_groups_by_stage("ثانوي")
+        # جلب كل المجموعات بعدد طلابها (يحدّثه trigger) في استعلام واحد
+        def fetch_groups_by_stage():
+            groups_by_stage = {stage: [] for stage in STAGES}
+            with get_connection() as conn:
+                rows = cached_fetchall(conn, 'SELECT stage, name, students_count FROM groups ORDER BY id',
+                                       tables=("groups", "students"))
+                for stage, name, count in rows:
+                    if stage in groups_by_stage:
+                        groups_by_stage[stage].append((name, count or 0))
+            return groups_by_stage
+
+        groups_by_stage = fetch_groups_by_stage()
+        primary_groups = groups_by_stage["ابتدائي"]
+        prep_groups = groups_by_stage["إعدادي"]
+        secondary_groups = groups_by_stage["ثانوي"]
 
         def make_col(title, groups):
             return ft.Column([
@@ -1,18 +1,23 @@
 import flet as ft
 import sqlite3
 from datetime import datetime
-from functools import partial
+from functools import partial, lru_cache
 import uuid
 
 import logging
 
 # استيراد من الوحدات الأخرى
-from utils.database import students_db_path
+from utils.database import students_db_path, get_connection
 from utils.helpers import show_error_dialog, show_success_dialog, search_bar, get_groups,show_skipped_students_dialog,send_telegrem_messege
 from utils.whatsapp_manager import send_whatsapp_message, check_internet
 from utils.connection_manager import ConnectionManager
 from utils.telegram_bot import generate_activation_link,send_telegram_message
 from utils.activation_messages import get_activation_message, get_student_welcome_message, get_guardian_welcome_message
+from utils.date_utils import to_display_date, parse_date, DISPLAY_DATE_FORMAT, WEEKDAYS_AR
+from utils.broadcast import BroadcastJob
+from components.virtual_table import VirtualTable
+from utils.student_search import search_students, order_by_ids
+from utils.scan_lookup import looks_like_barcode, resolve_scan
 
 # ====== وظائف إدارة قوالب الرسائل ======
 def get_exams_message(exams, student_type, n=None):
@@ -104,47 +109,42 @@ def fetch_students(filter_group=None, filter_search=""):
     if not filter_group and not filter_search:
         return []
     
-    from utils.helpers import extract_unique_code
-    with sqlite3.connect(students_db_path) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
-        query = '''SELECT s.id, s.first_name, s.father_name, s.family_name, s.phone, s.guardian_phone, s.gender, g.name as group_name, s.group_id, s.code
-                    FROM students s LEFT JOIN groups g ON s.group_id = g.id'''
-        params = []
+        # حالة دفع الشهر الحالي بـ LEFT JOIN بدلاً من استعلام لكل طالب
+        query = '''SELECT s.id, s.full_name, s.phone, s.guardian_phone, s.gender,
+                          g.name as group_name, s.group_id, s.code, p.status
+                    FROM students s
+                    LEFT JOIN groups g ON s.group_id = g.id
+                    LEFT JOIN payments p ON p.student_id = s.id AND p.month = ?'''
+        params = [datetime.now().strftime("%Y-%m")]
         where = []
+        student_ids = None
         
-        if filter_group:
+        search_val = filter_search.strip() if filter_search else ""
+        if search_val:
+            # الباركود الممسوح يُطابق بالكود من الذاكرة، وغيره بحث مرتب بالأقرب عبر فهرس FTS
+            if looks_like_barcode(search_val):
+                student = resolve_scan(search_val)
+                student_ids = [student["id"]] if student else []
+            else:
+                student_ids = search_students(conn, search_val, group_id=filter_group)
+            if not student_ids:
+                return []
+            where.append(f"s.id IN ({','.join('?' * len(student_ids))})")
+            params += student_ids
+        elif filter_group:
             where.append("s.group_id = ?")
             params.append(filter_group)
-        
-        search_val = filter_search
-        code_val = extract_unique_code(search_val) if search_val else ""
-        if search_val:
-            where.append("(s.first_name LIKE ? OR s.father_name LIKE ? OR s.family_name LIKE ? OR s.code LIKE ?)")
-            val = f"%{search_val}%"
-            code_like = f"%{code_val}%"
-            params += [val, val, val, code_like]
             
         if where:
             query += " WHERE " + " AND ".join(where)
         query += " ORDER BY s.first_name, s.father_name, s.family_name"
         
         c.execute(query, params)
-        students = c.fetchall()
         result = []
-        
-        from datetime import datetime
-        now = datetime.now()
-        month_str = now.strftime("%Y-%m")
-        
-        for s in students:
-            student_id, first_name, father_name, family_name, phone, guardian_phone, gender, group_name, group_id, code = s
-            full_name = f"{first_name} {father_name} {family_name}"
-            
-            c.execute('SELECT status FROM payments WHERE student_id=? AND strftime("%Y-%m", month)=? ORDER BY month DESC LIMIT 1', 
-                     (student_id, month_str))
-            payment_status = c.fetchone()
-            payment_status = payment_status[0] if payment_status else "-"
-            
+        for s in c.fetchall():
+            student_id, full_name, phone, guardian_phone, gender, group_name, group_id, code, payment_status = s
             result.append({
                 "id": student_id,
                 "name": full_name,
@@ -152,20 +152,23 @@ def fetch_students(filter_group=None, filter_search=""):
                 "parent_phone": guardian_phone,
                 "gender": gender or "-",
                 "group": group_name or "-",
-                "payment_status": payment_status,
+                "payment_status": payment_status or "-",
                 "code": code,
             })
             
+        if student_ids is not None:
+            result = order_by_ids(result, student_ids)
         return result
 
-def get_student_data(student_name):
-    """استرجاع كافة بيانات الطالب المطلوبة للتقارير"""
-    # استخراج الاسم الثلاثي
-    name_parts = student_name.strip().split()
-    first, father, family = name_parts[0], name_parts[1] if len(name_parts) > 1 else '', name_parts[2] if len(name_parts) > 2 else ''
-    
-    student_data = {
-        "name": student_name,
+def get_student_data(student_id):
+    """استرجاع كافة بيانات الطالب المطلوبة للتقارير بمعرفه (المفتاح الأساسي)"""
+    student_data = load_report_data([student_id]).get(student_id)
+    if student_data is not None:
+        return student_data
+
+    return {
+        "id": student_id,
+        "name": "",
         "phone": "",
         "parent_phone": "",
         "gender": "---",
@@ -177,63 +180,117 @@ def get_student_data(student_name):
         "chat_id": None,  # معرف محادثة الطالب في تيليجرام
         "guardian_chat_id": None  # معرف محادثة ولي الأمر في تيليجرام
     }
-    
+
+@lru_cache(maxsize=4096)
+def attendance_day(date_str):
+    """
+    (تاريخ العرض، اسم اليوم) لتاريخ حضور مخزن، أو None إذا لم يكن تاريخاً صالحاً.
+    عدد تواريخ الحصص صغير ومتكرر بين الطلاب لذلك تُحسب مرة واحدة لكل تاريخ.
+    """
+    parsed_date = parse_date(date_str)
+    if parsed_date is None:
+        return None
+    return parsed_date.strftime(DISPLAY_DATE_FORMAT), WEEKDAYS_AR[parsed_date.weekday()]
+
+def _chunks(items, size=500):
+    """تقسيم قائمة المعرفات لتبقى ضمن حد متغيرات SQLite"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def load_report_data(student_ids):
+    """
+    استرجاع بيانات التقارير لمجموعة طلاب دفعة واحدة بدلاً من get_student_data لكل طالب.
+    يرجع قاموساً {student_id: student_data} بنفس مفاتيح get_student_data.
+    """
+    student_ids = list(student_ids)
+    data = {}
+    if not student_ids:
+        return data
+
     try:
-        with sqlite3.connect(students_db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
-            # استرجاع البيانات الأساسية
-            c.execute("""
-                SELECT s.id, s.phone, s.guardian_phone, s.gender, s.code,
-                       s.chat_id as student_chat_id,
-                       s.guardian_chat_id as guardian_chat_id
-                FROM students s
-                WHERE s.first_name=? AND s.father_name=? AND s.family_name=?
-            """, (first, father, family))
-            
-            row = c.fetchone()
-            if row:
-                student_id, phone, parent_phone, gender, code, student_chat_id, guardian_chat_id = row
-                student_data.update({
-                    "phone": phone,
-                    "parent_phone": parent_phone,
-                    "gender": gender,
-                    "type": "الطالب" if gender == "ذكر" else "الطالبة" if gender == "انثى" else "الطالب/ة",
-                    "code": str(code) if code else None,
-                    "chat_id": str(student_chat_id) if student_chat_id else None,
-                    "guardian_chat_id": str(guardian_chat_id) if guardian_chat_id else None
-                })
-                
-                # استرجاع بيانات الاختبارات
-                c.execute("SELECT exam_date, total_score, student_score FROM exams WHERE student_id=? ORDER BY exam_date", (student_id,))
-                student_data["exams"] = [list(map(str, r)) for r in c.fetchall()]
-                
-                # استرجاع بيانات الحضور
-                c.execute("SELECT attendance_date, status FROM attendance WHERE student_id=? ORDER BY attendance_date", (student_id,))
-                att_rows = c.fetchall()
-                attendance = []
-                for att in att_rows:
-                    date_str, status = att
-                    try:
-                        day_name = datetime.strptime(date_str, "%Y-%m-%d").strftime("%A")
-                        days_ar = {
-                            "Monday": "الاثنين", "Tuesday": "الثلاثاء", "Wednesday": "الأربعاء",
-                            "Thursday": "الخميس", "Friday": "الجمعة", "Saturday": "السبت", "Sunday": "الأحد"
-                        }
-                        day_ar = days_ar.get(day_name, day_name)
-                        attendance.append([date_str, day_ar, status])
-                    except ValueError:
-                        attendance.append([date_str, "تاريخ غير صالح", status])
-                
-                student_data["attendance"] = attendance
-                
-                # استرجاع بيانات المدفوعات
-                c.execute("SELECT month, status FROM payments WHERE student_id=? ORDER BY month", (student_id,))
-                student_data["payments"] = [list(r) for r in c.fetchall()]
-                
+            for ids in _chunks(student_ids):
+                placeholders = ",".join("?" * len(ids))
+
+                c.execute(f"""
+                    SELECT id, full_name, phone, guardian_phone,
+                           gender, code, chat_id, guardian_chat_id
+                    FROM students WHERE id IN ({placeholders})
+                """, ids)
+                for (student_id, full_name, phone, parent_phone,
+                     gender, code, student_chat_id, guardian_chat_id) in c.fetchall():
+                    data[student_id] = {
+                        "id": student_id,
+                        "name": full_name,
+                        "phone": phone,
+                        "parent_phone": parent_phone,
+                        "gender": gender,
+                        "type": "الطالب" if gender == "ذكر" else "الطالبة" if gender == "انثى" else "الطالب/ة",
+                        "exams": [],
+                        "attendance": [],
+                        "payments": [],
+                        "code": str(code) if code else None,
+                        "chat_id": str(student_chat_id) if student_chat_id else None,
+                        "guardian_chat_id": str(guardian_chat_id) if guardian_chat_id else None
+                    }
+
+                c.execute(f"""
+                    SELECT student_id, exam_date, total_score, student_score FROM exams
+                    WHERE student_id IN ({placeholders}) ORDER BY student_id, exam_date
+                """, ids)
+                for student_id, exam_date, total_score, student_score in c.fetchall():
+                    if student_id in data:
+                        data[student_id]["exams"].append([to_display_date(exam_date), str(total_score), str(student_score)])
+
+                c.execute(f"""
+                    SELECT student_id, attendance_date, status FROM attendance
+                    WHERE student_id IN ({placeholders}) ORDER BY student_id, attendance_date
+                """, ids)
+                for student_id, date_str, status in c.fetchall():
+                    if student_id not in data:
+                        continue
+                    day = attendance_day(date_str)
+                    if day is None:
+                        data[student_id]["attendance"].append([date_str, "تاريخ غير صالح", status])
+                    else:
+                        data[student_id]["attendance"].append([day[0], day[1], status])
+
+                c.execute(f"""
+                    SELECT student_id, month, status FROM payments
+                    WHERE student_id IN ({placeholders}) ORDER BY student_id, month
+                """, ids)
+                for student_id, month, status in c.fetchall():
+                    if student_id in data:
+                        data[student_id]["payments"].append([month, status])
+
     except sqlite3.Error as e:
         print(f"خطأ في الاتصال بقاعدة البيانات: {e}")
-        
-    return student_data
+
+    return data
+
+def render_report(student_data, what_value, to_value, teacher_name, custom_msg="",
+                  exams_num=None, attends_num=None, payments_num=None):
+    """بناء نص التقرير المطلوب لطالب واحد، يرجع None إذا لم يكن هناك قالب صالح"""
+    student_name = student_data["name"]
+    if what_value == "رسالة مخصصة":
+        if not custom_msg.strip():
+            return None
+        return create_custom_report(
+            custom_msg, student_name, student_data["type"], teacher_name,
+            student_data["exams"], student_data["attendance"], student_data["payments"],
+            to_value, exams_num, attends_num, payments_num
+        )
+    if what_value == "تقرير كامل":
+        return create_monthly_report(
+            student_name, student_data["type"], student_data["exams"], student_data["attendance"],
+            student_data["payments"], teacher_name, to_value, exams_num, attends_num, payments_num
+        )
+    if what_value == "تقرير الحضور":
+        return create_attendance_report(student_name, student_data["attendance"], teacher_name, to_value, attends_num)
+    if what_value == "تقرير الاختبارات":
+        return create_exams_report(student_name, student_data["type"], student_data["exams"], teacher_name, to_value, exams_num)
+    return None
 
 # ====== وظائف إرسال الرسائل ======
 def send_whatsapp_messege(student_data, message, to_value="ولي الأمر", page=None):
@@ -453,66 +510,43 @@ def send_mails_page(page: ft.Page):
 
         def on_name_click(e, student):
             """معالجة النقر على اسم الطالب"""
-            update_side_content(send_to_student_container(student["name"]))
+            update_side_content(send_to_student_container(student["id"]))
+
+        def render_student_cells(idx, s):
+            return [
+                ft.Text(str(idx+1), text_align="center", color="#1E3A8A", weight="bold"),
+                ft.TextButton(
+                    text=s["name"],
+                    on_click=lambda e, student=s: on_name_click(e, student),
+                    style=ft.ButtonStyle(color="#0077CC"),
+                    tooltip="تمرير"
+                ),
+                ft.TextButton(
+                    text=s["student_phone"] or "-",
+                    url=f"https://wa.me/{s['student_phone'].replace('+', '')}" if s["student_phone"] else None,
+                    style=ft.ButtonStyle(color="#25D366"),
+                    tooltip="تواصل واتساب مع الطالب",
+                    disabled=not s["student_phone"]
+                ),
+                ft.TextButton(
+                    text=s["parent_phone"] or "-",
+                    url=f"https://wa.me/{s['parent_phone'].replace('+', '')}" if s["parent_phone"] else None,
+                    style=ft.ButtonStyle(color="#0D6EFD"),
+                    tooltip="تواصل واتساب مع ولي الأمر",
+                    disabled=not s["parent_phone"]
+                ),
+                ft.Text(s["gender"], text_align="center", color="#000000"),
+                ft.Text(s["group"], text_align="center", color="#000000"),
+                ft.Text(s["payment_status"], text_align="center", color="green" if s["payment_status"]=="دفع" else "red", weight="bold"),
+            ]
 
         def refresh_table():
             """تحديث جدول الطلاب"""
-            nonlocal student_table
-            students_data = fetch_students(filter_group["value"], filter_search["value"])
-            if not students_data:
-                student_table.rows = [
-                    ft.DataRow(
-                        cells=[
-                            ft.DataCell(ft.Text('لا يوجد طلاب لعرضهم', text_align='center', color='red', weight='bold'))
-                        ] + [ft.DataCell(ft.Text(''))]*6)
-                ]
-            else:
-                student_table.rows = [
-                    ft.DataRow(
-                        cells=[
-                            ft.DataCell(ft.Text(str(idx+1), text_align="center", color="#1E3A8A", weight="bold")),
-                            ft.DataCell(
-                                ft.TextButton(
-                                    text=s["name"],
-                                    on_click=lambda e, student=s: on_name_click(e, student),
-                                    style=ft.ButtonStyle(color="#0077CC"),
-                                    tooltip="تمرير"
-                                )
-                            ),
-                            ft.DataCell(
-                                ft.TextButton(
-                                    text=s["student_phone"] or "-",
-                                    url=f"https://wa.me/{s['student_phone'].replace('+', '')}" if s["student_phone"] else None,
-                                    style=ft.ButtonStyle(color="#25D366"),
-                                    tooltip="تواصل واتساب مع الطالب",
-                                    disabled=not s["student_phone"]
-                                )
-                            ),
-                            ft.DataCell(
-                                ft.TextButton(
-                                    text=s["parent_phone"] or "-",
-                                    url=f"https://wa.me/{s['parent_phone'].replace('+', '')}" if s["parent_phone"] else None,
-                                    style=ft.ButtonStyle(color="#0D6EFD"),
-                                    tooltip="تواصل واتساب مع ولي الأمر",
-                                    disabled=not s["parent_phone"]
-                                )
-                            ),
-                            ft.DataCell(ft.Text(s["gender"], text_align="center", color="#000000")),
-                            ft.DataCell(ft.Text(s["group"], text_align="center", color="#000000")),
-                            ft.DataCell(ft.Text(s["payment_status"], text_align="center", color="green" if s["payment_status"]=="دفع" else "red", weight="bold")),
-                        ]
-                    )
-                    for idx, s in enumerate(students_data)
-                ]
-            page.update()
+            student_table.set_records(fetch_students(filter_group["value"], filter_search["value"]))
 
         def on_search_submit(e=None):
-            """معالجة البحث عن طالب"""
-            from utils.helpers import extract_unique_code
-            val = e.control.value.strip() if e else ""
-            if val:
-                val = extract_unique_code(val)
-            filter_search["value"] = val
+            """معالجة البحث عن طالب (الباركود الممسوح يُفك داخل fetch_students)"""
+            filter_search["value"] = e.control.value.strip() if e else ""
             refresh_table()
 
         def on_group_change(e):
@@ -528,23 +562,20 @@ def send_mails_page(page: ft.Page):
             on_change=on_group_change
         )
 
-        student_table = ft.DataTable(
-            expand=True,
-            column_spacing=30,
-            data_row_min_height=50,
-            heading_row_color="#1E3A8A",
-            border=ft.border.all(1, "#1E3A8A"),
-            divider_thickness=1,
+        student_table = VirtualTable(
             columns=[
-                ft.DataColumn(ft.Text("#", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("اسم الطالب", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("هاتف الطالب", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("هاتف الأب", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("النوع", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("المجموعة", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("حالة الدفع (الشهر الحالي)", weight="bold", color="white", text_align="center")),
+                ("#", 60),
+                ("اسم الطالب", 240),
+                ("هاتف الطالب", 140),
+                ("هاتف الأب", 140),
+                ("النوع", 80),
+                ("المجموعة", 150),
+                ("حالة الدفع (الشهر الحالي)", 180),
             ],
-            rows=[],
+            render_cells=render_student_cells,
+            page=page,
+            mode=VirtualTable.MODE_WINDOWED,
+            empty_text="لا يوجد طلاب لعرضهم",
         )
 
         return ft.Container(
@@ -585,17 +616,7 @@ def send_mails_page(page: ft.Page):
                         border_radius=10,
                         padding=10,
                         border=ft.border.all(1, "#CBD5E1"),
-                        content=ft.Column(
-                            expand=True,
-                            scroll=ft.ScrollMode.AUTO,
-                            controls=[
-                                ft.Row(
-                                    controls=[student_table],
-                                    scroll=ft.ScrollMode.AUTO,
-                                    expand=True,
-                                )
-                            ]
-                        )
+                        content=student_table
                     ),
                 ],
                 expand=True,
@@ -605,12 +626,13 @@ def send_mails_page(page: ft.Page):
             ),
         )
 
-    def send_to_student_container(student_name):
+    def send_to_student_container(student_id):
         """حاوية نموذج إرسال للطالب المحدد"""
         if not conn_manager.check_connection(show_message=True, page=page):
             return ft.Text("⚠️ لا يوجد اتصال بالإنترنت", color="red")
 
-        student_data = get_student_data(student_name)
+        student_data = get_student_data(student_id)
+        student_name = student_data["name"]
         teacher_name = "مستر / احمد العبادي"
 
         def update_preview(e=None):
@@ -867,7 +889,7 @@ def send_mails_page(page: ft.Page):
         def get_students_count_by_level(grade):
             """عدد الطلاب في الصف"""
             try:
-                with sqlite3.connect(students_db_path) as conn:
+                with get_connection() as conn:
                     c = conn.cursor()
                     c.execute("SELECT COUNT(*) FROM students WHERE grade=?", (grade,))
                     return c.fetchone()[0]
@@ -877,17 +899,18 @@ def send_mails_page(page: ft.Page):
         def get_students_count_by_group(group_id):
             """عدد الطلاب في المجموعة"""
             try:
-                with sqlite3.connect(students_db_path) as conn:
+                with get_connection() as conn:
                     c = conn.cursor()
-                    c.execute("SELECT COUNT(*) FROM students WHERE group_id=?", (group_id,))
-                    return c.fetchone()[0]
+                    c.execute("SELECT students_count FROM groups WHERE id=?", (group_id,))
+                    row = c.fetchone()
+                    return row[0] if row else 0
             except sqlite3.Error:
                 return 0
 
         def get_students_by_level(grade):
             """استرجاع طلاب الصف"""
             try:
-                with sqlite3.connect(students_db_path) as conn:
+                with get_connection() as conn:
                     c = conn.cursor()
                     c.execute("SELECT id, first_name, father_name, family_name FROM students WHERE grade=?", (grade,))
                     return c.fetchall()
@@ -898,7 +921,7 @@ def send_mails_page(page: ft.Page):
         def get_students_by_group(group_id):
             """استرجاع طلاب المجموعة"""
             try:
-                with sqlite3.connect(students_db_path) as conn:
+                with get_connection() as conn:
                     c = conn.cursor()
                     c.execute("SELECT id, first_name, father_name, family_name FROM students WHERE group_id=?", (group_id,))
                     return c.fetchall()
@@ -919,13 +942,13 @@ def send_mails_page(page: ft.Page):
                 number_of_group_students = get_students_count_by_level(selected_level)
                 students = get_students_by_level(selected_level)
                 if students:
-                    sample_student_data = get_student_data(f"{students[0][1]} {students[0][2]} {students[0][3]}")
+                    sample_student_data = get_student_data(students[0][0])
             elif selected_group:
                 title_text.value += f" - المجموعة: {selected_group}"
                 number_of_group_students = get_students_count_by_group(selected_group)
                 students = get_students_by_group(selected_group)
                 if students:
-                    sample_student_data = get_student_data(f"{students[0][1]} {students[0][2]} {students[0][3]}")
+                    sample_student_data = get_student_data(students[0][0])
 
             num_of_std.content.value = f"الطالب: 0 من {number_of_group_students}"
 
@@ -972,8 +995,35 @@ def send_mails_page(page: ft.Page):
             """
             page.update()
 
+        # عملية الإرسال الجماعي الحالية (تعمل في خيط خلفي)
+        broadcast = {"job": None}
+
+        def on_broadcast_progress(result):
+            """تحديث عداد الطلاب، يُستدعى من خيط الإرسال بمعدل محدود"""
+            num_of_std.content.value = f"الطالب: {result.processed} من {result.total} (تم الإرسال: {result.sent})"
+            page.update()
+
+        def on_broadcast_done(result):
+            """إعادة الأزرار لحالتها وعرض النتيجة النهائية"""
+            send_button.disabled = False
+            cancel_button.disabled = True
+            page.update()
+
+            show_skipped_students_dialog(page, result.skipped)
+            print(f" تم إرسال {result.sent} من أصل {result.total} عبر {send_how.value}")
+            if result.cancelled:
+                show_error_dialog(page, f"⏹️ تم إلغاء الإرسال بعد {result.sent} رسالة من أصل {result.total}")
+            elif result.error:
+                show_error_dialog(page, f"⚠️ توقف الإرسال بعد {result.sent} رسالة: {result.error}")
+            else:
+                show_success_dialog(page, f"✅ تم إرسال {result.sent} رسالة من أصل {result.total}")
+
         def on_send_click(e):
             """معالجة إرسال الرسائل الجماعية"""
+            if broadcast["job"] is not None and broadcast["job"].running:
+                show_error_dialog(page, "⚠️ يوجد إرسال جماعي قيد التنفيذ بالفعل.")
+                return
+
             if not conn_manager.check_connection(show_message=True, page=page):
                 return
 
@@ -989,98 +1039,44 @@ def send_mails_page(page: ft.Page):
                 return
 
             what_value = form_controls["send_what"].value or "تقرير كامل"
+            to_value = form_controls["send_to"].value or "ولي الأمر"
+            custom_msg = form_controls["custom_msg"].value or ""
             exams_num = int(form_controls["exams_num"].value) if form_controls["exams_num"].value and form_controls["exams_num"].value.isdigit() else None
             attends_num = int(form_controls["attends_num"].value) if form_controls["attends_num"].value and form_controls["attends_num"].value.isdigit() else None
             payments_num = int(form_controls["payments_num"].value) if form_controls["payments_num"].value and form_controls["payments_num"].value.isdigit() else None
 
+            if what_value == "رسالة مخصصة" and not custom_msg.strip():
+                show_error_dialog(page, "❌ يرجى كتابة رسالة مخصصة.")
+                return
+
             # التحقق من اختيار منصة الإرسال
             send_platform = send_how.value
             if not send_platform:
                 show_error_dialog(page, "⚠️ يرجى اختيار منصة الإرسال (واتساب أو تليجرام)")
                 return
 
-            show_success_dialog(page, "يتم محاولة ارسال الرسائل...")
-            current_student_count = 0
-            skipped_students = []
-
-            for student in students:
-                student_name = f"{student[1]} {student[2]} {student[3]}"
-                student_data = get_student_data(student_name)
-
-                # الحصول على المستلم
-                to_value = form_controls["send_to"].value or "ولي الأمر"
-                is_guardian = to_value == "ولي الأمر"
-
-                # التحقق من وجود بيانات الاتصال المطلوبة
-                if send_platform == "واتساب":
-                    required_phone = student_data["parent_phone"] if is_guardian else student_data["phone"]
-                    if not required_phone:
-                        skipped_students.append(f"{student_name} (لا يوجد رقم هاتف {to_value})")
-                        continue
-                elif send_platform == "تليجرام":
-                    required_chat_id = student_data["guardian_chat_id"] if is_guardian else student_data["chat_id"]
-                    if not required_chat_id:
-                        skipped_students.append(f"{student_name} (لا يوجد معرف تليجرام {to_value})")
-                        continue
-
-                if what_value == "رسالة مخصصة" and not form_controls["custom_msg"].value.strip():
-                    show_error_dialog(page, "❌ يرجى كتابة رسالة مخصصة.")
-                    continue
-                elif what_value == "رسالة مخصصة":
-                    msg = create_custom_report(
-                        form_controls["custom_msg"].value, student_name, student_data["type"], teacher_name,
-                        student_data["exams"], student_data["attendance"], student_data["payments"],
-                        form_controls["send_to"].value, exams_num, attends_num, payments_num
-                    )
-                elif what_value == "تقرير كامل":
-                    msg = create_monthly_report(
-                        student_name, student_data["type"], student_data["exams"], student_data["attendance"],
-                        student_data["payments"], teacher_name, form_controls["send_to"].value, exams_num, attends_num, payments_num
-                    )
-                elif what_value == "تقرير الحضور":
-                    msg = create_attendance_report(student_name, student_data["attendance"], teacher_name, form_controls["send_to"].value, attends_num)
-                elif what_value == "تقرير الاختبارات":
-                    msg = create_exams_report(student_name, student_data["type"], student_data["exams"], teacher_name, form_controls["send_to"].value, exams_num)
-                else:
-                    show_error_dialog(page, "❌ لم يتم اختيار تقرير.")
-                    continue
-
-                # الحصول على المستلم
-                to_value = form_controls["send_to"].value or "ولي الأمر"
+            render = partial(
+                render_report, what_value=what_value, to_value=to_value, teacher_name=teacher_name,
+                custom_msg=custom_msg, exams_num=exams_num, attends_num=attends_num, payments_num=payments_num
+            )
+            job = BroadcastJob(load_report_data, render, on_broadcast_progress, on_broadcast_done)
+            broadcast["job"] = job
 
-                preview_container.content.value = f"""
-                {f"مرحبًا {student_name}" if to_value == "الطالب" else f"مرحبًا ولي أمر الطالب {student_name}"}
+            send_button.disabled = True
+            cancel_button.disabled = False
+            num_of_std.content.value = f"الطالب: 0 من {len(students)}"
+            page.update()
+            show_success_dialog(page, "يتم محاولة ارسال الرسائل...")
 
-                📌 المستلم: {to_value}
-                📌 نوع التقرير: {what_value}
-                📱 منصة الإرسال: {send_platform}
+            job.start([student[0] for student in students], send_platform, to_value)
 
-                ✉️ الرسالة:
-                {msg}
-                """
+        def on_cancel_click(e):
+            """إلغاء الإرسال الجماعي الجاري"""
+            if broadcast["job"] is not None and broadcast["job"].running:
+                broadcast["job"].cancel()
+                cancel_button.disabled = True
                 page.update()
 
-                # إرسال الرسالة حسب المنصة المختارة
-                if send_platform == "واتساب":
-                    success, message = send_whatsapp_messege(student_data, msg, to_value, page)
-                elif send_platform == "تليجرام":
-                    success, message = send_telegrem_messege(student_data, msg, to_value, page)
-
-                if success:
-                    current_student_count += 1
-                    num_of_std.content.value = f"الطالب: {current_student_count} من {len(students)}"
-                    page.update()
-                else:
-                    if "اتصال" in message or "إنترنت" in message:
-                        break
-
-            # بعد حلقة الإرسال
-            show_skipped_students_dialog(page, skipped_students)
-
-            # النتيجة النهائية
-            print(f" تم إرسال {current_student_count} من أصل {len(students)} عبر {send_platform}")
-            show_success_dialog(page, f"✅ تم إرسال {current_student_count} رسالة من أصل {len(students)}")
-
 
         def on_send_activation_click(e):
             if not conn_manager.check_connection(show_message=True, page=page):
@@ -1108,10 +1104,14 @@ def send_mails_page(page: ft.Page):
             total_students = len(students)
             skipped_students = []
 
+            students_data = load_report_data([student[0] for student in students])
             for student in students:
                 student_name = f"{student[1]} {student[2]} {student[3]}"
-                student_data = get_student_data(student_name)
-                
+                student_data = students_data.get(student[0])
+                if student_data is None:
+                    skipped_students.append(f"{student_name} (غير موجود)")
+                    continue
+
                 # إرسال رسالة التفعيل للمستلم المحدد (طالب/ولي أمر)
                 to_value = form_controls["send_to"].value or "ولي الأمر"
                 is_guardian = to_value == "ولي الأمر"
@@ -1231,6 +1231,37 @@ def send_mails_page(page: ft.Page):
             ),
         )
 
+        send_button = ft.ElevatedButton(
+            content=ft.Row(
+                [
+                    ft.Text("ارسال", size=18, weight=ft.FontWeight.BOLD, color="#F5F5F5"),
+                    ft.Icon(ft.Icons.SEND, size=28, color="#07C06A"),
+                ],
+                alignment=ft.MainAxisAlignment.CENTER,
+                spacing=10
+            ),
+            height=50,
+            expand=True,
+            bgcolor="#0059DF",
+            on_click=on_send_click,
+        )
+
+        cancel_button = ft.ElevatedButton(
+            content=ft.Row(
+                [
+                    ft.Text("إيقاف الإرسال", size=18, weight=ft.FontWeight.BOLD, color="#F5F5F5"),
+                    ft.Icon(ft.Icons.STOP_CIRCLE, size=28, color="#FF5252"),
+                ],
+                alignment=ft.MainAxisAlignment.CENTER,
+                spacing=10
+            ),
+            height=50,
+            expand=True,
+            bgcolor="#0059DF",
+            disabled=True,
+            on_click=on_cancel_click,
+        )
+
         update_preview_and_counts()
 
         return ft.Container(
@@ -1284,20 +1315,8 @@ def send_mails_page(page: ft.Page):
                     ),
                     ft.Row(
                         [
-                            ft.ElevatedButton(
-                                content=ft.Row(
-                                    [
-                                        ft.Text("ارسال", size=18, weight=ft.FontWeight.BOLD, color="#F5F5F5"),
-                                        ft.Icon(ft.Icons.SEND, size=28, color="#07C06A"),
-                                    ],
-                                    alignment=ft.MainAxisAlignment.CENTER,
-                                    spacing=10
-                                ),
-                                height=50,
-                                expand=True,
-                                bgcolor="#0059DF",
-                                on_click=on_send_click,
-                            ),
+                            send_button,
+                            cancel_button,
                             ft.ElevatedButton(
                                 content=ft.Row(
                                     [
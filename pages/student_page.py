@@ -5,14 +5,22 @@ import asyncio
 from datetime import datetime, date
 
 # استيراد من الوحدات الأخرى في المشروع
-from utils.database import students_db_path
+from utils.database import students_db_path, get_connection, normalize_full_name, cached_fetchall
 from utils.helpers import show_error_dialog, show_success_dialog, search_bar, format_phone_number, get_groups , extract_unique_code
 from utils.add_code import init_codes
 from components.tables import PaymentTable, AttendanceTable, ExamTable
-from utils.date_utils import normalize_date_format
+from components.virtual_table import VirtualTable
+from utils.date_utils import normalize_date_format, to_display_date, today_storage, WEEKDAYS_AR
+from utils.roster import fetch_roster
+from utils.student_search import search_students
+from utils.scan_lookup import looks_like_barcode, resolve_scan, decode_scan, CodeDirectory
+from utils.telegram_outbox import enqueue_message, enqueue_messages
+from utils.attendance_kiosk import AttendanceKiosk
+from utils.activation_messages import get_attendance_update_message
 
 
 current_month = datetime.now().strftime("%Y-%m")
+ATTENDANCE_STATUSES = ("حاضر", "غائب", "معتذر")
 
 def student_page(page) :
 
@@ -153,11 +161,11 @@ def student_page(page) :
                 show_error_dialog(e.page, "رقم الطالب يجب أن يكون مختلفًا عن رقم ولي الأمر إذا كانا غير فارغين.")
                 return
             try:
-                conn = sqlite3.connect(students_db_path)
+                conn = get_connection()
                 c = conn.cursor()
                 c.execute(
                     """SELECT id FROM students WHERE first_name=? AND father_name=? AND family_name=?""",
-                    (std_name.value.strip(), father_name.value.strip(), family_name.value.strip()),
+                    (normalize_full_name(std_name.value), normalize_full_name(father_name.value), normalize_full_name(family_name.value)),
                 )
                 exists = c.fetchone()
                 if exists:
@@ -171,9 +179,9 @@ def student_page(page) :
                 c.execute(
                     """INSERT INTO students (first_name, father_name, family_name, phone, guardian_phone, grade, group_id, gender) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
                     (
-                        std_name.value.strip(),
-                        father_name.value.strip(),
-                        family_name.value.strip(),
+                        normalize_full_name(std_name.value),
+                        normalize_full_name(father_name.value),
+                        normalize_full_name(family_name.value),
                         normalized_std_phone,
                         normalized_father_phone,
                         std_level.value,
@@ -323,7 +331,7 @@ def student_page(page) :
         # ----------------------------
         # البحث عن الطالب
         def search_student(search_term):
-            conn = sqlite3.connect(students_db_path)
+            conn = get_connection()
             c = conn.cursor()
             
             # تنظيف الكود من الزوائد إذا كان البحث بالكود
@@ -335,7 +343,7 @@ def student_page(page) :
             else:
                 c.execute('''SELECT id, first_name, father_name, family_name, phone, guardian_phone, grade, group_id, gender 
                          FROM students 
-                         WHERE first_name || ' ' || father_name || ' ' || family_name = ?''', (search_term.strip(),))
+                         WHERE full_name = ?''', (normalize_full_name(search_term),))
             
             result = c.fetchone()
             conn.close()
@@ -346,9 +354,9 @@ def student_page(page) :
         # استخدم dict لتخزين std_id بشكل قابل للتغيير
         std_id_holder = {"id": std_id}
         if name:
-            conn = sqlite3.connect(students_db_path)
+            conn = get_connection()
             c = conn.cursor()
-            c.execute('''SELECT id, first_name, father_name, family_name, phone, guardian_phone, grade, group_id, gender FROM students WHERE first_name || ' ' || father_name || ' ' || family_name = ?''', (name.strip(),))
+            c.execute('''SELECT id, first_name, father_name, family_name, phone, guardian_phone, grade, group_id, gender FROM students WHERE full_name = ?''', (normalize_full_name(name),))
             result = c.fetchone()
             conn.close()
             if result:
@@ -425,12 +433,12 @@ def student_page(page) :
                 return  
 
             try:
-                conn = sqlite3.connect(students_db_path)
+                conn = get_connection()
                 c = conn.cursor()
                 c.execute('''UPDATE students 
                              SET first_name=?, father_name=?, family_name=?, phone=?, guardian_phone=?, grade=?, group_id=?, gender=? 
                              WHERE id = ?''',
-                    (std_name.value.strip(), father_name.value.strip(), family_name.value.strip(),
+                    (normalize_full_name(std_name.value), normalize_full_name(father_name.value), normalize_full_name(family_name.value),
                      phone, guardian_phone, std_level.value, int(std_group.value),
                      std_type.value,
                      std_id_holder["id"]))
@@ -443,11 +451,10 @@ def student_page(page) :
 
         def on_delete_click(e):
             try:
-                conn = sqlite3.connect(students_db_path)
+                conn = get_connection()
                 c = conn.cursor()
-                c.execute('''DELETE FROM students 
-                             WHERE first_name || ' ' || father_name || ' ' || family_name = ?''',
-                          (std_name.value.strip() + ' ' + father_name.value.strip() + ' ' + family_name.value.strip(),))
+                c.execute('DELETE FROM students WHERE full_name = ?',
+                          (normalize_full_name(f"{std_name.value} {father_name.value} {family_name.value}"),))
                 conn.commit()
                 show_success_dialog(e.page, "تم حذف الطالب")
                 std_name.value = ""; father_name.value = ""; family_name.value = ""
@@ -558,169 +565,65 @@ def student_page(page) :
         filter_level = {"value": None}
         filter_search = {"value": ""}
 
-        def fetch_students():
-            with sqlite3.connect(students_db_path) as conn:
-                c = conn.cursor()
-                query = '''SELECT s.id, s.code, s.first_name, s.father_name, s.family_name, 
-                                  s.phone, s.guardian_phone, s.grade, g.name as group_name
-                           FROM students s 
-                           LEFT JOIN groups g ON s.group_id = g.id'''
-                params = []
-                where = []      
-
-                if filter_level["value"]:
-                    where.append("s.grade = ?")
-                    params.append(filter_level["value"])        
-
-                if filter_search["value"]:
-                    search_val = filter_search["value"].strip()
-
-                    # ✅ لو المدخل كله أرقام (باركود)
-                    if search_val.isdigit():
-                        # استخدم دالة extract_unique_code
-                        filtered_code = extract_unique_code(search_val)
-                        if filtered_code:
-                            where.append("CAST(s.code AS TEXT) LIKE ?")
-                            params.append(f"%{filtered_code}%")
-                        else:
-                            # إذا لم يرجع شيء من الدالة، استخدم آخر 4 أرقام كاحتياط
-                            search_val = search_val[-4:]
-                            where.append("CAST(s.code AS TEXT) LIKE ?")
-                            params.append(f"%{search_val}%")
-                    else:
-                        # 🔍 بحث بالاسم أو رقم الهاتف إلخ
-                        val = f"%{search_val}%"
-                        where.append(
-                            "(s.first_name LIKE ? OR s.father_name LIKE ? OR s.family_name LIKE ? OR CAST(s.code AS TEXT) LIKE ?)"
-                        )
-                        params += [val, val, val, val]
-
-                if where:
-                    query += " WHERE " + " AND ".join(where)        
+        def fetch_students(after=None, limit=None):
+            search_val = filter_search["value"].strip()
 
-                query += " ORDER BY s.first_name, s.father_name, s.family_name"
-                c.execute(query, params)
-                students = c.fetchall()
-                result = []     
+            with get_connection() as conn:
+                if not search_val:
+                    return fetch_roster(conn, grade=filter_level["value"], after=after, limit=limit)
 
-                # الشهر الحالي بالتنسيق الرقمي YYYY-MM
-                current_month_numeric = datetime.now().strftime('%Y-%m')
-
-                for s in students:
-                    student_id, code, first_name, father_name, family_name, phone, guardian_phone, grade, group_name = s
-                    full_name = f"{first_name} {father_name} {family_name}"     
-
-                    # حالة الدفع
-                    c.execute(
-                        'SELECT status FROM payments WHERE student_id=? AND month=? LIMIT 1',
-                        (student_id, current_month_numeric)
-                    )
-                    payment_status_row = c.fetchone()
-                    payment_status = payment_status_row[0] if payment_status_row else "لم يدفع"     
-
-                    # عدد الاختبارات
-                    c.execute('SELECT COUNT(*) FROM exams WHERE student_id=?', (student_id,))
-                    tests_count = c.fetchone()[0]       
-
-                    # الحضور
-                    c.execute('SELECT group_id FROM students WHERE id=?', (student_id,))
-                    group_id_row = c.fetchone()
-                    group_id = group_id_row[0] if group_id_row else None        
-
-                    if group_id:
-                        c.execute(
-                            'SELECT DISTINCT attendance_date FROM attendance a JOIN students s ON a.student_id = s.id WHERE s.group_id=?',
-                            (group_id,)
-                        )
-                        group_dates = [row[0] for row in c.fetchall()]
-                        total_att = len(group_dates)        
-
-                        if group_dates:
-                            c.execute(
-                                f'SELECT COUNT(*) FROM attendance WHERE student_id=? AND status="حاضر" AND attendance_date IN ({",".join(["?"]*len(group_dates))})',
-                                [student_id] + group_dates
-                            )
-                            attended = c.fetchone()[0]
-                        else:
-                            attended = 0
-                    else:
-                        total_att = 0
-                        attended = 0        
-
-                    attendance = f"{attended}/{total_att}" if total_att > 0 else "-"        
-
-                    result.append({
-                        "id": student_id,
-                        "code": code,
-                        "name": full_name,
-                        "group": group_name or "-",
-                        "student_phone": phone,
-                        "parent_phone": guardian_phone,
-                        "grade": grade,
-                        "payment_status": payment_status,
-                        "tests_count": tests_count,
-                        "attendance": attendance,
-                    })
-                return result       
+                # نتائج البحث مرتبة بالأقرب ومحدودة بـ SEARCH_LIMIT فتُعرض في صفحة واحدة
+                if after is not None:
+                    return []
+                if looks_like_barcode(search_val):
+                    # ✅ باركود ممسوح: مطابقة تامة للكود من الذاكرة
+                    student = resolve_scan(search_val)
+                    student_ids = [student["id"]] if student else []
+                else:
+                    student_ids = search_students(conn, search_val, grade=filter_level["value"])
+                return fetch_roster(conn, student_ids=student_ids)
+
+        def render_student_cells(idx, s):
+            return [
+                ft.Text(str(idx + 1), text_align="center", color="#1E3A8A", weight="bold"),
+                ft.Text(str(s["code"]), text_align="center", color="#000000", weight="bold"),
+                ft.TextButton(
+                    text=s["name"],
+                    style=ft.ButtonStyle(color="#000000"),
+                    on_click=lambda e, student=s: on_click(student)
+                ),
+                ft.Text(s["group"], text_align="center", color="#000000", weight="bold"),
+                ft.TextButton(
+                    text=s["student_phone"] if s["student_phone"] else "-",
+                    url=f"https://wa.me/{s['student_phone'].replace('+', '')}" if s["student_phone"] else None,
+                    style=ft.ButtonStyle(color="#25D366"),
+                    tooltip="تواصل واتساب مع الطالب",
+                    disabled=not s["student_phone"]
+                ),
+                ft.TextButton(
+                    text=s["parent_phone"] if s["parent_phone"] else "-",
+                    url=f"https://wa.me/{s['parent_phone'].replace('+', '')}" if s["parent_phone"] else None,
+                    style=ft.ButtonStyle(color="#0D6EFD"),
+                    tooltip="تواصل واتساب مع ولي الأمر",
+                    disabled=not s["parent_phone"]
+                ),
+                ft.Text(s["grade"] if s["grade"] else "-", text_align="center", color="#000000", weight="bold"),
+                ft.Text(
+                    s["payment_status"],
+                    color="green" if s["payment_status"] == "دفع" else "red",
+                    text_align="center",
+                    weight="bold"
+                ),
+                ft.Text(str(s["tests_count"]), text_align="center", color="#000000", weight="bold"),
+                ft.Text(s["attendance"], text_align="center", color="#000000", weight="bold"),
+            ]
 
         def refresh_table():
-            students_data = fetch_students()
-
-            if not students_data:
-                student_table.rows = [
-                    ft.DataRow(
-                        cells=[ft.DataCell(ft.Text('لا يوجد طلاب لعرضهم', text_align='center', color='red', weight='bold'))]
-                        + [ft.DataCell(ft.Text(''))] * 9
-                    )
-                ]
-            else:
-                student_table.rows = [
-                    ft.DataRow(
-                        cells=[
-                            ft.DataCell(ft.Text(str(idx + 1), text_align="center", color="#1E3A8A", weight="bold")),
-                            ft.DataCell(ft.Text(str(s["code"]), text_align="center", color="#000000", weight="bold")),
-                            ft.DataCell(
-                                ft.TextButton(
-                                    text=s["name"],
-                                    style=ft.ButtonStyle(color="#000000"),
-                                    on_click=lambda e, student=s: on_click(student)
-                                )
-                            ),
-                            ft.DataCell(ft.Text(s["group"], text_align="center", color="#000000", weight="bold")),
-                            ft.DataCell(
-                                ft.TextButton(
-                                    text=s["student_phone"] if s["student_phone"] else "-",
-                                    url=f"https://wa.me/{s['student_phone'].replace('+', '')}" if s["student_phone"] else None,
-                                    style=ft.ButtonStyle(color="#25D366"),
-                                    tooltip="تواصل واتساب مع الطالب",
-                                    disabled=not s["student_phone"]
-                                )
-                            ),
-                            ft.DataCell(
-                                ft.TextButton(
-                                    text=s["parent_phone"] if s["parent_phone"] else "-",
-                                    url=f"https://wa.me/{s['parent_phone'].replace('+', '')}" if s["parent_phone"] else None,
-                                    style=ft.ButtonStyle(color="#0D6EFD"),
-                                    tooltip="تواصل واتساب مع ولي الأمر",
-                                    disabled=not s["parent_phone"]
-                                )
-                            ),
-                            ft.DataCell(ft.Text(s["grade"] if s["grade"] else "-", text_align="center", color="#000000", weight="bold")),
-                            ft.DataCell(
-                                ft.Text(
-                                    s["payment_status"],
-                                    color="green" if s["payment_status"] == "دفع" else "red",
-                                    text_align="center",
-                                    weight="bold"
-                                )
-                            ),
-                            ft.DataCell(ft.Text(str(s["tests_count"]), text_align="center", color="#000000", weight="bold")),
-                            ft.DataCell(ft.Text(s["attendance"], text_align="center", color="#000000", weight="bold")),
-                        ]
-                    )
-                    for idx, s in enumerate(students_data)
-                ]
-            page.update()
+            # صفحات keyset من قاعدة البيانات: حجم كل تحديث ثابت مهما زاد عدد الطلاب
+            student_table.set_query(
+                lambda after, limit: fetch_students(after, limit),
+                lambda s: s["sort_key"]
+            )
 
         def on_click(student):
             update_side_content(show_student_details(student["name"]))
@@ -733,26 +636,23 @@ def student_page(page) :
             filter_level["value"] = std_level.value
             refresh_table()
 
-        student_table = ft.DataTable(
-            expand=True,
-            column_spacing=30,
-            data_row_min_height=50,
-            heading_row_color="#1E3A8A",
-            border=ft.border.all(1, "#1E3A8A"),
-            divider_thickness=1,
+        student_table = VirtualTable(
             columns=[
-                ft.DataColumn(ft.Text("#", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("كود الطالب", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("الاسم الثلاثي", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("المجموعة", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("هاتف الطالب", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("هاتف ولي الأمر", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("الصف", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("حالة الدفع", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("عدد الاختبارات", weight="bold", color="white", text_align="center")),
-                ft.DataColumn(ft.Text("الحضور", weight="bold", color="white", text_align="center")),
+                ("#", 60),
+                ("كود الطالب", 100),
+                ("الاسم الثلاثي", 240),
+                ("المجموعة", 150),
+                ("هاتف الطالب", 140),
+                ("هاتف ولي الأمر", 140),
+                ("الصف", 140),
+                ("حالة الدفع", 100),
+                ("عدد الاختبارات", 110),
+                ("الحضور", 90),
             ],
-            rows=[],
+            render_cells=render_student_cells,
+            page=page,
+            mode=VirtualTable.MODE_PAGED,
+            empty_text="لا يوجد طلاب لعرضهم",
         )
 
         std_level = ft.Dropdown(
@@ -811,17 +711,7 @@ def student_page(page) :
                         border_radius=10,
                         padding=10,
                         border=ft.border.all(1, "#CBD5E1"),
-                        content=ft.Column(
-                            expand=True,
-                            scroll=ft.ScrollMode.ADAPTIVE,
-                            controls=[
-                                ft.Row(
-                                    controls=[student_table],
-                                    scroll=ft.ScrollMode.ADAPTIVE,
-                                    expand=True,
-                                )
-                            ]
-                        )
+                        content=student_table
                     )
                 ],
                 spacing=25,
@@ -839,11 +729,9 @@ def student_page(page) :
         def on_delete_click(e):
             def confirm_delete(ev):
                 try:
-                    with sqlite3.connect(students_db_path) as conn:
+                    with get_connection() as conn:
                         c = conn.cursor()
-                        c.execute("DELETE FROM attendance WHERE student_id=?", (student_data["id"],))
-                        c.execute("DELETE FROM exams WHERE student_id=?", (student_data["id"],))
-                        c.execute("DELETE FROM payments WHERE student_id=?", (student_data["id"],))
+                        # الحضور والاختبارات والمدفوعات تُحذف تلقائياً (ON DELETE CASCADE)
                         c.execute("DELETE FROM students WHERE id=?", (student_data["id"],))
                         conn.commit()
                     show_success_dialog(page, "تم حذف الطالب بنجاح!")
@@ -880,20 +768,17 @@ def student_page(page) :
             show_success_dialog(page, "تم تحديث البيانات بنجاح")    
 
         student_data = None
-        with sqlite3.connect(students_db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
-            name_parts = name.strip().split()
-            if len(name_parts) >= 3:
-                c.execute('''SELECT s.id, s.code, s.first_name, s.father_name, s.family_name, s.phone, s.guardian_phone, s.grade, s.gender, g.name as group_name
-                             FROM students s LEFT JOIN groups g ON s.group_id = g.id
-                             WHERE s.first_name=? AND s.father_name=? AND s.family_name=?''',
-                          (name_parts[0], name_parts[1], ' '.join(name_parts[2:])))
-            else:
-                like_val = f"%{name.strip()}%"
-                c.execute('''SELECT s.id, s.code, s.first_name, s.father_name, s.family_name, s.phone, s.guardian_phone, s.grade, s.gender, g.name as group_name
-                             FROM students s LEFT JOIN groups g ON s.group_id = g.id
-                             WHERE s.first_name || ' ' || s.father_name || ' ' || s.family_name LIKE ?''', (like_val,))
+            # تطابق تام على فهرس full_name أولاً، ثم بحث جزئي إذا لم يوجد
+            full_name = normalize_full_name(name)
+            select = '''SELECT s.id, s.code, s.first_name, s.father_name, s.family_name, s.phone, s.guardian_phone, s.grade, s.gender, g.name as group_name
+                        FROM students s LEFT JOIN groups g ON s.group_id = g.id'''
+            c.execute(select + ' WHERE s.full_name = ?', (full_name,))
             row = c.fetchone()
+            if not row:
+                c.execute(select + ' WHERE s.full_name LIKE ? LIMIT 1', (f"%{full_name}%",))
+                row = c.fetchone()
             if row:
                 student_data = {
                     "id": row[0],
@@ -988,7 +873,7 @@ def student_page(page) :
                 "يوليو", "أغسطس", "سبتمبر", "أكتوبر", "نوفمبر", "ديسمبر"
             ]
             students_payment = []
-            with sqlite3.connect(students_db_path) as conn:
+            with get_connection() as conn:
                 c = conn.cursor()
                 c.execute('SELECT month, status, IFNULL(payment_date, "-") FROM payments WHERE student_id=? ORDER BY month DESC',
                           (student_data["id"],))
@@ -1002,7 +887,7 @@ def student_page(page) :
                     students_payment.append({
                         "month": month_ar,
                         "status": row[1],
-                        "date": row[2],
+                        "date": to_display_date(row[2]),
                         "numeric_month": row[0]
                     })  
 
@@ -1087,8 +972,9 @@ def student_page(page) :
                     new_date = date_field.value if new_status == "دفع" else "-"
                     if new_status == "دفع" and (not new_date or new_date == "-"):
                         new_date = today_str    
+                    new_date = normalize_date_format(new_date)
 
-                    with sqlite3.connect(students_db_path) as conn:
+                    with get_connection() as conn:
                         c = conn.cursor()
                         if payment is None or new_month_numeric != payment["numeric_month"]:
                             c.execute('SELECT COUNT(*) FROM payments WHERE student_id=? AND month=?',
@@ -1206,7 +1092,7 @@ def student_page(page) :
             arabic_days = {"Saturday": "السبت", "Sunday": "الأحد", "Monday": "الإثنين", "Tuesday": "الثلاثاء", "Wednesday": "الأربعاء", "Thursday": "الخميس", "Friday": "الجمعة"}
             students_attendance = []
             date_format = "%d-%m-%Y"
-            with sqlite3.connect(students_db_path) as conn:
+            with get_connection() as conn:
                 c = conn.cursor()
                 c.execute('''
                     SELECT attendance_date, status, COALESCE(day, '-') as day 
@@ -1215,7 +1101,7 @@ def student_page(page) :
                     ORDER BY attendance_date DESC
                 ''', (student_data["id"],))
                 for row in c.fetchall():
-                    att_date_str = row[0]
+                    att_date_str = to_display_date(row[0])
                     day_ar = row[2]
                     try:
                         dt = datetime.strptime(att_date_str, date_format)
@@ -1267,19 +1153,19 @@ def student_page(page) :
                 def save_changes(e):
                     try:
                         datetime.strptime(date_field.value, date_format)
-                        old_date = att["date"]
-                        new_date = date_field.value
+                        old_date = normalize_date_format(att["date"])
+                        new_date = normalize_date_format(date_field.value)
                         new_status = status_field.value
-                        new_day = get_day_ar(new_date)
+                        new_day = get_day_ar(date_field.value)
                     except ValueError:
                         show_error_dialog(page, "صيغة التاريخ غير صحيحة. يجب أن تكون dd-mm-yyyy")
                         return
-                    with sqlite3.connect(students_db_path) as conn:
+                    with get_connection() as conn:
                         c = conn.cursor()
                         if new_date != old_date:
                             c.execute('SELECT COUNT(*) FROM attendance WHERE student_id=? AND attendance_date=?', (student_data["id"], new_date))
                             if c.fetchone()[0] > 0:
-                                show_error_dialog(page, f"التاريخ {new_date} مسجل بالفعل لهذا الطالب.")
+                                show_error_dialog(page, f"التاريخ {date_field.value} مسجل بالفعل لهذا الطالب.")
                                 return
                         c.execute('''UPDATE attendance SET attendance_date=?, status=?, day=? WHERE student_id=? AND attendance_date=?''',
                                   (new_date, new_status, new_day, student_data["id"], old_date))
@@ -1388,7 +1274,7 @@ def student_page(page) :
 
         def exams_table():
             students_exams = []
-            with sqlite3.connect(students_db_path) as conn:
+            with get_connection() as conn:
                 c = conn.cursor()
                 c.execute('''
                     SELECT e.id, s.code, e.total_score, e.student_score, e.exam_date
@@ -1398,7 +1284,7 @@ def student_page(page) :
                     ORDER BY e.exam_date DESC
                 ''', (student_data["id"],))
                 for row in c.fetchall():
-                    students_exams.append({"id": row[0], "code": row[1], "total": row[2], "score": row[3], "date": row[4]})
+                    students_exams.append({"id": row[0], "code": row[1], "total": row[2], "score": row[3], "date": to_display_date(row[4])})
 
 
             exams_table_widget = ft.DataTable(
@@ -1460,9 +1346,9 @@ def student_page(page) :
                     try:
                         new_total = int(total_field.value)
                         new_score = int(score_field.value)
-                        new_date = date_field.value
+                        new_date = normalize_date_format(date_field.value)
                         exam_id = exam["id"]
-                        with sqlite3.connect(students_db_path) as conn:
+                        with get_connection() as conn:
                             c = conn.cursor()
                             c.execute('''UPDATE exams SET exam_date=?, total_score=?, student_score=? WHERE id=?''',
                                       (new_date, new_total, new_score, exam_id))
@@ -1664,22 +1550,17 @@ def student_page(page) :
         # جلب بيانات الطلاب
         # ------------------------
         def get_students(group_id=None, search_name=None):
-            conn = sqlite3.connect(students_db_path)
+            conn = get_connection()
             c = conn.cursor()
-            month = PaymentTable.get_current_month()  # YYYY-MM 
 
+            # حالة الدفع لا تُقرأ هنا: الجدول يحمّلها للشهر المختار باستعلام واحد (load_payment_statuses)
+            query = '''SELECT s.id, s.code, s.full_name FROM students s'''
+            params = []
             if group_id:
-                c.execute('''SELECT s.id, s.code, s.first_name || ' ' || s.father_name || ' ' || s.family_name, 
-                            (SELECT status FROM payments WHERE student_id = s.id AND month = ? LIMIT 1) as pay_status,
-                            (SELECT month FROM payments WHERE student_id = s.id AND month = ? LIMIT 1) as pay_month
-                            FROM students s 
-                            WHERE s.group_id=? ORDER BY s.first_name, s.father_name, s.family_name''', (month, month, group_id))
-            else:
-                c.execute('''SELECT s.id, s.code, s.first_name || ' ' || s.father_name || ' ' || s.family_name, 
-                            (SELECT status FROM payments WHERE student_id = s.id AND month = ? LIMIT 1) as pay_status,
-                            (SELECT month FROM payments WHERE student_id = s.id AND month = ? LIMIT 1) as pay_month
-                            FROM students s 
-                            ORDER BY s.first_name, s.father_name, s.family_name''', (month, month)) 
+                query += " WHERE s.group_id = ?"
+                params.append(group_id)
+            query += " ORDER BY s.first_name, s.father_name, s.family_name"
+            c.execute(query, params)
 
             students = c.fetchall()
             conn.close()    
@@ -1689,8 +1570,8 @@ def student_page(page) :
                 students = [s for s in students if search_name in s[2] or search_name in str(s[1])]  # البحث بالاسم والكود  
 
             students.sort(key=lambda s: s[2])
-            # إرجاع الاسم، الكود، حالة الدفع، الشهر (عربي للعرض)
-            return [[s[2], s[1], s[3] if s[3] else "لم يدفع", PaymentTable.numeric_month_to_arabic(s[4] if s[4] else month)] for s in students] 
+            # إرجاع الاسم، الكود، حالة الدفع والشهر (يملؤهما الجدول)، معرف الطالب (مفتاح صف الجدول)
+            return [[s[2], s[1], None, None, s[0]] for s in students] 
 
         students_data = []  # بداية بقائمة فارغة    
 
@@ -1804,89 +1685,55 @@ def student_page(page) :
         )
 
         # جلب بيانات الطلاب من القاعدة
-        def get_students(group_id=None, search_name=None):
-            from utils.date_utils import normalize_date_format
-            conn = sqlite3.connect(students_db_path)
+        def get_students(group_id=None, student_id=None):
+            conn = get_connection()
             c = conn.cursor()
-            today = normalize_date_format(datetime.now().strftime('%Y-%m-%d'))
+            today = today_storage()
+            # آخر حصة قبل اليوم: بحث مدى على فهرس (student_id, attendance_date) لكل طالب
+            query = '''
+                SELECT 
+                    s.id, 
+                    s.code, 
+                    s.full_name,
+                    COALESCE(t.status, 'غير محدد') as today_status,
+                    COALESCE((
+                        SELECT l.status FROM attendance l
+                        WHERE l.student_id = s.id AND l.attendance_date < ?
+                        ORDER BY l.attendance_date DESC LIMIT 1
+                    ), '-') as last_status
+                FROM students s
+                LEFT JOIN attendance t ON t.student_id = s.id AND t.attendance_date = ?
+            '''
+            params = [today, today]
+            where = []
             if group_id:
-                c.execute('''
-                    WITH LastAttendance AS (
-                        SELECT 
-                            student_id,
-                            status,
-                            attendance_date,
-                            ROW_NUMBER() OVER (PARTITION BY student_id ORDER BY attendance_date DESC) as rn
-                        FROM attendance
-                        WHERE attendance_date < ?
-                    ),
-                    TodayAttendance AS (
-                        SELECT student_id, status
-                        FROM attendance
-                        WHERE attendance_date = ?
-                    )
-                    SELECT 
-                        s.id, 
-                        s.code, 
-                        s.first_name || ' ' || s.father_name || ' ' || s.family_name,
-                        COALESCE(t.status, 'غير محدد') as today_status,
-                        COALESCE(l.status, '-') as last_status
-                    FROM students s
-                    LEFT JOIN TodayAttendance t ON s.id = t.student_id
-                    LEFT JOIN LastAttendance l ON s.id = l.student_id AND l.rn = 1
-                    WHERE s.group_id = ?
-                    ORDER BY s.first_name, s.father_name, s.family_name
-                ''', (today, today, group_id))
-            else:
-                c.execute('''
-                    WITH LastAttendance AS (
-                        SELECT 
-                            student_id,
-                            status,
-                            attendance_date,
-                            ROW_NUMBER() OVER (PARTITION BY student_id ORDER BY attendance_date DESC) as rn
-                        FROM attendance
-                        WHERE attendance_date < ?
-                    ),
-                    TodayAttendance AS (
-                        SELECT student_id, status
-                        FROM attendance
-                        WHERE attendance_date = ?
-                    )
-                    SELECT 
-                        s.id, 
-                        s.code, 
-                        s.first_name || ' ' || s.father_name || ' ' || s.family_name,
-                        COALESCE(t.status, 'غير محدد') as today_status,
-                        COALESCE(l.status, '-') as last_status
-                    FROM students s
-                    LEFT JOIN TodayAttendance t ON s.id = t.student_id
-                    LEFT JOIN LastAttendance l ON s.id = l.student_id AND l.rn = 1
-                    ORDER BY s.first_name, s.father_name, s.family_name
-                ''', (today, today))
+                where.append("s.group_id = ?")
+                params.append(group_id)
+            if student_id:
+                where.append("s.id = ?")
+                params.append(student_id)
+            if where:
+                query += " WHERE " + " AND ".join(where)
+            query += " ORDER BY s.first_name, s.father_name, s.family_name"
+            c.execute(query, params)
             students = c.fetchall()
             conn.close()
-            if search_name:
-                search_name = search_name.strip()
-                students = [s for s in students if search_name in s[2] or search_name in str(s[1])]  # بحث بالاسم أو الكود
-            # ترتيب أبجدي بعد البحث
+            # ترتيب أبجدي
             students.sort(key=lambda s: s[2])
-            # إرجاع الاسم، الكود، اخر حالة، الحالة الحالية
-            # ترتيب البيانات: [الاسم، الكود، آخر حالة حضور، الحالة الحالية]
+            # ترتيب البيانات: [الاسم، الكود، آخر حالة حضور، الحالة الحالية، معرف الطالب]
             formatted_students = []
             for s in students:
                 name = s[2]  # الاسم الكامل
                 code = s[1]  # الكود
                 last_status = s[4]  # حالة آخر حصة
                 current_status = s[3]  # حالة اليوم
-                formatted_students.append([name, code, last_status, current_status])
+                formatted_students.append([name, code, last_status, current_status, s[0]])
             return formatted_students
 
         students_data = []  # بداية بقائمة فارغة
 
         def on_search_submit(e):
                 barcode = e.control.value.strip()
-                from utils.helpers import extract_unique_code
                 group_id = std_group.value
                 if not group_id:
                     show_error_dialog(page, "يرجى اختيار المجموعة أولاً")
@@ -1895,61 +1742,44 @@ def student_page(page) :
                     page.update()
                     return
 
+                if barcode and kiosk_switch.value:
+                    on_kiosk_scan(e, barcode, group_id)
+                    return
+
                 if barcode:
-                    barcode = extract_unique_code(barcode)
-                    # تحديث البيانات للعرض
-                    students_data.clear()
-                    students_data.extend(get_students(group_id, barcode))
-                    
-                    # إذا وجد الطالب، قم بتسجيل حضوره مباشرة
-                    if students_data:
-                        student = students_data[0]  # نأخذ أول طالب (يفترض أن البحث بالباركود سيرجع طالب واحد)
-                        student[3] = "حاضر"  # تحديث حالة الحضور
-                        
-                        # حفظ في قاعدة البيانات مباشرة
-                        conn = sqlite3.connect(students_db_path)
+                    # الكود يُحل من الذاكرة (CodeDirectory) بدون استعلام، والنص غير الرقمي
+                    # يُقبل فقط إذا طابق طالباً واحداً في المجموعة
+                    student = resolve_scan(barcode)
+                    if student is None and decode_scan(barcode) is None:
+                        with get_connection() as conn:
+                            matches = search_students(conn, barcode, limit=2, group_id=group_id)
+                        if len(matches) == 1:
+                            student = CodeDirectory().by_id(matches[0])
+
+                    if student and str(student["group_id"]) == str(group_id):
+                        today = today_storage()
+                        day_ar = WEEKDAYS_AR[date.today().weekday()]
+
+                        # تحديث/إضافة سجل الحضور
+                        conn = get_connection()
                         c = conn.cursor()
-                        
-                        # الحصول على معرف الطالب من الكود
-                        c.execute('SELECT id FROM students WHERE code=?', (student[1],))
-                        student_id = c.fetchone()
-                        
-                        if student_id:
-                            from utils.date_utils import normalize_date_format
-                            today = normalize_date_format(datetime.now().strftime('%Y-%m-%d'))
-                            days_ar = ["الأحد", "الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت"]
-                            day_idx = datetime.strptime(today, '%d-%m-%Y').weekday()
-                            day_ar = days_ar[(day_idx + 1) % 7]
-                            
-                            # تحديث/إضافة سجل الحضور
-                            c.execute('''INSERT INTO attendance (student_id, attendance_date, status, day) 
-                                       VALUES (?, ?, ?, ?)
-                                       ON CONFLICT(student_id, attendance_date) 
-                                       DO UPDATE SET status=excluded.status, day=excluded.day''',
-                                    (student_id[0], today, "حاضر", day_ar))
-                            
-                            # إرسال إشعار تليجرام
-                            c.execute('''SELECT first_name || ' ' || father_name || ' ' || family_name, guardian_chat_id 
-                                       FROM students WHERE id = ?''', (student_id[0],))
-                            student_info = c.fetchone()
-                            if student_info and student_info[1]:
-                                from utils.telegram_bot import send_telegram_message
-                                message = f"⏰ تحديث حالة الحضور\n"
-                                message += f"الطالب: {student_info[0]}\n"
-                                message += f"اليوم: {day_ar}\n"
-                                message += f"التاريخ: {today}\n"
-                                message += f"الحالة: حاضر\n"
-                                try:
-                                    loop = asyncio.new_event_loop()
-                                    asyncio.set_event_loop(loop)
-                                    loop.run_until_complete(send_telegram_message(student_info[1], message))
-                                finally:
-                                    loop.close()
-                            
-                            conn.commit()
-                            show_success_dialog(page, f"✅ تم تسجيل حضور الطالب: {student[0]}")
-                        
+                        c.execute('''INSERT INTO attendance (student_id, attendance_date, status, day) 
+                                   VALUES (?, ?, ?, ?)
+                                   ON CONFLICT(student_id, attendance_date) 
+                                   DO UPDATE SET status=excluded.status, day=excluded.day''',
+                                (student["id"], today, "حاضر", day_ar))
+                        conn.commit()
                         conn.close()
+
+                        # إرسال إشعار تليجرام (في الخلفية عبر صندوق الصادر)
+                        if student["guardian_chat_id"]:
+                            enqueue_message(student["guardian_chat_id"], get_attendance_update_message(student["name"], day_ar, today))
+
+                        show_success_dialog(page, f"✅ تم تسجيل حضور الطالب: {student['name']}")
+
+                        # عرض الطالب الممسوح فقط في الجدول
+                        students_data.clear()
+                        students_data.extend(get_students(group_id, student_id=student["id"]))
                         attendance_table.refresh(students_data)
                     else:
                         show_error_dialog(page, "❌ لم يتم العثور على الطالب")
@@ -1963,99 +1793,128 @@ def student_page(page) :
             group_id = std_group.value
             students_data.clear()
             students_data.extend(get_students(group_id))
+            row_index.clear()
+            row_index.update({str(row[1]): index for index, row in enumerate(students_data)})
             attendance_table.refresh(students_data)
 
+        # ------------------------
+        # وضع المسح السريع: المسحة تُسجل في الذاكرة وملف اليومية فوراً،
+        # والكتابة في قاعدة البيانات والإشعارات على دفعات في الخلفية
+        # ------------------------
+        kiosk = AttendanceKiosk()
+        row_index = {}  # كود الطالب -> موقع صفه في الجدول المعروض
+
+        def on_kiosk_scan(e, barcode, group_id):
+            ok, student, message = kiosk.record_scan(barcode, group_id)
+            kiosk_status.value = f"{'✅' if ok else '❌'} {message}  ({kiosk.recorded} مسحة)"
+            kiosk_status.color = "#07C06A" if ok else "#DC2626"
+            if ok and student:
+                index = row_index.get(str(student["code"]))
+                # الجدول قد يكون تغير بعد بناء الفهرس (بحث عادي مثلاً)
+                if (index is not None and index < len(students_data)
+                        and str(students_data[index][1]) == str(student["code"])
+                        and students_data[index][3] != "حاضر"):
+                    students_data[index][3] = "حاضر"
+                    attendance_table.update_row(index)
+            # تفريغ حقل البحث والتركيز عليه للمسح التالي بدون تحديث الصفحة كاملة
+            e.control.value = ""
+            e.control.focus()
+            e.control.update()
+            kiosk_status.update()
+
+        def on_kiosk_toggle(e):
+            try:
+                if kiosk_switch.value:
+                    kiosk.start()
+                    kiosk_status.value = "وضع المسح السريع مفعل، امسح الباركود"
+                    kiosk_status.color = "#0059DF"
+                else:
+                    kiosk.stop()
+                    kiosk_status.value = ""
+                    if std_group.value:
+                        on_group_change(None)
+            except Exception as ex:
+                kiosk_switch.value = False
+                show_error_dialog(page, f"خطأ في وضع المسح السريع: {ex}")
+            page.update()
+
+        # الوضع يبقى مفعلاً عند مغادرة الصفحة، والمفتاح يعكس حالته عند العودة
+        kiosk_switch = ft.Switch(label="وضع المسح السريع", value=kiosk.running, on_change=on_kiosk_toggle)
+        kiosk_status = ft.Text("وضع المسح السريع مفعل، امسح الباركود" if kiosk.running else "",
+                               color="#0059DF", weight=ft.FontWeight.BOLD, size=16)
+
         def on_update_click(e):
             group_id = std_group.value
             if not group_id:
                 show_error_dialog(e.page, "يرجى اختيار مجموعة أولاً")
                 return
                 
-            # تعيين الطلاب الذين لم يتم تحديد حالتهم كغائبين
-            for student in students_data:
-                if student[3] not in ["حاضر", "غائب", "معتذر"]:
-                    student[3] = "غائب"
-            # استيراد الدالة المساعدة في بداية الملف:
-            from utils.date_utils import normalize_date_format
-            
-            conn = sqlite3.connect(students_db_path)
-            c = conn.cursor()
-            today = normalize_date_format(datetime.now().strftime('%Y-%m-%d'))
-            # استخراج اليوم بالعربي
-            days_ar = ["الأحد", "الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت"]
-            day_idx = datetime.strptime(today, '%d-%m-%Y').weekday()
-            day_ar = days_ar[(day_idx + 1) % 7]
-            # جلب الطلاب في المجموعة المختارة فقط
-            c.execute('SELECT id, first_name || " " || father_name || " " || family_name FROM students WHERE group_id=?', (group_id,))
-            group_students = {row[1]: row[0] for row in c.fetchall()}
             # حساب عدد الطلاب الذين سيتم تحديد حالتهم كغائبين تلقائياً
-            unset_count = sum(1 for student in students_data if student[3] == "غير محدد")
+            unset_count = sum(1 for student in students_data if student[3] not in ATTENDANCE_STATUSES)
             if unset_count > 0:
                 show_success_dialog(e.page, f"سيتم اعتبار {unset_count} طالب غير محدد الحالة كغائبين")
+            # تعيين الطلاب الذين لم يتم تحديد حالتهم كغائبين
+            for student in students_data:
+                if student[3] not in ATTENDANCE_STATUSES:
+                    student[3] = "غائب"
 
-            updated_count = 0
-            for name, code, last_status, current_status in students_data:
-                # البحث بالاسم أو الكود
-                student_id = None
-                if name in group_students:
-                    student_id = group_students[name]
-                else:
-                    # جلب id بالكود إذا لم يوجد بالاسم
-                    c.execute('SELECT id FROM students WHERE code=?', (code,))
-                    result = c.fetchone()
-                    if result:
-                        student_id = result[0]
-                if student_id:
-                    # التحقق من صحة الحالة قبل الحفظ
-                    # التأكد من أن الحالة صحيحة
-                    if current_status not in ["حاضر", "غائب", "معتذر"]:
-                        show_error_dialog(e.page, "يجب تحديد حالة الحضور (حاضر/غائب/معتذر)")
-                        return
-                    
-                    # التحقق من الحالة الحالية في قاعدة البيانات
-                    c.execute('''SELECT status FROM attendance 
-                               WHERE student_id = ? AND attendance_date = ?''', (student_id, today))
-                    current_db_status = c.fetchone()
-                    
-                    # تنفيذ الإدراج/التحديث
-                    c.execute('''INSERT INTO attendance (student_id, attendance_date, status, day) VALUES (?, ?, ?, ?)
-                        ON CONFLICT(student_id, attendance_date) DO UPDATE SET status=excluded.status, day=excluded.day''', 
-                        (student_id, today, current_status, day_ar))
-                    
-                    # إرسال رسالة تليجرام لولي الأمر فقط إذا تغيرت الحالة
-                    if not current_db_status or current_db_status[0] != current_status:
-                        from utils.telegram_bot import send_telegram_message
-                        # جلب معرف التليجرام لولي الأمر ومعلومات الطالب
-                        c.execute('''SELECT s.first_name || ' ' || s.father_name || ' ' || s.family_name, s.guardian_chat_id 
-                                   FROM students s WHERE s.id = ?''', (student_id,))
-                        student_info = c.fetchone()
-                        if student_info and student_info[1]:  # إذا كان لديه معرف تليجرام لولي الأمر
-                            student_name, guardian_chat_id = student_info
-                            message = f"⏰ تحديث حالة الحضور\n"
-                            message += f"الطالب: {student_name}\n"
-                            message += f"اليوم: {day_ar}\n"
-                            message += f"التاريخ: {today}\n"
-                            message += f"الحالة: {current_status}\n"
-                            try:
-                                loop = asyncio.new_event_loop()
-                                asyncio.set_event_loop(loop)
-                                success, error_msg = loop.run_until_complete(send_telegram_message(guardian_chat_id, message))
-                                if not success:
-                                    show_error_dialog(e.page, f"تم تحديث الحضور ولكن فشل إرسال الإشعار لولي أمر {student_name}:\n{error_msg}")
-                            finally:
-                                loop.close()
-                    
-                    updated_count += 1
-            conn.commit()
-            conn.close()
-            if updated_count:
-                # تعديل رسالة النجاح لتشمل معلومات إرسال الإشعارات
-                success_message = f"✅ تم تحديث حالة الحضور لعدد {updated_count} طالب في المجموعة"
-                if any(s[1] for s in students_data if s[3] == current_status):  # إذا كان هناك طلاب لديهم معرف تليجرام
-                    success_message += "\n📱 تم إرسال إشعارات لأولياء الأمور المسجلين في التليجرام"
+            if not students_data:
+                show_error_dialog(e.page, "لا يوجد طلاب في المجموعة المحددة")
+                return
+
+            # مسحات وضع المسح السريع المعلقة تُكتب أولاً حتى تكون المقارنة مع أحدث حالة
+            if kiosk.running:
+                try:
+                    kiosk.flush()
+                except Exception as ex:
+                    # بدونها قد تُحفظ حالة "غائب" لطالب مسح حضوره بالفعل
+                    show_error_dialog(e.page, f"تعذرت كتابة مسحات الحضور المعلقة، حاول مرة أخرى: {ex}")
+                    return
+
+            today = today_storage()
+            day_ar = WEEKDAYS_AR[date.today().weekday()]
+            # الحالة المطلوبة لكل طالب معروض: [الاسم، الكود، آخر حالة، الحالة الحالية، المعرف]
+            new_statuses = {row[4]: row[3] for row in students_data}
+
+            conn = get_connection()
+            try:
+                # الحالات المخزنة لكل طلاب المجموعة في استعلام واحد، ثم الفرق فقط يُكتب
+                stored = conn.execute('''SELECT s.id, s.full_name, s.guardian_chat_id, a.status
+                                         FROM students s
+                                         LEFT JOIN attendance a ON a.student_id = s.id AND a.attendance_date = ?
+                                         WHERE s.group_id = ?''', (today, group_id)).fetchall()
+                changed = [
+                    (student_id, student_name, guardian_chat_id, new_statuses[student_id])
+                    for student_id, student_name, guardian_chat_id, status in stored
+                    if student_id in new_statuses and status != new_statuses[student_id]
+                ]
+                conn.executemany('''INSERT INTO attendance (student_id, attendance_date, status, day) VALUES (?, ?, ?, ?)
+                                     ON CONFLICT(student_id, attendance_date) DO UPDATE SET status=excluded.status, day=excluded.day''',
+                                 [(student_id, today, status, day_ar) for student_id, _, _, status in changed])
+                conn.commit()
+            except Exception as ex:
+                conn.rollback()
+                show_error_dialog(e.page, f"خطأ في حفظ الحضور: {ex}")
+                return
+            finally:
+                conn.close()
+
+            # الإشعارات بعد انتهاء المعاملة، والإرسال نفسه في الخلفية عبر صندوق الصادر
+            pending_messages = [
+                (guardian_chat_id, get_attendance_update_message(student_name, day_ar, today, status))
+                for _, student_name, guardian_chat_id, status in changed
+                if guardian_chat_id and guardian_chat_id != "None"
+            ]
+            enqueue_messages(pending_messages)
+            attendance_table.refresh(students_data)
+
+            if changed:
+                success_message = f"✅ تم تحديث حالة الحضور لعدد {len(changed)} طالب في المجموعة"
+                if pending_messages:
+                    success_message += f"\n📱 تمت جدولة {len(pending_messages)} إشعار لأولياء الأمور المسجلين في التليجرام"
                 show_success_dialog(e.page, success_message)
             else:
-                show_error_dialog(e.page, "لا يوجد طلاب في المجموعة المحددة")
+                show_success_dialog(e.page, "✅ الحضور محفوظ بالفعل، لا توجد تغييرات")
 
         attendance_table = AttendanceTable(students_data, page)
         std_group.on_change = on_group_change
@@ -2086,6 +1945,7 @@ def student_page(page) :
                                         controls=[
                                             search_bar("ابحث بالاسم أو الكود...",on_submit=on_search_submit,),
                                             std_group,
+                                            ft.Row([kiosk_switch, kiosk_status], spacing=20),
                                         ]
                                     )
                                 ),
@@ -2149,19 +2009,18 @@ def student_page(page) :
         # جلب بيانات الطلاب
         # ------------------------
         def get_students(group_id=None, search_name=None):
-            conn = sqlite3.connect(students_db_path)
-            c = conn.cursor()
+            conn = get_connection()
+            exam_tables = ("students", "exams")
             if group_id:
-                c.execute('''SELECT s.code, s.first_name || ' ' || s.father_name || ' ' || s.family_name,
-                            (SELECT student_score || '/' || total_score FROM exams WHERE student_id = s.id ORDER BY date(exam_date) DESC, id DESC LIMIT 1) as last_grade,
+                students = cached_fetchall(conn, '''SELECT s.code, s.full_name,
+                            (SELECT student_score || '/' || total_score FROM exams WHERE student_id = s.id ORDER BY exam_date DESC, id DESC LIMIT 1) as last_grade,
                             (SELECT COUNT(*) FROM exams WHERE student_id = s.id) as num_exams
-                            FROM students s WHERE s.group_id=? ORDER BY s.first_name, s.father_name, s.family_name''', (group_id,))
+                            FROM students s WHERE s.group_id=? ORDER BY s.first_name, s.father_name, s.family_name''', (group_id,), exam_tables)
             else:
-                c.execute('''SELECT s.code, s.first_name || ' ' || s.father_name || ' ' || s.family_name,
-                            (SELECT student_score || '/' || total_score FROM exams WHERE student_id = s.id ORDER BY date(exam_date) DESC, id DESC LIMIT 1) as last_grade,
+                students = cached_fetchall(conn, '''SELECT s.code, s.full_name,
+                            (SELECT student_score || '/' || total_score FROM exams WHERE student_id = s.id ORDER BY exam_date DESC, id DESC LIMIT 1) as last_grade,
                             (SELECT COUNT(*) FROM exams WHERE student_id = s.id) as num_exams
-                            FROM students s ORDER BY s.first_name, s.father_name, s.family_name''')
-            students = c.fetchall()
+                            FROM students s ORDER BY s.first_name, s.father_name, s.family_name''', tables=exam_tables)
             conn.close()    
 
             if search_name:
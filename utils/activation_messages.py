@@ -1,3 +1,5 @@
+from utils.date_utils import to_display_date
+
 def get_student_welcome_message(student_name: str) -> str:
     """
     إنشاء رسالة ترحيبية للطالب
@@ -53,4 +55,20 @@ def get_activation_message(name: str, code: str, is_guardian: bool = False) -> s
 🔗 t.me/studentMang_bot?start={activation_code}
 
 ⚠️ هذا الرابط خاص بك، لا تشاركه مع أحد.
-"""
\ No newline at end of file
+"""
+
+def get_attendance_update_message(student_name: str, day_ar: str, date_str: str, status: str = "حاضر") -> str:
+    """
+    إنشاء رسالة تحديث الحضور لولي الأمر
+    :param student_name: اسم الطالب
+    :param day_ar: اسم اليوم
+    :param date_str: التاريخ المخزن (ISO)
+    :param status: حالة الحضور
+    :return: نص الرسالة
+    """
+    message = f"⏰ تحديث حالة الحضور\n"
+    message += f"الطالب: {student_name}\n"
+    message += f"اليوم: {day_ar}\n"
+    message += f"التاريخ: {to_display_date(date_str)}\n"
+    message += f"الحالة: {status}\n"
+    return message
@@ -1,45 +1,33 @@
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-import sqlite3
 
-from utils.database import students_db_path
+from utils.database import get_connection
 
 def init_codes():
-    with sqlite3.connect(students_db_path) as conn:
+    """توزيع أكواد للطلاب الذين ليس لديهم كود، وإرجاع عدد الأكواد المضافة"""
+    with get_connection() as conn:
         c = conn.cursor()
 
-        # 1️⃣ إنشاء العمود لو مش موجود
-        # إضافة عمود code للطلاب لو مش موجود
-        c.execute("PRAGMA table_info(students)")
-        columns = [row[1] for row in c.fetchall()]
-        if "code" not in columns:
-            c.execute('ALTER TABLE students ADD COLUMN code INTEGER')
-        
-
-        # 2️⃣ توزيع أكواد للطلاب القدامى
-        c.execute("SELECT id, code FROM students ORDER BY id")
-        students = c.fetchall()
-        
-        next_code = 1001
-        for student_id, code in students:
-            if code is None:  # الطالب معندوش كود
-                c.execute("UPDATE students SET code = ? WHERE id = ?", (next_code, student_id))
-                next_code += 1
-            else:
-                # تحديث العداد بحيث يفضل أكبر من أي كود موجود
-                if code is not None:  # تأكد من أن الكود موجود
-                    code_int = int(code)  # تحويل الكود لرقم صحيح
-                    if code_int >= next_code:
-                        next_code = code_int + 1
+        c.execute("SELECT id FROM students WHERE code IS NULL OR code = '' ORDER BY id")
+        missing = [row[0] for row in c.fetchall()]
+        if not missing:
+            return 0
 
+        # الأكواد الجديدة تبدأ بعد أكبر كود موجود
+        next_code = get_next_code()
+        c.executemany(
+            "UPDATE students SET code = ? WHERE id = ?",
+            [(next_code + i, student_id) for i, student_id in enumerate(missing)]
+        )
         conn.commit()
-    print("Codes have been distributed successfully!")
+    print(f"Codes have been distributed successfully! ({len(missing)})")
+    return len(missing)
 
 def get_next_code():
-    with sqlite3.connect(students_db_path) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
-        c.execute("SELECT MAX(code) FROM students")
+        c.execute("SELECT MAX(code_int) FROM students")  # من نهاية الفهرس مباشرة
         max_code = c.fetchone()[0]
         if not max_code:
             return 1001
@@ -48,6 +36,3 @@ def get_next_code():
         if max_code < 1000:
             return 1001
         return max_code + 1
-
-init_codes()
-print("Next code to be distributed:", get_next_code())
@@ -0,0 +1,292 @@
+"""
+وضع المسح السريع للحضور - Attendance Kiosk
+
+مصمم للمسح المتواصل للباركود وقت دخول الطلاب (مسحة كل 200ms أو أسرع):
+
+1. المسحة تُحل من الذاكرة (CodeDirectory) بدون أي استعلام
+2. تُكتب سطراً في ملف يومية JSONL محلي وتُؤكد للواجهة فوراً
+3. خيط خلفي يجمع المسحات ويكتبها في جدول attendance بمعاملة واحدة (executemany)
+   كل FLUSH_INTERVAL ثانية أو عند تجمع FLUSH_BATCH مسحة
+4. بعد نجاح المعاملة فقط تُضاف إشعارات أولياء الأمور لصندوق الصادر دفعة واحدة،
+   ثم يُحذف ملف اليومية الخاص بهذه الدفعة
+
+إذا أُغلق التطبيق قبل الكتابة، تُعاد قراءة ملفات اليومية عند التشغيل التالي وتُكتب
+(الإدراج ON CONFLICT DO UPDATE فلا يتكرر سجل الحضور).
+مسحة طالب حُذف قبل الكتابة تُتجاهل، وملف دفعة فيه بيانات تالفة يُنقل جانباً (.failed)
+حتى لا تتوقف الدفعات التالية خلفه.
+
+الاستخدام النموذجي:
+    kiosk = AttendanceKiosk()
+    kiosk.start()
+    ok, student, message = kiosk.record_scan(barcode, group_id)
+    ...
+    kiosk.stop()
+"""
+
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import time
+from datetime import date, datetime
+from threading import Event, Lock, Thread
+
+from utils.activation_messages import get_attendance_update_message
+from utils.database import base_path, get_connection
+from utils.date_utils import WEEKDAYS_AR
+from utils.scan_lookup import CodeDirectory, decode_scan
+from utils.telegram_outbox import enqueue_messages
+
+
+JOURNAL_PATH = os.path.join(base_path, "attendance_journal.jsonl")
+PRESENT = "حاضر"
+
+
+class AttendanceKiosk:
+    """
+    يومية كتابة مؤجلة لمسحات الحضور مع تفريغ على دفعات في خيط خلفي.
+    Singleton: الصفحة تُبنى من جديد مع كل زيارة، ويجب ألا يكتب أكثر من كاتب في نفس ملف اليومية.
+    """
+    _instance = None
+    _instance_lock = Lock()
+
+    FLUSH_INTERVAL = 2.0   # ثوانٍ
+    FLUSH_BATCH = 50       # مسحات
+
+    def __new__(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = super(AttendanceKiosk, cls).__new__(cls)
+                cls._instance._initialize()
+            return cls._instance
+
+    def _initialize(self, journal_path=JOURNAL_PATH):
+        self.journal_path = journal_path
+        self._lock = Lock()            # يحمي اليومية والمسحات المعلقة
+        self._flush_lock = Lock()      # دفعة واحدة تُكتب في كل مرة
+        self._pending = []
+        self._batches = []             # (ملف الدفعة، المسحات) بانتظار الكتابة
+        self._journal = None
+        self._seen = set()             # (student_id, date) المسجلة في هذه الجلسة
+        self._wake = Event()
+        self._stop = Event()
+        self._thread = None
+        self.recorded = 0
+
+    # ================= التشغيل والإيقاف =================
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._batches = []
+        self.recorded = 0
+        self._recover()
+        self._load_today()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._thread = Thread(target=self._run, name="attendance-kiosk", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logging.info("تم تشغيل وضع المسح السريع للحضور")
+
+    def stop(self):
+        """إيقاف الخيط الخلفي بعد كتابة كل المسحات المعلقة"""
+        if not self.running:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+        atexit.unregister(self.stop)
+        logging.info(f"تم إيقاف وضع المسح السريع للحضور ({self.recorded} مسحة)")
+
+    # ================= المسح =================
+    def record_scan(self, value, group_id=None):
+        """
+        تسجيل مسحة باركود بدون انتظار قاعدة البيانات.
+        يرجع (نجاح، الطالب أو None، رسالة للعرض)
+        """
+        if decode_scan(value) is None:
+            return False, None, "قيمة الباركود غير صالحة"
+        student = CodeDirectory().resolve(value)
+        if student is None:
+            return False, None, "لم يتم العثور على الطالب"
+        if group_id and str(student["group_id"]) != str(group_id):
+            return False, student, f"{student['name']} ليس في هذه المجموعة"
+
+        today = date.today()
+        key = (student["id"], today.isoformat())
+        entry = {
+            "student_id": student["id"],
+            "date": today.isoformat(),
+            "day": WEEKDAYS_AR[today.weekday()],
+            "time": datetime.now().strftime("%H:%M:%S"),
+            "status": PRESENT,
+        }
+        with self._lock:
+            if key in self._seen:
+                return True, student, f"{student['name']} مسجل بالفعل"
+            if self._journal is None:
+                return False, student, "وضع المسح السريع غير مفعل"
+            # سطر واحد لكل مسحة، flush يكفي لحمايته من إغلاق التطبيق المفاجئ
+            self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._journal.flush()
+            self._pending.append(entry)
+            self._seen.add(key)
+            self.recorded += 1
+            pending = len(self._pending)
+
+        if pending >= self.FLUSH_BATCH:
+            self._wake.set()
+        return True, student, f"تم تسجيل حضور {student['name']}"
+
+    # ================= التفريغ =================
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.FLUSH_INTERVAL)
+            self._wake.clear()
+            self._flush_safely()
+        self._flush_safely()
+
+    def _flush_safely(self):
+        try:
+            self.flush()
+        except Exception as e:
+            # المسحات باقية في ملف اليومية وستُعاد المحاولة في الدورة القادمة أو عند التشغيل التالي
+            logging.error(f"خطأ أثناء كتابة مسحات الحضور: {e}", exc_info=True)
+
+    def flush(self):
+        """كتابة المسحات المعلقة في قاعدة البيانات ثم إرسال إشعاراتها للصادر"""
+        with self._flush_lock:
+            with self._lock:
+                if self._pending:
+                    # فصل ملف هذه الدفعة عن الملف الذي تُكتب فيه المسحات الجديدة
+                    batch_path = f"{self.journal_path}.{time.time_ns()}.flushing"
+                    self._journal.close()
+                    os.replace(self.journal_path, batch_path)
+                    self._journal = open(self.journal_path, "a", encoding="utf-8")
+                    self._batches.append((batch_path, self._pending))
+                    self._pending = []
+
+            # دفعة فشلت لسبب مؤقت (قاعدة البيانات مشغولة مثلاً) تبقى أول القائمة بملفها
+            # وتُعاد في الدورة القادمة، أما الدفعة التالفة فتُنقل جانباً ولا توقف ما بعدها
+            written = 0
+            while self._batches:
+                batch_path, entries = self._batches[0]
+                written += self._write_batch_file(batch_path, entries)
+                self._batches.pop(0)
+            return written
+
+    def _write_batch_file(self, batch_path, entries):
+        """كتابة دفعة ثم حذف ملفها. OperationalError (خطأ مؤقت) يُرفع ليُعاد لاحقاً"""
+        try:
+            written = self._write_batch(entries)
+        except sqlite3.OperationalError:
+            raise
+        except (sqlite3.Error, KeyError, TypeError) as e:
+            failed_path = f"{batch_path}.failed"
+            os.replace(batch_path, failed_path)
+            logging.error(f"دفعة مسحات حضور تالفة نُقلت إلى {failed_path}: {e}")
+            self._forget(entries)
+            return 0
+        os.remove(batch_path)
+        return written
+
+    def _forget(self, entries):
+        """إزالة مسحات دفعة لم تُكتب من _seen حتى يمكن مسح أصحابها مرة أخرى"""
+        keys = {
+            (entry.get("student_id"), entry.get("date"))
+            for entry in entries if isinstance(entry, dict)
+        }
+        with self._lock:
+            self._seen -= keys
+        logging.warning(f"يمكن إعادة مسح {len(keys)} طالب لم يُسجل حضورهم")
+
+    def _write_batch(self, entries):
+        conn = get_connection()
+        try:
+            # مسحة طالب حُذف بعد مسحها لا تُدرج (وإلا فشلت الدفعة كلها بالمفتاح الأجنبي)
+            conn.executemany('''INSERT INTO attendance (student_id, attendance_date, status, day, attendance_time)
+                                SELECT :student_id, :date, :status, :day, :time
+                                WHERE EXISTS (SELECT 1 FROM students WHERE id = :student_id)
+                                ON CONFLICT(student_id, attendance_date)
+                                DO UPDATE SET status=excluded.status, day=excluded.day,
+                                              attendance_time=excluded.attendance_time''', entries)
+            student_ids = list({entry["student_id"] for entry in entries})
+            existing = {
+                row[0] for row in conn.execute(
+                    f"SELECT id FROM students WHERE id IN ({','.join('?' * len(student_ids))})", student_ids)
+            }
+            conn.commit()
+        finally:
+            conn.close()
+
+        written = [entry for entry in entries if entry["student_id"] in existing]
+        if len(written) < len(entries):
+            logging.warning(f"تم تجاهل {len(entries) - len(written)} مسحة حضور لطلاب محذوفين")
+        logging.info(f"تمت كتابة {len(written)} مسحة حضور")
+
+        directory = CodeDirectory()
+        messages = []
+        for entry in written:
+            student = directory.by_id(entry["student_id"])
+            if student and student["guardian_chat_id"]:
+                messages.append((student["guardian_chat_id"],
+                                 get_attendance_update_message(student["name"], entry["day"], entry["date"])))
+        if messages:
+            enqueue_messages(messages)
+        return len(written)
+
+    # ================= الاستعادة =================
+    def _load_today(self):
+        """الطلاب المسجل حضورهم اليوم بالفعل حتى لا يتكرر التسجيل والإشعار عند إعادة المسح"""
+        today = date.today().isoformat()
+        conn = get_connection()
+        try:
+            rows = conn.execute("SELECT student_id FROM attendance WHERE attendance_date = ? AND status = ?",
+                                (today, PRESENT)).fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            self._seen = {(student_id, today) for (student_id,) in rows}
+
+    def _recover(self):
+        """
+        كتابة مسحات بقيت في ملفات اليومية من تشغيل سابق لم يكتمل.
+        كل ملف مستقل: الملف الذي يفشل لسبب مؤقت يُترك للخيط الخلفي ليعيد المحاولة.
+        """
+        if os.path.exists(self.journal_path):
+            # اليومية السابقة تصبح ملف دفعة حتى لا تختلط بمسحات هذا التشغيل
+            os.replace(self.journal_path, f"{self.journal_path}.{time.time_ns()}.flushing")
+
+        directory, name = os.path.split(self.journal_path)
+        paths = sorted(
+            os.path.join(directory, f) for f in os.listdir(directory or ".")
+            if f.startswith(name + ".") and f.endswith(".flushing")
+        )
+        for path in paths:
+            entries = []
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # سطر أخير غير مكتمل إذا انقطع التطبيق أثناء الكتابة
+                        continue
+            if not entries:
+                os.remove(path)
+                continue
+            try:
+                if self._write_batch_file(path, entries):
+                    logging.info(f"تمت استعادة مسحات حضور من {path}")
+            except sqlite3.OperationalError as e:
+                logging.warning(f"تعذرت استعادة {path} الآن وستُعاد المحاولة في الخلفية: {e}")
+                self._batches.append((path, entries))
@@ -0,0 +1,301 @@
+"""
+محرك توليد الباركود - Barcode Engine
+
+يولد صور باركود EAN-13 لمجموعة طلاب دفعة واحدة:
+
+1. الخطوط وفئة EAN وخيارات الكاتب تُحمل مرة واحدة لكل عملية (وليس لكل طالب)
+2. الباركود واسم الطالب يُركبان في الذاكرة ويُكتب ملف PNG مرة واحدة فقط
+3. الطلاب يُوزعون على مجموعة عمليات (ProcessPoolExecutor) عند الدفعات الكبيرة
+4. مسارات الباركود تُحفظ في قاعدة البيانات بـ executemany واحد
+
+ذاكرة الصور معنونة بالمحتوى: اسم كل ملف هو بصمة (الكود + الاسم + إعدادات الرسم)،
+لذلك تغيير اسم الطالب أو الخط أو الإعدادات ينتج ملفاً جديداً تلقائياً، وما لم يتغير
+لا يُعاد رسمه. ملف manifest.json يسجل الملفات التي يملكها المحرك حتى يمكن حذف
+غير المستخدم منها دون لمس أي ملفات أخرى في المجلد.
+
+الاستخدام النموذجي:
+    from utils.barcode_engine import sync_barcodes
+    stats = sync_barcodes(barcodes_dir)
+
+القياس:
+    python benchmarks/bench_barcodes.py
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import barcode
+from barcode.writer import ImageWriter
+from PIL import Image, ImageDraw, ImageFont
+import arabic_reshaper
+from bidi.algorithm import get_display
+
+
+# خيارات رسم الباركود (تُمرر لـ render مباشرة لأن render يعيد الخيارات الافتراضية للكاتب)
+WRITER_OPTIONS = {
+    "module_width": 0.35,
+    "module_height": 20.0,
+    "font_size": 12,
+    "text_distance": 2,
+    "quiet_zone": 1.0,
+    "write_text": True,
+}
+
+NAME_FONT_SIZE = 22
+# الباركود أبيض وأسود فقط: صورة رمادية بضغط سريع أصغر وأسرع في الترميز من RGB
+IMAGE_MODE = "L"
+PNG_COMPRESS_LEVEL = 1
+FONT_PATHS = [
+    "Amiri-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "arialbd.ttf",
+    "NotoNaskhArabic-Bold.ttf",
+]
+
+# يُزاد عند تغيير طريقة الرسم نفسها (وليس الإعدادات) لإبطال كل الصور القديمة
+RENDER_VERSION = 2
+MANIFEST_NAME = "manifest.json"
+# ملفات الإصدار السابق كانت تُسمى بكود الطالب فقط
+_LEGACY_FILE_RE = re.compile(r"^\d+\.png$")
+
+# الصور المصغرة لجدول العرض: ضعف مقاس الخلية (120x40) حتى تبقى واضحة على الشاشات عالية الدقة
+THUMBNAIL_DIR = "thumbs"
+THUMBNAIL_SIZE = (240, 80)
+
+# أقل عدد من الطلاب يستحق تكلفة تشغيل عمليات إضافية
+PARALLEL_THRESHOLD = 200
+CHUNK_SIZE = 25
+
+# حالة كل عملية: تُملأ مرة واحدة في _init_worker
+_worker = {}
+
+
+def load_name_font(size=NAME_FONT_SIZE):
+    """أول خط متاح من FONT_PATHS، أو الخط الافتراضي"""
+    for path in FONT_PATHS:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def _init_worker():
+    _worker["ean"] = barcode.get_barcode_class("ean13")
+    _worker["font"] = load_name_font()
+
+
+def barcode_value(code):
+    """القيمة المرمزة (12 رقماً، والرقم 13 للتحقق يضيفه EAN) لكود الطالب"""
+    return str(code).zfill(4).rjust(12, "0")
+
+
+def render_barcode_image(code, student_name):
+    """رسم الباركود مع اسم الطالب فوقه في صورة واحدة في الذاكرة"""
+    if not _worker:
+        _init_worker()
+    font = _worker["font"]
+
+    img = _worker["ean"](barcode_value(code), writer=ImageWriter(mode=IMAGE_MODE)).render(WRITER_OPTIONS)
+    img_width, img_height = img.size
+
+    try:
+        bidi_text = get_display(arabic_reshaper.reshape(student_name))
+    except Exception:
+        bidi_text = student_name
+
+    bbox = ImageDraw.Draw(img).textbbox((0, 0), bidi_text, font=font)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+
+    composite = Image.new(IMAGE_MODE, (img_width, img_height + NAME_FONT_SIZE + 20), 255)
+    x = max(3, (img_width - text_width) / 2)
+    ImageDraw.Draw(composite).text((x, 10), bidi_text, font=font, fill=0)
+    composite.paste(img, (0, text_height + 20))
+    return composite
+
+
+def _render_job(job):
+    """(student_id, code, name, path) -> (student_id, path, error)"""
+    student_id, code, student_name, path = job
+    try:
+        render_barcode_image(code, student_name).save(path, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+        return student_id, path, None
+    except Exception as e:
+        return student_id, None, f"{code}: {e}"
+
+
+def render_barcodes(jobs, workers=None):
+    """
+    تنفيذ مجموعة مهام رسم [(student_id, code, name, path)...] وإرجاع النتائج بنفس الترتيب.
+    الدفعات الصغيرة تُرسم في نفس العملية، والكبيرة تُوزع على عمليات.
+    """
+    jobs = list(jobs)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(jobs) < PARALLEL_THRESHOLD:
+        return [_render_job(job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        return list(pool.map(_render_job, jobs, chunksize=CHUNK_SIZE))
+
+
+def render_settings_fingerprint():
+    """بصمة كل ما يؤثر على شكل الصورة غير الكود والاسم"""
+    font = load_name_font()
+    settings = {
+        "version": RENDER_VERSION,
+        "writer": WRITER_OPTIONS,
+        "name_font_size": NAME_FONT_SIZE,
+        "font": getattr(font, "path", "default"),
+        "mode": IMAGE_MODE,
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def barcode_key(code, student_name, fingerprint):
+    """اسم ملف الصورة: بصمة المحتوى الذي يظهر فيها"""
+    content = f"{fingerprint}|{code}|{student_name}"
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()[:20]
+
+
+def load_manifest(barcodes_dir):
+    path = os.path.join(barcodes_dir, MANIFEST_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get("entries"), dict):
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"fingerprint": None, "entries": {}}
+
+
+def save_manifest(barcodes_dir, manifest):
+    # الكتابة في ملف مؤقت ثم استبداله حتى لا يبقى manifest نصف مكتوب عند انقطاع مفاجئ
+    path = os.path.join(barcodes_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def sync_barcodes(barcodes_dir, workers=None, collect_garbage=True):
+    """
+    مزامنة صور الباركود مع بيانات الطلاب:
+    - رسم الصور الناقصة فقط (طالب جديد، أو تغير اسمه أو كوده أو إعدادات الرسم)
+    - تصحيح barcode_path لمن تغير ملفه، بـ executemany واحد
+    - حذف الصور التي لم يعد يستخدمها أي طالب (ملفات المحرك فقط)
+    يرجع {"generated", "reused", "relinked", "removed", "errors"}
+    """
+    # استيراد متأخر حتى لا تفتح عمليات الرسم قاعدة البيانات عند استيراد الوحدة
+    from utils.database import get_connection
+
+    os.makedirs(barcodes_dir, exist_ok=True)
+    manifest = load_manifest(barcodes_dir)
+    fingerprint = render_settings_fingerprint()
+
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT id, code, first_name, father_name, family_name, barcode_path FROM students WHERE code IS NOT NULL"
+        ).fetchall()
+
+    live = {}
+    jobs = []
+    relink = []
+    for student_id, code, first_name, father_name, family_name, barcode_path in rows:
+        if not code:
+            continue
+        student_name = f"{first_name} {father_name} {family_name}"
+        key = barcode_key(code, student_name, fingerprint)
+        path = os.path.join(barcodes_dir, f"{key}.png")
+        live[key] = {"student_id": student_id, "code": str(code)}
+        if not os.path.exists(path):
+            jobs.append((student_id, code, student_name, path))
+        elif barcode_path != path:
+            relink.append((path, student_id))
+
+    results = render_barcodes(jobs, workers)
+    updates = relink + [(path, student_id) for student_id, path, error in results if error is None]
+    errors = [error for _, _, error in results if error is not None]
+
+    if updates:
+        with get_connection() as conn:
+            conn.executemany("UPDATE students SET barcode_path = ? WHERE id = ?", updates)
+            conn.commit()
+
+    removed = 0
+    if collect_garbage:
+        owned = set(manifest["entries"])
+        for file_name in os.listdir(barcodes_dir):
+            key, ext = os.path.splitext(file_name)
+            if ext != ".png" or key in live:
+                continue
+            if key in owned or _LEGACY_FILE_RE.match(file_name):
+                try:
+                    os.remove(os.path.join(barcodes_dir, file_name))
+                    removed += 1
+                    thumb = thumbnail_path(os.path.join(barcodes_dir, file_name))
+                    if os.path.exists(thumb):
+                        os.remove(thumb)
+                except OSError as e:
+                    logging.warning(f"تعذر حذف الباركود القديم {file_name}: {e}")
+        manifest["entries"] = {}
+    failed_keys = {os.path.splitext(os.path.basename(job[3]))[0]
+                   for job, result in zip(jobs, results) if result[2] is not None}
+    manifest["entries"].update({key: entry for key, entry in live.items() if key not in failed_keys})
+    manifest["fingerprint"] = fingerprint
+    save_manifest(barcodes_dir, manifest)
+
+    stats = {
+        "generated": len(updates) - len(relink),
+        "reused": len(live) - len(jobs),
+        "relinked": len(relink),
+        "removed": removed,
+        "errors": errors,
+    }
+    logging.info(
+        f"مزامنة الباركود: رسم {stats['generated']}، إعادة استخدام {stats['reused']}، "
+        f"تحديث مسار {stats['relinked']}، حذف {removed}، أخطاء {len(errors)}"
+    )
+    return stats
+
+
+def thumbnail_path(barcode_path):
+    """مسار الصورة المصغرة المقابلة لصورة باركود"""
+    directory, file_name = os.path.split(barcode_path)
+    return os.path.join(directory, THUMBNAIL_DIR, file_name)
+
+
+def get_thumbnail(barcode_path):
+    """
+    صورة مصغرة لعرضها في الجداول بدلاً من الصورة الكاملة.
+    تُنشأ عند أول طلب وتُعاد إنشاؤها إذا كانت أقدم من الصورة الأصلية.
+    ترجع None إذا لم تكن الصورة الأصلية موجودة.
+    """
+    try:
+        source_mtime = os.stat(barcode_path).st_mtime
+    except (OSError, TypeError):
+        return None
+
+    thumb = thumbnail_path(barcode_path)
+    try:
+        if os.stat(thumb).st_mtime >= source_mtime:
+            return thumb
+    except OSError:
+        pass
+
+    try:
+        os.makedirs(os.path.dirname(thumb), exist_ok=True)
+        with Image.open(barcode_path) as img:
+            img = img.convert(IMAGE_MODE)
+            img.thumbnail(THUMBNAIL_SIZE, Image.LANCZOS)
+            img.save(thumb, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+        return thumb
+    except OSError as e:
+        logging.warning(f"تعذر إنشاء صورة مصغرة لـ {barcode_path}: {e}")
+        return barcode_path
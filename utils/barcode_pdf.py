@@ -0,0 +1,239 @@
+"""
+تصدير أوراق الباركود PDF - Barcode PDF Sheets
+
+يرسم باركود EAN-13 كرسومات متجهة في ReportLab مباشرة بدلاً من إدراج صور PNG:
+- ملفات أصغر وطباعة حادة بأي مقاس
+- لا حاجة لتوليد الصور أولاً، يكفي أن يكون للطالب كود
+
+تصدير كل المجموعات:
+- كل مجموعة تُرسم في عملية مستقلة (ProcessPoolExecutor) وتُكتب في ملفها مباشرة،
+  فلا تبقى صفحات كل المجموعات في الذاكرة معاً
+- ملف لكل مجموعة، أو ملف واحد مدمج (يُدمج بـ pypdf إذا كانت مثبتة)
+
+الاستخدام النموذجي:
+    from utils.barcode_pdf import fetch_group_students, write_group_pdf
+    groups = fetch_group_students([group_id])
+    write_group_pdf(path, groups[group_id]["students"], num_rows=6, num_columns=3)
+"""
+
+import itertools
+import logging
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from reportlab.graphics import renderPDF
+from reportlab.graphics.barcode import createBarcodeDrawing
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+import arabic_reshaper
+from bidi.algorithm import get_display
+
+from utils.barcode_engine import FONT_PATHS, barcode_value
+
+try:
+    from pypdf import PdfWriter
+except ImportError:
+    PdfWriter = None
+
+
+# نفس أبعاد التخطيط المستخدمة سابقاً مع صور PNG
+MARGIN_X = 40
+MARGIN_Y = 40
+BASE_BARCODE_WIDTH = 150
+COL_GAP = 30
+BARCODE_HEIGHT = 80
+ROW_GAP = 50
+NAME_FONT_SIZE = 10
+NAME_FONT = "BarcodeName"
+
+_font_name = None
+# أسماء فريدة لـ Forms الباركود داخل الملف الواحد
+_form_ids = itertools.count(1)
+
+
+def register_name_font():
+    """تسجيل أول خط TTF متاح لأسماء الطلاب (مرة واحدة لكل عملية)"""
+    global _font_name
+    if _font_name is None:
+        _font_name = "Helvetica-Bold"
+        for path in FONT_PATHS:
+            try:
+                pdfmetrics.registerFont(TTFont(NAME_FONT, path))
+                _font_name = NAME_FONT
+                break
+            except Exception:
+                continue
+    return _font_name
+
+
+def compute_layout(num_rows, num_columns, page_size=A4):
+    """مواقع الأعمدة وأبعاد الخلية، مع تصغير العرض إذا لم تتسع الأعمدة للصفحة"""
+    page_width, page_height = page_size
+    available_width = page_width - 2 * MARGIN_X
+    required_width = num_columns * BASE_BARCODE_WIDTH + (num_columns - 1) * COL_GAP
+    if required_width > available_width:
+        barcode_width = max(80, (available_width - (num_columns - 1) * COL_GAP) / num_columns)
+    else:
+        barcode_width = BASE_BARCODE_WIDTH
+
+    return {
+        "rows": num_rows,
+        "columns": num_columns,
+        "width": barcode_width,
+        "height": BARCODE_HEIGHT,
+        "x_positions": [MARGIN_X + col * (barcode_width + COL_GAP) for col in range(num_columns)],
+        "y_start": page_height - MARGIN_Y - BARCODE_HEIGHT,
+        "row_height": BARCODE_HEIGHT + ROW_GAP,
+    }
+
+
+def draw_student_barcode(cpdf, code, student_name, x, y, width, height):
+    """رسم اسم الطالب وتحته الباركود المتجه داخل المستطيل (x, y, width, height)"""
+    font_name = register_name_font()
+    try:
+        name_text = get_display(arabic_reshaper.reshape(student_name))
+    except Exception:
+        name_text = student_name
+
+    name_height = NAME_FONT_SIZE + 4
+    cpdf.setFont(font_name, NAME_FONT_SIZE)
+    cpdf.drawCentredString(x + width / 2, y + height - NAME_FONT_SIZE, name_text)
+
+    drawing = createBarcodeDrawing("EAN13", value=barcode_value(code), barHeight=40, humanReadable=True)
+    scale_x = width / drawing.width
+    scale_y = (height - name_height) / drawing.height
+    drawing.scale(scale_x, scale_y)
+    drawing.width *= scale_x
+    drawing.height *= scale_y
+    renderPDF.draw(drawing, cpdf, x, y)
+
+
+def draw_students(cpdf, students, layout):
+    """
+    رسم الطلاب [(code, name)...] صفاً لكل طالب وتكراره في كل الأعمدة.
+    باركود كل طالب يُرسم مرة واحدة كـ Form داخل الملف ثم يُستدعى في كل عمود،
+    فيقل زمن الرسم وحجم الملف بعدد التكرارات.
+    """
+    width, height = layout["width"], layout["height"]
+    row_count = 0
+    for code, student_name in students:
+        form_name = f"barcode_{next(_form_ids)}"
+        cpdf.beginForm(form_name, 0, 0, width, height)
+        draw_student_barcode(cpdf, code, student_name, 0, 0, width, height)
+        cpdf.endForm()
+
+        y = layout["y_start"] - row_count * layout["row_height"]
+        for x in layout["x_positions"]:
+            cpdf.saveState()
+            cpdf.translate(x, y)
+            cpdf.doForm(form_name)
+            cpdf.restoreState()
+
+        row_count += 1
+        if row_count == layout["rows"]:
+            cpdf.showPage()
+            row_count = 0
+    if row_count:
+        cpdf.showPage()
+
+
+def write_group_pdf(path, students, num_rows=6, num_columns=3):
+    """كتابة ملف PDF لمجموعة واحدة، ويرجع عدد الطلاب"""
+    cpdf = canvas.Canvas(path, pagesize=A4, pageCompression=1)
+    draw_students(cpdf, students, compute_layout(num_rows, num_columns))
+    cpdf.save()
+    return len(students)
+
+
+def _write_group_job(job):
+    path, students, num_rows, num_columns = job
+    write_group_pdf(path, students, num_rows, num_columns)
+    return path
+
+
+def fetch_group_students(group_ids=None):
+    """
+    طلاب كل مجموعة ممن لهم كود في استعلام واحد.
+    يرجع {group_id: {"name": اسم المجموعة، "students": [(code, name)...]}} بترتيب المجموعات.
+    """
+    from utils.database import get_connection
+
+    query = '''
+        SELECT g.id, g.name, s.code, s.first_name, s.father_name, s.family_name
+        FROM students s
+        JOIN groups g ON s.group_id = g.id
+        WHERE s.code IS NOT NULL AND s.code != ''
+    '''
+    params = []
+    if group_ids:
+        query += f" AND g.id IN ({','.join('?' * len(group_ids))})"
+        params = list(group_ids)
+    query += " ORDER BY g.name, g.id, s.first_name, s.father_name, s.family_name"
+
+    groups = {}
+    with get_connection() as conn:
+        for group_id, group_name, code, first_name, father_name, family_name in conn.execute(query, params):
+            group = groups.setdefault(group_id, {"name": group_name, "students": []})
+            group["students"].append((code, f"{first_name} {father_name} {family_name}"))
+    return groups
+
+
+def safe_file_name(name):
+    """اسم ملف صالح على ويندوز من اسم المجموعة"""
+    return re.sub(r'[\\/:*?"<>|]+', "_", str(name)).strip() or "group"
+
+
+def export_all_groups(out_dir, num_rows=6, num_columns=3, merged_path=None, workers=None):
+    """
+    تصدير باركودات كل المجموعات.
+    - بدون merged_path: ملف لكل مجموعة في out_dir، ويرجع قائمة المسارات
+    - مع merged_path: ملف واحد مدمج، ويرجع [merged_path]
+    """
+    groups = fetch_group_students()
+    if not groups:
+        return []
+
+    if merged_path and PdfWriter is None:
+        # بدون pypdf لا يمكن دمج ملفات جاهزة، فتُرسم كل المجموعات في ملف واحد بالتتابع
+        cpdf = canvas.Canvas(merged_path, pagesize=A4, pageCompression=1)
+        layout = compute_layout(num_rows, num_columns)
+        for group in groups.values():
+            draw_students(cpdf, group["students"], layout)
+        cpdf.save()
+        return [merged_path]
+
+    work_dir = tempfile.mkdtemp(prefix="barcode_pdf_") if merged_path else out_dir
+    os.makedirs(work_dir, exist_ok=True)
+    jobs = [
+        (os.path.join(work_dir, f"{index:03d}_{safe_file_name(group['name'])}_barcodes.pdf"),
+         group["students"], num_rows, num_columns)
+        for index, group in enumerate(groups.values(), start=1)
+    ]
+
+    try:
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        if workers <= 1:
+            paths = [_write_group_job(job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                paths = list(pool.map(_write_group_job, jobs))
+
+        if not merged_path:
+            return paths
+
+        writer = PdfWriter()
+        for path in paths:
+            writer.append(path)
+        with open(merged_path, "wb") as f:
+            writer.write(f)
+        writer.close()
+        return [merged_path]
+    finally:
+        if merged_path:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        logging.info(f"تم تصدير باركودات {len(groups)} مجموعة")
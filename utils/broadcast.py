@@ -0,0 +1,194 @@
+"""
+خط إرسال الرسائل الجماعية - Broadcast Pipeline
+
+يقسم الإرسال الجماعي إلى ثلاث مراحل تعمل كلها في خيط خلفي حتى لا تتجمد الواجهة:
+
+1. التحميل: بيانات كل الطلاب المختارين دفعة واحدة (دالة load يمررها المستدعي)
+2. التجهيز: بناء نصوص الرسائل بمجموعة خيوط (ThreadPoolExecutor)
+3. الإرسال:
+   - تليجرام: إضافة الرسائل لصندوق الصادر على دفعات (enqueue_messages)، والصادر
+     يتولى الإرسال المتوازي مع احترام حدود المعدل
+   - واتساب: بالتتابع لأن pywhatkit يتحكم في المتصفح ولا يحتمل إرسالين معاً
+
+التقدم يُبلغ للواجهة بمعدل محدود (كل PROGRESS_INTERVAL ثانية على الأكثر)،
+ويمكن إلغاء العملية في أي وقت بين الرسائل عبر cancel().
+
+الاستخدام النموذجي:
+    job = BroadcastJob(load, render, on_progress, on_done)
+    job.start(student_ids, "تليجرام", to_value)
+    ...
+    job.cancel()
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+
+from utils.telegram_outbox import enqueue_messages
+from utils.whatsapp_manager import send_whatsapp_message
+
+
+PLATFORM_TELEGRAM = "تليجرام"
+PLATFORM_WHATSAPP = "واتساب"
+
+
+class BroadcastResult:
+    """ملخص عملية إرسال جماعي"""
+
+    def __init__(self, total=0):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.skipped = []       # نصوص توضح سبب تخطي كل طالب
+        self.cancelled = False
+        self.error = None       # رسالة الخطأ إذا توقفت العملية بسبب الاتصال مثلاً
+
+    @property
+    def processed(self):
+        return self.sent + self.failed + len(self.skipped)
+
+
+class BroadcastJob:
+    """
+    عملية إرسال جماعي واحدة.
+    - load(student_ids) -> {student_id: student_data}
+    - render(student_data) -> نص الرسالة أو None لتخطي الطالب
+    - on_progress(result) و on_done(result) تُستدعى من الخيط الخلفي
+    """
+
+    RENDER_WORKERS = 4
+    ENQUEUE_CHUNK = 50
+    PROGRESS_INTERVAL = 0.25   # ثوانٍ بين تحديثين للواجهة
+
+    def __init__(self, load, render, on_progress=None, on_done=None):
+        self._load = load
+        self._render = render
+        self._on_progress = on_progress
+        self._on_done = on_done
+        self._cancel = Event()
+        self._thread = None
+        self._last_progress = 0.0
+        self.result = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, student_ids, platform, to_value="ولي الأمر"):
+        """بدء الإرسال في خيط خلفي"""
+        if self.running:
+            return False
+        self._cancel.clear()
+        self.result = BroadcastResult(len(student_ids))
+        self._thread = Thread(
+            target=self._run, args=(list(student_ids), platform, to_value),
+            name="broadcast", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def cancel(self):
+        """طلب إيقاف العملية، الرسائل التي أُضيفت للصادر بالفعل لن تُسحب"""
+        self._cancel.set()
+
+    # ================= المراحل =================
+    def _run(self, student_ids, platform, to_value):
+        result = self.result
+        try:
+            data = self._load(student_ids)
+            recipients = self._collect_recipients(student_ids, data, platform, to_value)
+            if not self._cancel.is_set():
+                messages = self._render_all(recipients)
+                if platform == PLATFORM_TELEGRAM:
+                    self._send_telegram(messages)
+                else:
+                    self._send_whatsapp(messages)
+        except Exception as e:
+            logging.error(f"خطأ أثناء الإرسال الجماعي: {e}", exc_info=True)
+            result.error = str(e)
+        finally:
+            result.cancelled = self._cancel.is_set()
+            self._report(force=True)
+            logging.info(
+                f"إرسال جماعي عبر {platform}: {result.sent} تم، {result.failed} فشل، "
+                f"{len(result.skipped)} تم تخطيه من أصل {result.total}"
+                + (" (تم الإلغاء)" if result.cancelled else "")
+            )
+            if self._on_done:
+                self._on_done(result)
+
+    def _collect_recipients(self, student_ids, data, platform, to_value):
+        """استبعاد الطلاب بدون وسيلة تواصل قبل تجهيز أي رسالة"""
+        is_guardian = to_value == "ولي الأمر"
+        if platform == PLATFORM_TELEGRAM:
+            key, label = ("guardian_chat_id" if is_guardian else "chat_id"), "معرف تليجرام"
+        else:
+            key, label = ("parent_phone" if is_guardian else "phone"), "رقم هاتف"
+
+        recipients = []
+        for student_id in student_ids:
+            student_data = data.get(student_id)
+            if student_data is None:
+                self.result.skipped.append(f"طالب رقم {student_id} (غير موجود)")
+                continue
+            address = student_data.get(key)
+            if not address or not str(address).strip():
+                self.result.skipped.append(f"{student_data['name']} (لا يوجد {label} {to_value})")
+                continue
+            recipients.append((student_data, str(address).strip()))
+        self._report()
+        return recipients
+
+    def _render_all(self, recipients):
+        """بناء نصوص الرسائل بالتوازي مع الحفاظ على ترتيب الطلاب"""
+        if not recipients:
+            return []
+        with ThreadPoolExecutor(max_workers=self.RENDER_WORKERS) as pool:
+            texts = list(pool.map(lambda r: self._render(r[0]), recipients))
+
+        messages = []
+        for (student_data, address), text in zip(recipients, texts):
+            if not text:
+                self.result.skipped.append(f"{student_data['name']} (لا توجد رسالة)")
+                continue
+            messages.append((student_data, address, text))
+        return messages
+
+    def _send_telegram(self, messages):
+        for start in range(0, len(messages), self.ENQUEUE_CHUNK):
+            if self._cancel.is_set():
+                return
+            chunk = messages[start:start + self.ENQUEUE_CHUNK]
+            queued = enqueue_messages([(address, text) for _, address, text in chunk])
+            self.result.sent += queued
+            self.result.failed += len(chunk) - queued
+            self._report()
+
+    def _send_whatsapp(self, messages):
+        for student_data, address, text in messages:
+            if self._cancel.is_set():
+                return
+            success, message = send_whatsapp_message(address, text)
+            if success:
+                self.result.sent += 1
+            else:
+                self.result.failed += 1
+                if "اتصال" in message or "إنترنت" in message:
+                    # لا فائدة من إكمال باقي الطلاب بدون اتصال
+                    self.result.error = message
+                    return
+            self._report()
+
+    def _report(self, force=False):
+        if not self._on_progress:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_progress < self.PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        try:
+            self._on_progress(self.result)
+        except Exception as e:
+            # مثلاً إغلاق الصفحة أثناء الإرسال، لا يجب أن يوقف ذلك الإرسال نفسه
+            logging.warning(f"تعذر تحديث تقدم الإرسال: {e}")
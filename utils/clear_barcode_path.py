@@ -2,12 +2,12 @@ import sqlite3
 import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from utils.database import students_db_path
+from utils.database import students_db_path, get_connection
 from datetime import datetime, date
 
 def clear_barcode_paths():
     try:
-        with sqlite3.connect(students_db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
             # تفريغ المسارات فقط
             c.execute("UPDATE students SET barcode_path = NULL")
@@ -28,7 +28,7 @@ def clean_old_payments(before_year: int = None):
         before_year = int(datetime.now().strftime('%Y')) - 2  # حذف قبل سنتين افتراضياً
     conn = None
     try:
-        conn = sqlite3.connect(students_db_path)
+        conn = get_connection()
         c = conn.cursor()
         # حذف السجلات حيث month < 'YYYY-01' للسنة المحددة
         cutoff_month = f"{before_year}-01"
@@ -49,7 +49,7 @@ def clear_all_payments():
     """
     conn = None
     try:
-        conn = sqlite3.connect(students_db_path)
+        conn = get_connection()
         c = conn.cursor()
         c.execute('DELETE FROM payments')
         deleted_rows = c.rowcount
@@ -2,8 +2,15 @@ import os
 import shutil
 import sqlite3
 import logging
+import atexit
+import sys
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
+from utils.date_utils import normalize_date_column
+from utils.student_search import create_search_index
+
 # إعداد الـ logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -57,184 +64,767 @@ def get_writable_db_path():
 # استدعاء الدالة للحصول على مسار قاعدة البيانات
 students_db_path = get_writable_db_path()
 
-def init_db():
-    logging.info("بدء تهيئة قاعدة البيانات")
+# ================= مجمع الاتصالات =================
+class PooledConnection(sqlite3.Connection):
+    """
+    اتصال مشترك لكل خيط، لا يُستخدم مباشرة بل عبر ConnectionHandle،
+    والإغلاق الحقيقي يتم عند إيقاف التطبيق.
+    """
+
+    owners = 0  # عدد المقابض الحية التي تملك معاملة هذا الاتصال
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def _close(self):
+        super().close()
+
+
+class ConnectionHandle:
+    """
+    اتصال منطقي فوق اتصال الخيط المشترك، يُعاد من get_connection().
+
+    كل الدوال في نفس الخيط تتشارك معاملة واحدة، فالمقبض الذي يُطلب أثناء معاملة
+    مفتوحة (دالة مساعدة داخل معاملة دالة أخرى) لا يملكها: commit و rollback و close
+    والخروج من with لا تفعل شيئاً، وتبقى المعاملة لصاحبها الذي يحفظها أو يلغيها.
+    المقبض المالك يتصرف كاتصال sqlite3 عادي، وclose() منه تلغي ما لم يُحفظ.
+    """
+    __slots__ = ("_conn", "_owner", "_released")
+
+    def __init__(self, conn):
+        if conn.in_transaction and conn.owners == 0:
+            # معاملة متروكة من مقبض انتهى بدون commit أو close
+            logging.warning("إلغاء معاملة غير محفوظة متروكة على اتصال الخيط")
+            conn.rollback()
+        owner = not conn.in_transaction
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_owner", owner)
+        object.__setattr__(self, "_released", not owner)
+        if owner:
+            conn.owners += 1
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def _release(self):
+        if not self._released:
+            object.__setattr__(self, "_released", True)
+            self._conn.owners -= 1
+
+    def commit(self):
+        if self._owner:
+            self._conn.commit()
+
+    def rollback(self):
+        if self._owner:
+            self._conn.rollback()
+
+    def close(self):
+        if self._owner and self._conn.in_transaction:
+            self._conn.rollback()
+        self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._owner:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        return False
+
+    def __del__(self):
+        try:
+            self._release()
+        except AttributeError:
+            pass
+
+
+class ConnectionPool:
+    """اتصال واحد لكل خيط ولكل قاعدة بيانات مع إعدادات أداء ثابتة"""
+
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=-16000",       # حوالي 16 ميجابايت
+        "PRAGMA mmap_size=268435456",     # 256 ميجابايت
+        "PRAGMA busy_timeout=5000",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA foreign_keys=ON",         # الحذف المتتابع ومنع السجلات اليتيمة
+    )
+
+    def __init__(self, cached_statements=256):
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []  # (الخيط، الاتصال) لكل اتصال مفتوح
+        self._pid = os.getpid()
+
+    def _reset_after_fork(self):
+        # الاتصالات الموروثة من العملية الأم لا يجوز استخدامها في عملية فرعية
+        self._local = threading.local()
+        self._connections = []
+        self._pid = os.getpid()
+
+    def _open(self, db_path):
+        conn = sqlite3.connect(
+            db_path,
+            timeout=5,
+            factory=PooledConnection,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+        )
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        conn.db_path = db_path
+        return conn
+
+    def get(self, db_path):
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = {}
+
+        conn = conns.get(db_path)
+        if conn is None:
+            conn = self._open(db_path)
+            conns[db_path] = conn
+            with self._lock:
+                self._prune_dead_threads()
+                self._connections.append((threading.current_thread(), conn))
+        return conn
+
+    def _prune_dead_threads(self):
+        # إغلاق اتصالات الخيوط المنتهية (مثل خيوط حفظ الدرجات المؤقتة)
+        alive = []
+        for thread, conn in self._connections:
+            if thread.is_alive():
+                alive.append((thread, conn))
+            else:
+                try:
+                    conn._close()
+                except sqlite3.Error:
+                    pass
+        self._connections = alive
+
+    def close_all(self):
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            for _, conn in self._connections:
+                try:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    conn._close()
+                except sqlite3.Error as e:
+                    logging.warning(f"تحذير أثناء إغلاق اتصال قاعدة البيانات: {e}")
+            self._connections = []
+        self._local = threading.local()
+
+
+_pool = ConnectionPool()
+
+
+def get_connection(db_path=None):
+    """الحصول على اتصال منطقي فوق اتصال الخيط الحالي في المجمع (يُنشأ عند أول طلب)"""
+    return ConnectionHandle(_pool.get(db_path or students_db_path))
+
+
+def close_all_connections():
+    """إغلاق كل اتصالات المجمع، تُستدعى عند إيقاف التطبيق"""
+    _pool.close_all()
+
+
+atexit.register(close_all_connections)
+
+# ================= ذاكرة نتائج الاستعلامات =================
+class QueryCache:
+    """
+    نتائج استعلامات القراءة المتكررة في الذاكرة (LRU بحد أقصى للحجم) لقاعدة البيانات الرئيسية.
+
+    كل نتيجة تُحفظ مع أرقام إصدارات الجداول التي تعتمد عليها (table_versions، تزيدها triggers
+    مع كل تعديل حتى من عملية بوت تيليجرام)، وتُرفض إذا تغير أي منها.
+    أرقام الإصدارات نفسها لا تُقرأ مع كل استعلام: PRAGMA data_version (تعديلات اتصالات أخرى)
+    و total_changes (تعديلات نفس الاتصال) إذا لم يتغيرا فلم يتغير شيء منذ آخر قراءة.
+    """
+
+    MAX_BYTES = 32 * 1024 * 1024
+    MAX_ENTRIES = 512
+
+    def __init__(self, max_bytes=MAX_BYTES, max_entries=MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # (sql, params) -> (rows, versions, size)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _estimate_size(rows):
+        # تقدير تقريبي لحجم الصفوف في الذاكرة
+        return sys.getsizeof(rows) + sum(
+            sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in rows
+        )
+
+    def _current_versions(self, conn):
+        stamp = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+        if getattr(conn, "cache_stamp", None) != stamp:
+            # النسخة محفوظة على الاتصال نفسه مع الختم: لكل خيط لقطته الخاصة من table_versions
+            conn.cache_versions = dict(conn.execute("SELECT name, version FROM table_versions").fetchall())
+            conn.cache_stamp = stamp
+        return conn.cache_versions
+
+    def fetchall(self, conn, sql, params=(), tables=()):
+        """
+        مثل conn.execute(sql, params).fetchall() مع حفظ النتيجة.
+        tables: كل الجداول التي يقرأ منها الاستعلام
+        """
+        # اتصال قاعدة بيانات أخرى، أو معاملة لم تُحفظ بعد في هذا الاتصال: بدون ذاكرة
+        if getattr(conn, "db_path", None) != students_db_path or conn.in_transaction:
+            return conn.execute(sql, params).fetchall()
+
+        versions = self._current_versions(conn)
+        try:
+            dependencies = tuple(versions[table] for table in tables)
+        except KeyError as e:
+            logging.warning(f"الجدول {e} ليس له رقم إصدار، لن تُحفظ نتيجة الاستعلام")
+            return conn.execute(sql, params).fetchall()
+
+        key = (sql, tuple(params))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] == dependencies:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return list(entry[0])
+                self._remove(key)
+                self.invalidations += 1
+            self.misses += 1
+
+        rows = conn.execute(sql, params).fetchall()
+        size = self._estimate_size(rows)
+        if size <= self.max_bytes:
+            with self._lock:
+                if key in self._entries:
+                    self._remove(key)
+                self._entries[key] = (tuple(rows), dependencies, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                    self._remove(next(iter(self._entries)))
+                    self.evictions += 1
+        return rows
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+
+_query_cache = QueryCache()
+
+
+def cached_fetchall(conn, sql, params=(), tables=()):
+    """نتيجة استعلام قراءة من الذاكرة ما لم تتغير الجداول tables (انظر QueryCache)"""
+    return _query_cache.fetchall(conn, sql, params, tables)
+
+
+def query_cache_stats():
+    return _query_cache.stats()
+
+
+def _log_query_cache_stats():
+    stats = query_cache_stats()
+    if stats["hits"] or stats["misses"]:
+        logging.info(
+            f"ذاكرة الاستعلامات: {stats['hits']} إصابة، {stats['misses']} إخفاق "
+            f"({stats['hit_rate']:.0%})، {stats['invalidations']} نتيجة قديمة، "
+            f"{stats['evictions']} إزالة، {stats['entries']} نتيجة بحجم {stats['bytes'] // 1024} كيلوبايت"
+        )
+
+
+atexit.register(_log_query_cache_stats)
+
+# ================= ترحيلات المخطط =================
+# كل ترحيل يُطبق مرة واحدة فقط، ورقم آخر ترحيل مطبق يُحفظ في PRAGMA user_version.
+# لإضافة تعديل جديد على المخطط: أضف دالة جديدة وسجّلها في MIGRATIONS برقم أكبر.
+
+def _column_names(c, table):
+    c.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in c.fetchall()]
+
+
+def _migration_001_base_schema(c):
+    """المخطط الأساسي، ويتعامل مع قواعد البيانات القديمة التي أُنشئت قبل نظام الترحيلات"""
+    c.execute('''CREATE TABLE IF NOT EXISTS groups (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        days TEXT,
+        students_count INTEGER DEFAULT 0,
+        stage TEXT
+    )''')
+    if "stage" not in _column_names(c, "groups"):
+        c.execute('ALTER TABLE groups ADD COLUMN stage TEXT')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS students (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_name TEXT NOT NULL,
+        father_name TEXT NOT NULL,
+        family_name TEXT NOT NULL,
+        phone TEXT,
+        guardian_phone TEXT,
+        grade TEXT,
+        group_id INTEGER,
+        email TEXT,
+        gender TEXT,
+        chat_id TEXT,
+        guardian_chat_id TEXT,
+        barcode_path TEXT,
+        code TEXT,
+        UNIQUE(first_name, father_name, family_name),
+        FOREIGN KEY(group_id) REFERENCES groups(id)
+    )''')
+    columns = _column_names(c, "students")
+    for column in ("email", "gender", "code", "chat_id", "guardian_chat_id", "barcode_path"):
+        if column not in columns:
+            c.execute(f'ALTER TABLE students ADD COLUMN {column} TEXT')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS exams (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER,
+        exam_date TEXT,
+        total_score INTEGER,
+        student_score INTEGER,
+        FOREIGN KEY(student_id) REFERENCES students(id)
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS attendance (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER,
+        attendance_date TEXT,
+        status TEXT,
+        day TEXT,
+        attendance_time TEXT,
+        UNIQUE(student_id, attendance_date),
+        FOREIGN KEY(student_id) REFERENCES students(id)
+    )''')
+    columns = _column_names(c, "attendance")
+    for column in ("day", "attendance_time"):
+        if column not in columns:
+            c.execute(f'ALTER TABLE attendance ADD COLUMN {column} TEXT')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER,
+        month TEXT,
+        status TEXT,
+        payment_date TEXT,
+        UNIQUE(student_id, month),
+        FOREIGN KEY(student_id) REFERENCES students(id)
+    )''')
+    if "payment_date" not in _column_names(c, "payments"):
+        c.execute('ALTER TABLE payments ADD COLUMN payment_date TEXT')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS teachers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        phone TEXT,
+        email TEXT,
+        subject TEXT
+    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS pending_notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id TEXT NOT NULL,
+        message TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )''')
+
+    # فهارس لتحسين الأداء
+    c.execute('CREATE INDEX IF NOT EXISTS idx_students_code ON students(code)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_students_name ON students(first_name, father_name, family_name)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_exams_student ON exams(student_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_payments_student_month ON payments(student_id, month)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_student_date ON attendance(student_id, attendance_date)')
+
+
+def _migration_002_iso_dates(c):
+    """توحيد تخزين التواريخ بتنسيق ISO القابل للترتيب وفهرسة تاريخ الحضور"""
+    normalize_date_column(c, "attendance", "attendance_date")
+    normalize_date_column(c, "exams", "exam_date")
+    normalize_date_column(c, "payments", "payment_date")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance(attendance_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_exams_student_date ON exams(student_id, exam_date)')
+
+
+def _migration_003_telegram_outbox(c):
+    """تحويل pending_notifications إلى صندوق صادر بحالة وعدد محاولات وموعد المحاولة القادمة"""
+    columns = _column_names(c, "pending_notifications")
+    if "status" not in columns:
+        c.execute("ALTER TABLE pending_notifications ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'")
+    if "attempts" not in columns:
+        c.execute("ALTER TABLE pending_notifications ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    if "next_attempt_at" not in columns:
+        c.execute("ALTER TABLE pending_notifications ADD COLUMN next_attempt_at REAL")  # unix timestamp
+    if "last_error" not in columns:
+        c.execute("ALTER TABLE pending_notifications ADD COLUMN last_error TEXT")
+    if "sent_at" not in columns:
+        c.execute("ALTER TABLE pending_notifications ADD COLUMN sent_at TEXT")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON pending_notifications(status, next_attempt_at)')
+
+
+# الاسم الكامل كما يُخزن في العمود المولد full_name، وكل بحث بالاسم يمر عليه.
+# الفاصل يُضاف قبل الجزء غير الفارغ فقط، فالنتيجة هي نفسها ناتج normalize_full_name
+FULL_NAME_EXPR = (
+    "trim(coalesce(trim(first_name), '')"
+    " || CASE WHEN trim(father_name) <> '' THEN ' ' || trim(father_name) ELSE '' END"
+    " || CASE WHEN trim(family_name) <> '' THEN ' ' || trim(family_name) ELSE '' END)"
+)
+
+
+def normalize_full_name(name):
+    """
+    توحيد الاسم المدخل بنفس شكل العمود full_name (مسافة واحدة بين الكلمات).
+    أجزاء الاسم نفسها تُحفظ بعد توحيدها بهذه الدالة، فلا تبقى مسافات مكررة داخل full_name.
+    """
+    return " ".join(str(name or "").split())
+
+
+def _migration_004_full_name(c):
+    """
+    عمود مولد full_name بالاسم الكامل مع فهرس عليه، بدلاً من ربط الأجزاء الثلاثة وقت كل استعلام.
+    ALTER TABLE لا يسمح بإضافة عمود مولد STORED، فالعمود VIRTUAL والقيمة المحسوبة
+    تُخزن في الفهرس نفسه وتُحدّث تلقائياً مع كل INSERT/UPDATE.
+    """
+    if "full_name" not in _column_names(c, "students"):
+        c.execute(f"ALTER TABLE students ADD COLUMN full_name TEXT GENERATED ALWAYS AS ({FULL_NAME_EXPR}) VIRTUAL")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_students_full_name ON students(full_name)')
+
+
+def _migration_005_search_index(c):
+    """فهرس بحث FTS5 للطلاب (الاسم والهواتف والكود) بحروف عربية موحدة، تحدّثه triggers"""
+    create_search_index(c)
+
+
+# الكود كرقم صحيح فقط إذا كان أرقاماً، حتى لا يتحول '' أو نص غير رقمي إلى 0
+CODE_INT_EXPR = "CASE WHEN code <> '' AND code NOT GLOB '*[^0-9]*' THEN CAST(code AS INTEGER) END"
+
+
+def create_version_triggers(c, table, update_columns=None):
+    """
+    زيادة رقم إصدار الجدول في table_versions مع كل INSERT/UPDATE/DELETE عليه.
+    update_columns: تحديث هذه الأعمدة فقط يغير الإصدار (الافتراضي: أي عمود)
+    """
+    c.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, 0)", (table,))
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        timing = event
+        if event == "UPDATE" and update_columns:
+            timing = f"UPDATE OF {', '.join(update_columns)}"
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {timing} ON {table} BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+        END''')
+
+
+def get_table_version(conn, table):
+    """رقم إصدار الجدول الحالي (بحث واحد بالمفتاح الأساسي)"""
+    row = conn.execute("SELECT version FROM table_versions WHERE name = ?", (table,)).fetchone()
+    return row[0] if row else None
+
+
+def _migration_006_code_lookup(c):
+    """
+    عمود code_int (الكود كرقم صحيح) بفهرس فريد لقراءة الباركود بمطابقة تامة،
+    وجدول table_versions الذي يخبر الذاكرة المؤقتة بتغير جدول الطلاب.
+    """
+    if "code_int" not in _column_names(c, "students"):
+        c.execute(f"ALTER TABLE students ADD COLUMN code_int INTEGER GENERATED ALWAYS AS ({CODE_INT_EXPR}) VIRTUAL")
+
+    c.execute('''SELECT code_int FROM students WHERE code_int IS NOT NULL
+                 GROUP BY code_int HAVING COUNT(*) > 1''')
+    duplicates = [row[0] for row in c.fetchall()]
+    if duplicates:
+        # بيانات قديمة بأكواد مكررة: فهرس عادي حتى يتم تصحيحها بدلاً من فشل الترحيل
+        logging.warning(f"أكواد طلاب مكررة، لن يكون فهرس الكود فريداً: {duplicates[:20]}")
+        c.execute('CREATE INDEX IF NOT EXISTS idx_students_code_int ON students(code_int)')
+    else:
+        c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_students_code_int ON students(code_int)')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS table_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''')
+    create_version_triggers(c, "students")
+
+
+def create_students_count_triggers(c):
+    """تحديث groups.students_count مع كل إضافة أو حذف طالب أو نقله بين المجموعات"""
+    c.execute('''CREATE TRIGGER IF NOT EXISTS students_count_insert AFTER INSERT ON students
+        WHEN new.group_id IS NOT NULL BEGIN
+        UPDATE groups SET students_count = students_count + 1 WHERE id = new.group_id;
+    END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS students_count_delete AFTER DELETE ON students
+        WHEN old.group_id IS NOT NULL BEGIN
+        UPDATE groups SET students_count = students_count - 1 WHERE id = old.group_id;
+    END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS students_count_update AFTER UPDATE OF group_id ON students
+        WHEN old.group_id IS NOT new.group_id BEGIN
+        UPDATE groups SET students_count = students_count - 1 WHERE id = old.group_id;
+        UPDATE groups SET students_count = students_count + 1 WHERE id = new.group_id;
+    END''')
+
+
+def _migration_007_group_students_count(c):
+    """
+    عدد طلاب كل مجموعة في groups.students_count تحدّثه triggers على students،
+    فلوحة المجموعات تُقرأ باستعلام واحد بدلاً من COUNT(*) لكل مجموعة.
+    """
+    c.execute('CREATE INDEX IF NOT EXISTS idx_students_group ON students(group_id)')
+    # قد يحتوي العمود على NULL في قواعد بيانات قديمة
+    c.execute('''UPDATE groups SET students_count =
+                 (SELECT COUNT(*) FROM students WHERE students.group_id = groups.id)''')
+    create_students_count_triggers(c)
+
+
+def _migration_008_covering_indexes(c):
+    """
+    فهارس تغطي أعمدة ملخص طلاب المجموعة (الحضور بالحالة، وآخر دفع بالشهر والحالة)
+    فيُقرأ الملخص من الفهارس فقط. فهرس الدفع السابق (student_id, month) جزء من الجديد فيُحذف.
+    """
+    c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_student_status ON attendance(student_id, status)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_payments_student_month_status ON payments(student_id, month, status)')
+    c.execute('DROP INDEX IF EXISTS idx_payments_student_month')
+
+
+def _rebuild_table(c, table, create_sql):
+    """
+    إعادة إنشاء جدول بتعريف جديد مع الحفاظ على بياناته وفهارسه و triggers الخاصة به
+    (الطريقة التي توصي بها SQLite لتعديل القيود، ويجب أن تكون foreign_keys معطلة).
+    create_sql: تعريف الجدول الجديد باسم {name}
+    """
+    new_table = f"{table}_new"
+    c.execute("SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+              (table,))
+    schema_objects = [row[0] for row in c.fetchall()]
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+    sequence = c.fetchone()
+
+    c.execute(create_sql.format(name=new_table))
+    # الأعمدة المولدة (hidden = 2 أو 3) تُحسب من جديد ولا تُنسخ
+    c.execute(f"PRAGMA table_xinfo({table})")
+    old_columns = {row[1] for row in c.fetchall() if row[6] == 0}
+    c.execute(f"PRAGMA table_xinfo({new_table})")
+    columns = ", ".join(row[1] for row in c.fetchall() if row[6] == 0 and row[1] in old_columns)
+    c.execute(f"INSERT INTO {new_table} ({columns}) SELECT {columns} FROM {table}")
+
+    c.execute(f"DROP TABLE {table}")
+    c.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+    for sql in schema_objects:
+        c.execute(sql)
+    if sequence:
+        # AUTOINCREMENT لا يعيد استخدام معرفات محذوفة سابقاً
+        c.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?", (sequence[0], table))
+
+
+# تعريف جدول الطلاب الحالي باسم {name} لإعادة إنشائه بـ _rebuild_table.
+# full_name مخزن (STORED) فلا يُحسب من جديد مع كل قراءة للعمود
+STUDENTS_TABLE_SQL = f'''CREATE TABLE {{name}} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_name TEXT NOT NULL,
+        father_name TEXT NOT NULL,
+        family_name TEXT NOT NULL,
+        phone TEXT,
+        guardian_phone TEXT,
+        grade TEXT,
+        group_id INTEGER REFERENCES groups(id) ON DELETE CASCADE,
+        email TEXT,
+        gender TEXT,
+        chat_id TEXT,
+        guardian_chat_id TEXT,
+        barcode_path TEXT,
+        code TEXT,
+        full_name TEXT GENERATED ALWAYS AS ({FULL_NAME_EXPR}) STORED,
+        code_int INTEGER GENERATED ALWAYS AS ({CODE_INT_EXPR}) VIRTUAL,
+        UNIQUE(first_name, father_name, family_name)
+    )'''
+
+
+def _migration_009_cascade_deletes(c):
+    """
+    مفاتيح أجنبية ON DELETE CASCADE: حذف مجموعة يحذف طلابها، وحذف طالب يحذف
+    حضوره واختباراته ومدفوعاته، بأمر DELETE واحد. SQLite لا تعدل قيود جدول موجود
+    فتُعاد إنشاء الجداول، بعد حذف السجلات اليتيمة التي تركها الحذف اليدوي سابقاً.
+    """
+    for table in ("exams", "attendance", "payments"):
+        c.execute(f"DELETE FROM {table} WHERE student_id IS NOT NULL AND student_id NOT IN (SELECT id FROM students)")
+    # الطالب يبقى بدون مجموعة بدلاً من حذفه إذا كانت مجموعته محذوفة
+    c.execute("UPDATE students SET group_id = NULL WHERE group_id IS NOT NULL AND group_id NOT IN (SELECT id FROM groups)")
+
+    _rebuild_table(c, "students", STUDENTS_TABLE_SQL)
+    _rebuild_table(c, "exams", '''CREATE TABLE {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+        exam_date TEXT,
+        total_score INTEGER,
+        student_score INTEGER
+    )''')
+    _rebuild_table(c, "attendance", '''CREATE TABLE {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+        attendance_date TEXT,
+        status TEXT,
+        day TEXT,
+        attendance_time TEXT,
+        UNIQUE(student_id, attendance_date)
+    )''')
+    _rebuild_table(c, "payments", '''CREATE TABLE {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER REFERENCES students(id) ON DELETE CASCADE,
+        month TEXT,
+        status TEXT,
+        payment_date TEXT,
+        UNIQUE(student_id, month)
+    )''')
+    # المفتاح الأجنبي يحتاج فهرساً على العمود الفرعي حتى لا يمسح الجدول كاملاً مع كل حذف
+    c.execute('CREATE INDEX IF NOT EXISTS idx_students_group ON students(group_id)')
+
+
+def _migration_010_groups_version(c):
+    """
+    رقم إصدار لجدول المجموعات حتى تُقرأ قوائم المجموعات من الذاكرة (utils/lookups).
+    students_count يتغير مع كل طالب يُضاف فلا يغير الإصدار.
+    """
+    create_version_triggers(c, "groups", update_columns=("name", "days", "stage"))
+
+
+def _migration_011_data_versions(c):
+    """أرقام إصدارات لجداول الحضور والاختبارات والمدفوعات حتى تُحفظ الاستعلامات التي تقرأ منها"""
+    for table in ("attendance", "exams", "payments"):
+        create_version_triggers(c, table)
+
+
+def _migration_012_normalize_name_parts(c):
+    """توحيد المسافات داخل أجزاء أسماء الطلاب المحفوظة حتى يطابق full_name الاسم بعد normalize_full_name"""
+    c.execute("SELECT id, first_name, father_name, family_name FROM students")
+    updates = []
+    for student_id, *parts in c.fetchall():
+        normalized = [normalize_full_name(part) if part is not None else None for part in parts]
+        if normalized != parts:
+            updates.append((*normalized, student_id))
+    if updates:
+        c.executemany("UPDATE students SET first_name = ?, father_name = ?, family_name = ? WHERE id = ?", updates)
+        logging.info(f"تم توحيد المسافات في أسماء {len(updates)} طالب")
+
+
+def _migration_013_stored_full_name(c):
+    """
+    full_name بالتعريف الجديد (بدون مسافات زائدة عند جزء فارغ) كعمود STORED.
+    تعريف العمود المولد لا يُعدل إلا بإعادة إنشاء الجدول، والقواعد المنشأة بعد هذا
+    التعريف في الترحيل 9 لا تحتاج لذلك.
+    """
+    c.execute("PRAGMA table_xinfo(students)")
+    if any(row[1] == "full_name" and row[6] == 3 for row in c.fetchall()):  # 3 = STORED
+        return
+    _rebuild_table(c, "students", STUDENTS_TABLE_SQL)
+
+
+# (الإصدار، الوصف، الدالة) بترتيب تصاعدي
+MIGRATIONS = [
+    (1, "المخطط الأساسي", _migration_001_base_schema),
+    (2, "تخزين التواريخ بتنسيق ISO", _migration_002_iso_dates),
+    (3, "صندوق صادر تيليجرام", _migration_003_telegram_outbox),
+    (4, "عمود الاسم الكامل المفهرس", _migration_004_full_name),
+    (5, "فهرس بحث الطلاب FTS5", _migration_005_search_index),
+    (6, "كود رقمي فريد وأرقام إصدارات الجداول", _migration_006_code_lookup),
+    (7, "عدد طلاب المجموعة بالـ triggers", _migration_007_group_students_count),
+    (8, "فهارس تغطية لملخص المجموعة", _migration_008_covering_indexes),
+    (9, "حذف متتابع بالمفاتيح الأجنبية", _migration_009_cascade_deletes),
+    (10, "رقم إصدار جدول المجموعات", _migration_010_groups_version),
+    (11, "أرقام إصدارات الحضور والاختبارات والمدفوعات", _migration_011_data_versions),
+    (12, "توحيد المسافات في أسماء الطلاب", _migration_012_normalize_name_parts),
+    (13, "الاسم الكامل كعمود مخزن", _migration_013_stored_full_name),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def run_migrations(conn):
+    """
+    تطبيق الترحيلات المعلقة فقط داخل معاملة واحدة.
+    - إذا كانت قاعدة البيانات محدثة: قراءة PRAGMA واحدة بدون أي DDL.
+    - أي خطأ يلغي كل الترحيلات المعلقة ويترك الإصدار كما هو.
+    - المفاتيح الأجنبية معطلة أثناء الترحيل (إعادة إنشاء جدول كانت ستحذف سجلاته الفرعية)،
+      ويُتحقق منها كلها قبل الحفظ.
+    """
+    current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if current_version >= SCHEMA_VERSION:
+        return current_version
+
+    pending = [m for m in MIGRATIONS if m[0] > current_version]
+    logging.info(f"ترحيل قاعدة البيانات من الإصدار {current_version} إلى {SCHEMA_VERSION}")
+    c = conn.cursor()
+    # لا يمكن تغيير foreign_keys داخل معاملة
+    c.execute("PRAGMA foreign_keys = OFF")
     try:
-        with sqlite3.connect(students_db_path) as conn:
-            c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        for version, description, migration in pending:
+            migration(c)
+            logging.info(f"تم تطبيق الترحيل {version}: {description}")
+        c.execute("PRAGMA foreign_key_check")
+        violations = c.fetchall()
+        if violations:
+            raise sqlite3.IntegrityError(f"سجلات تخالف المفاتيح الأجنبية بعد الترحيل: {violations[:10]}")
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        c.execute("PRAGMA foreign_keys = ON")
+    return SCHEMA_VERSION
 
-            # إنشاء جدول groups
-            c.execute('''CREATE TABLE IF NOT EXISTS groups (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                days TEXT,
-                students_count INTEGER DEFAULT 0,
-                stage TEXT
-            )''')
-            logging.info("تم إنشاء/التحقق من جدول groups")
 
-            try:
-                c.execute('ALTER TABLE groups ADD COLUMN stage TEXT')
-                logging.info("تم إضافة عمود stage إلى groups")
-            except sqlite3.OperationalError:
-                pass  # العمود موجود بالفعل
-
-            # إنشاء جدول students
-            c.execute('''CREATE TABLE IF NOT EXISTS students (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                first_name TEXT NOT NULL,
-                father_name TEXT NOT NULL,
-                family_name TEXT NOT NULL,
-                phone TEXT,
-                guardian_phone TEXT,
-                grade TEXT,
-                group_id INTEGER,
-                email TEXT,
-                gender TEXT,
-                chat_id TEXT, 
-                guardian_chat_id TEXT, 
-                barcode_path TEXT,
-                code TEXT,
-                UNIQUE(first_name, father_name, family_name),
-                FOREIGN KEY(group_id) REFERENCES groups(id)
-            )''')
-            logging.info("تم إنشاء/التحقق من جدول students")
-
-            # التحقق من وجود الأعمدة قبل إضافتها
-            c.execute("PRAGMA table_info(students)")
-            columns = [row[1] for row in c.fetchall()]
-            if "email" not in columns:
-                c.execute('ALTER TABLE students ADD COLUMN email TEXT')
-                logging.info("تم إضافة عمود email إلى students")
-            if "gender" not in columns:
-                c.execute('ALTER TABLE students ADD COLUMN gender TEXT')
-                logging.info("تم إضافة عمود gender إلى students")
-            if "code" not in columns:
-                c.execute('ALTER TABLE students ADD COLUMN code TEXT')
-                logging.info("تم إضافة عمود code إلى students")
-            if "chat_id" not in columns:
-                c.execute('ALTER TABLE students ADD COLUMN chat_id TEXT')
-                logging.info("تم إضافة عمود chat_id إلى students")
-            if "guardian_chat_id" not in columns:
-                c.execute('ALTER TABLE students ADD COLUMN guardian_chat_id TEXT')
-                logging.info("تم إضافة عمود guardian_chat_id إلى students")
-            if "barcode_path" not in columns:
-                c.execute('ALTER TABLE students ADD COLUMN barcode_path TEXT')
-                logging.info("تم إضافة عمود barcode_path إلى students")
-
-            # إنشاء جدول exams
-            c.execute('''CREATE TABLE IF NOT EXISTS exams (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id INTEGER,
-                exam_date TEXT,
-                total_score INTEGER,
-                student_score INTEGER,
-                FOREIGN KEY(student_id) REFERENCES students(id)
-            )''')
-            logging.info("تم إنشاء/التحقق من جدول exams")
-            
-            # إنشاء جدول attendance
-            c.execute('''CREATE TABLE IF NOT EXISTS attendance (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id INTEGER,
-                attendance_date TEXT,
-                status TEXT,
-                day TEXT,
-                attendance_time TEXT,
-                UNIQUE(student_id, attendance_date),
-                FOREIGN KEY(student_id) REFERENCES students(id)
-            )''')
-            logging.info("تم إنشاء/التحقق من جدول attendance")
-            
-            try:
-                c.execute('ALTER TABLE attendance ADD COLUMN day TEXT')
-                logging.info("تم إضافة عمود day إلى attendance")
-            except sqlite3.OperationalError:
-                pass  # العمود موجود بالفعل
-            
-            try:
-                c.execute('ALTER TABLE attendance ADD COLUMN attendance_time TEXT')
-                logging.info("تم إضافة عمود attendance_time إلى attendance")
-            except sqlite3.OperationalError:
-                pass  # العمود موجود بالفعل
-
-            # إنشاء جدول payments
-            c.execute('''CREATE TABLE IF NOT EXISTS payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                student_id INTEGER,
-                month TEXT,
-                status TEXT,
-                payment_date TEXT,
-                UNIQUE(student_id, month),
-                FOREIGN KEY(student_id) REFERENCES students(id)
-            )''')
-            logging.info("تم إنشاء/التحقق من جدول payments")
-            
-            try:
-                c.execute('ALTER TABLE payments ADD COLUMN payment_date TEXT')
-                logging.info("تم إضافة عمود payment_date إلى payments")
-            except sqlite3.OperationalError:
-                pass
-                
-            # إنشاء جدول teachers
-            c.execute('''CREATE TABLE IF NOT EXISTS teachers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                phone TEXT,
-                email TEXT,
-                subject TEXT
-            )''')
-            logging.info("تم إنشاء/التحقق من جدول teachers")
-            
-            c.execute("PRAGMA table_info(teachers)")
-            teacher_columns = [row[1] for row in c.fetchall()]
-            if "name" not in teacher_columns:
-                c.execute('ALTER TABLE teachers ADD COLUMN name TEXT NOT NULL')
-                logging.info("تم إضافة عمود name إلى teachers")
-            
-            # إنشاء جدول pending_notifications
-            c.execute('''CREATE TABLE IF NOT EXISTS pending_notifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id TEXT NOT NULL,
-                message TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            )''')
-            logging.info("تم إنشاء/التحقق من جدول pending_notifications")
-            
-            # إضافة فهارس لتحسين الأداء
-            try:
-                c.execute('CREATE INDEX IF NOT EXISTS idx_students_code ON students(code)')
-                logging.info("تم إضافة فهرسة على code في students")
-                c.execute('CREATE INDEX IF NOT EXISTS idx_students_name ON students(first_name, father_name, family_name)')
-                logging.info("تم إضافة فهرسة على first_name, father_name, family_name في students")
-                c.execute('CREATE INDEX IF NOT EXISTS idx_exams_student ON exams(student_id)')
-                logging.info("تم إضافة فهرسة على student_id في exams")
-                c.execute('CREATE INDEX IF NOT EXISTS idx_payments_student_month ON payments(student_id, month)')
-                logging.info("تم إضافة فهرسة على student_id, month في payments")
-                c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_student_date ON attendance(student_id, attendance_date)')
-                logging.info("تم إضافة فهرسة على student_id, attendance_date في attendance")
-            except sqlite3.OperationalError as e:
-                logging.warning(f"تحذير أثناء إنشاء الفهارس: {e}")
-            
-            conn.commit()
-            logging.info("تم تهيئة قاعدة البيانات بنجاح")
+def init_db():
+    try:
+        run_migrations(get_connection())
     except Exception as e:
         logging.error(f"خطأ أثناء تهيئة قاعدة البيانات: {e}", exc_info=True)
-        conn.rollback()
         raise
 
+
 # استدعاء تهيئة قاعدة البيانات
-try:
-    init_db()
-    logging.info("تم استدعاء init_db بنجاح")
-except Exception as e:
-    logging.error(f"خطأ في init_db: {e}")
-    raise
+init_db()
 
 def get_next_code():
-    with sqlite3.connect(students_db_path) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
-        c.execute("SELECT MAX(CAST(code AS INTEGER)) FROM students")
+        c.execute("SELECT MAX(code_int) FROM students")  # من نهاية الفهرس مباشرة
         max_code = c.fetchone()[0]
         if not max_code or max_code < 1000:
             return 1001
@@ -247,23 +837,14 @@ def get_student_code(student_name: str) -> str:
     :return: الكود الفريد للطالب أو None إذا لم يتم العثور عليه
     """
     try:
-        # تقسيم الاسم إلى أجزائه
-        names = student_name.strip().split()
-        if len(names) < 3:
+        full_name = normalize_full_name(student_name)
+        if len(full_name.split()) < 3:
             logging.error(f"الاسم '{student_name}' غير مكتمل")
             return None
-            
-        first_name = names[0]
-        father_name = names[1]
-        family_name = names[-1]
-        
-        with sqlite3.connect(students_db_path) as conn:
+
+        with get_connection() as conn:
             c = conn.cursor()
-            c.execute("""
-                SELECT code 
-                FROM students 
-                WHERE first_name = ? AND father_name = ? AND family_name = ?
-            """, (first_name, father_name, family_name))
+            c.execute("SELECT code FROM students WHERE full_name = ?", (full_name,))
             
             result = c.fetchone()
             if result and result[0]:
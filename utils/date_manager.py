@@ -2,131 +2,67 @@ from datetime import datetime
 import sqlite3
 import logging
 
+from utils.database import get_connection
+from utils.date_utils import STORAGE_DATE_FORMAT, parse_date, normalize_date_column
+
 class DateManager:
-    DATE_FORMAT = '%d-%m-%Y'
+    # نفس تنسيق التخزين في قاعدة البيانات (yyyy-mm-dd)
+    DATE_FORMAT = STORAGE_DATE_FORMAT
 
     @staticmethod
     def normalize_date(date_str):
-        """توحيد تنسيق التاريخ إلى dd-mm-yyyy"""
+        """توحيد تنسيق التاريخ إلى yyyy-mm-dd"""
         if not date_str or date_str == '-' or date_str == "":
             return None
-            
-        try:
-            date_str = date_str.strip().replace('/', '-')
-            formats = [
-                '%Y-%m-%d', 
-                '%d-%m-%Y', 
-                '%d-%m-%y',
-                '%Y/%m/%d',
-                '%d/%m/%Y',
-                '%m-%d-%Y',
-                '%Y.%m.%d',
-                '%d.%m.%Y'
-            ]
-            
-            for fmt in formats:
-                try:
-                    return datetime.strptime(date_str, fmt).strftime(DateManager.DATE_FORMAT)
-                except ValueError:
-                    continue
-            return None
-        except Exception as e:
-            logging.error(f"Error normalizing date {date_str}: {str(e)}")
-            return None
+        parsed_date = parse_date(date_str)
+        return parsed_date.strftime(DateManager.DATE_FORMAT) if parsed_date else None
 
     @staticmethod
     def get_today():
         """الحصول على تاريخ اليوم بالتنسيق الموحد"""
         return datetime.now().strftime(DateManager.DATE_FORMAT)
 
+    # الجداول وأعمدة التواريخ التي يتم تنظيفها
+    DATE_COLUMNS = {
+        'attendance': 'attendance_date',
+        'payments': 'payment_date',
+        'exams': 'exam_date',
+    }
+
     @staticmethod
-    def clean_database(db_path):
-        """تنظيف وتوحيد جميع التواريخ في قاعدة البيانات"""
+    def clean_database(db_path, batch_size=5000):
+        """
+        تنظيف وتوحيد جميع التواريخ في قاعدة البيانات.
+        يتم التنظيف على دفعات (كل دفعة معاملة مستقلة) مع ملخص واحد لكل جدول.
+        """
         try:
-            conn = sqlite3.connect(db_path)
+            conn = get_connection(db_path)
             c = conn.cursor()
-            
-            updates = {
-                'attendance': {
-                    'table': 'attendance',
-                    'date_column': 'attendance_date',
-                    'count': 0,
-                    'total': 0,
-                    'errors': []
-                },
-                'payments': {
-                    'table': 'payments',
-                    'date_column': 'payment_date',
-                    'count': 0,
-                    'total': 0,
-                    'errors': []
-                },
-                'exams': {
-                    'table': 'exams',
-                    'date_column': 'exam_date',
-                    'count': 0,
-                    'total': 0,
-                    'errors': []
+
+            stats = {}
+            for table, date_column in DateManager.DATE_COLUMNS.items():
+                table_stats = normalize_date_column(c, table, date_column, batch_size=batch_size, commit=conn.commit)
+                stats[table] = {
+                    'total_records': table_stats['total'],
+                    'updated_records': table_stats['updated'],
+                    'duplicate_records': table_stats['duplicates'],
+                    'formats': dict(table_stats['by_format']),
+                    'errors': [f"Could not normalize date: {sample} in {table}"
+                               for sample in table_stats['invalid_samples']],
+                    'error_count': table_stats['invalid'],
                 }
-            }
-            
-            # معالجة كل جدول
-            for key, info in updates.items():
-                table = info['table']
-                date_column = info['date_column']
-                logging.info(f"Cleaning {table} dates...")
-                
-                # جلب كل السجلات
-                c.execute(f'SELECT id, {date_column} FROM {table}')
-                rows = c.fetchall()
-                info['total'] = len(rows)
-                
-                for row_id, old_date in rows:
-                    if old_date and old_date != '-':
-                        try:
-                            new_date = DateManager.normalize_date(old_date)
-                            if new_date and new_date != old_date:
-                                # تحديث التاريخ بالتنسيق الجديد
-                                update_query = f'''
-                                    UPDATE {table} 
-                                    SET {date_column} = ? 
-                                    WHERE id = ?
-                                '''
-                                c.execute(update_query, (new_date, row_id))
-                                info['count'] += 1
-                                logging.info(f"Updated {table} date: {old_date} -> {new_date} (ID: {row_id})")
-                            elif not new_date:
-                                error_msg = f"Could not normalize date: {old_date} in {table} (ID: {row_id})"
-                                info['errors'].append(error_msg)
-                                logging.warning(error_msg)
-                        except Exception as e:
-                            error_msg = f"Error processing date {old_date} in {table} (ID: {row_id}): {str(e)}"
-                            info['errors'].append(error_msg)
-                            logging.error(error_msg)
 
-            # تحديث قاعدة البيانات
-            conn.commit()
-            
             # إحصائيات التنظيف
-            stats = {
-                'summary': {
-                    'total_records': sum(info['total'] for info in updates.values()),
-                    'total_updated': sum(info['count'] for info in updates.values()),
-                    'total_errors': sum(len(info['errors']) for info in updates.values())
-                }
+            stats['summary'] = {
+                'total_records': sum(info['total_records'] for info in stats.values()),
+                'total_updated': sum(info['updated_records'] for info in stats.values()),
+                'total_errors': sum(info['error_count'] for info in stats.values())
             }
+            logging.info(f"Date cleaning summary: {stats['summary']}")
 
-            # إضافة تفاصيل لكل جدول
-            for key, info in updates.items():
-                stats[key] = {
-                    'total_records': info['total'],
-                    'updated_records': info['count'],
-                    'errors': info['errors']
-                }
-            
             conn.close()
             return True, stats
-            
+
         except Exception as e:
             logging.error(f"Error cleaning database: {str(e)}")
             return False, str(e)
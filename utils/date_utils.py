@@ -1,48 +1,164 @@
-from datetime import datetime
+import re
+import logging
+from collections import Counter
+from datetime import datetime, date
+
+# التخزين في قاعدة البيانات دائماً بتنسيق ISO (yyyy-mm-dd) لأنه يُرتب نصياً بشكل صحيح
+# ويسمح باستخدام الفهارس في فلاتر التاريخ، والعرض للمستخدم يبقى dd-mm-yyyy
+STORAGE_DATE_FORMAT = '%Y-%m-%d'
+DISPLAY_DATE_FORMAT = '%d-%m-%Y'
+
+# أسماء الأيام بترتيب date.weekday() (الاثنين = 0)
+WEEKDAYS_AR = ("الاثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد")
+
+# أنماط التواريخ المعروفة مصنفة مسبقاً، كل نمط يعيد (سنة، شهر، يوم) بدون strptime
+_ISO_RE = re.compile(r"^(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})$")
+_DMY_RE = re.compile(r"^(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})$")
+_DMY_SHORT_RE = re.compile(r"^(\d{1,2})[-/.](\d{1,2})[-/.](\d{2})$")
+
+# أعمدة مخزنة بالفعل بالتنسيق الموحد لا تحتاج للقراءة أثناء التنظيف
+ISO_DATE_GLOB = '[0-9][0-9][0-9][0-9]-[0-1][0-9]-[0-3][0-9]'
+
+
+def _ymd_from_iso(m):
+    return int(m.group(1)), int(m.group(2)), int(m.group(3))
+
+
+def _ymd_from_dmy(m):
+    day, month = int(m.group(1)), int(m.group(2))
+    if month > 12 and day <= 12:  # mm-dd-yyyy
+        day, month = month, day
+    return int(m.group(3)), month, day
+
+
+def _ymd_from_dmy_short(m):
+    year, month, day = _ymd_from_dmy(m)
+    # نفس قاعدة %y في strptime
+    return (2000 + year if year < 69 else 1900 + year), month, day
+
+
+DATE_PATTERNS = (
+    ("yyyy-mm-dd", _ISO_RE, _ymd_from_iso),
+    ("dd-mm-yyyy", _DMY_RE, _ymd_from_dmy),
+    ("dd-mm-yy", _DMY_SHORT_RE, _ymd_from_dmy_short),
+)
+
+
+def classify_date(value):
+    """إرجاع (اسم النمط، date) أو (None، None) إذا لم يطابق أي نمط معروف"""
+    value = value.strip()
+    for name, pattern, to_ymd in DATE_PATTERNS:
+        m = pattern.match(value)
+        if m:
+            try:
+                return name, date(*to_ymd(m))
+            except ValueError:
+                return None, None
+    return None, None
+
+
+def parse_date(value):
+    """تحويل نص أو تاريخ إلى date، أو None إذا لم يكن تاريخاً معروفاً"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not value or value == '-':
+        return None
+    return classify_date(str(value))[1]
+
 
 def normalize_date_format(date_str):
     """
-    توحيد تنسيق التاريخ إلى dd-mm-yyyy
-    يقبل التنسيقات التالية:
+    توحيد تنسيق التاريخ إلى تنسيق التخزين yyyy-mm-dd
+    يقبل التنسيقات التالية (بفواصل - أو / أو .):
     - yyyy-mm-dd
-    - dd-mm-yyyy
-    - d-m-yyyy
-    - yyyy/mm/dd
-    - dd/mm/yyyy
+    - dd-mm-yyyy و d-m-yyyy (و mm-dd-yyyy عندما يكون الشهر أكبر من 12)
+    - dd-mm-yy
     """
     if not date_str or date_str == '-':
         return date_str
-        
-    try:
-        # إزالة أي مسافات
-        date_str = date_str.strip()
-        
-        # تحويل / إلى -
-        date_str = date_str.replace('/', '-')
-        
-        # تجربة التنسيقات المختلفة
-        formats = [
-            '%Y-%m-%d',  # yyyy-mm-dd
-            '%d-%m-%Y',  # dd-mm-yyyy
-            '%d-%m-%y',  # dd-mm-yy
-            '%Y/%m/%d',  # yyyy/mm/dd
-            '%d/%m/%Y',  # dd/mm/yyyy
-        ]
-        
-        parsed_date = None
-        for fmt in formats:
-            try:
-                parsed_date = datetime.strptime(date_str, fmt)
-                break
-            except ValueError:
+
+    parsed_date = parse_date(date_str)
+    if parsed_date is None:
+        return date_str
+    return parsed_date.strftime(STORAGE_DATE_FORMAT)
+
+
+def to_display_date(value):
+    """تحويل تاريخ مخزن إلى تنسيق العرض dd-mm-yyyy"""
+    parsed_date = parse_date(value)
+    if parsed_date is None:
+        return value if value else '-'
+    return parsed_date.strftime(DISPLAY_DATE_FORMAT)
+
+
+def today_storage():
+    """تاريخ اليوم بتنسيق التخزين"""
+    return date.today().strftime(STORAGE_DATE_FORMAT)
+
+
+def normalize_date_column(c, table, column, batch_size=5000, commit=None):
+    """
+    توحيد عمود تاريخ كامل إلى yyyy-mm-dd على دفعات بذاكرة محدودة.
+    - السجلات الموحدة بالفعل لا تُقرأ أصلاً (فلتر GLOB).
+    - كل دفعة تُصنف بالأنماط المجهزة مسبقاً ثم تُكتب بـ executemany واحد.
+    - commit: دالة تُستدعى بعد كل دفعة (None داخل معاملة أكبر مثل الترحيلات).
+    - يرجع ملخصاً بدلاً من تسجيل كل سجل.
+    """
+    c.execute(f"SELECT COUNT(*) FROM {table}")
+    stats = {
+        "total": c.fetchone()[0],
+        "updated": 0,
+        "duplicates": 0,
+        "invalid": 0,
+        "by_format": Counter(),
+        "invalid_samples": [],
+    }
+
+    last_id = 0
+    while True:
+        c.execute(
+            f"SELECT id, {column} FROM {table} "
+            f"WHERE id > ? AND {column} IS NOT NULL AND {column} NOT IN ('', '-') "
+            f"AND {column} NOT GLOB '{ISO_DATE_GLOB}' ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        )
+        rows = c.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        updates = []
+        for row_id, value in rows:
+            fmt, parsed = classify_date(str(value))
+            if parsed is None:
+                stats["invalid"] += 1
+                if len(stats["invalid_samples"]) < 5:
+                    stats["invalid_samples"].append(f"{value} (ID: {row_id})")
                 continue
-                
-        if parsed_date is None:
-            return date_str
-            
-        # تحويل إلى التنسيق المطلوب dd-mm-yyyy
-        return parsed_date.strftime('%d-%m-%Y')
-        
-    except Exception as e:
-        print(f"Error normalizing date {date_str}: {str(e)}")
-        return date_str
\ No newline at end of file
+            stats["by_format"][fmt] += 1
+            new_value = parsed.isoformat()  # نفس STORAGE_DATE_FORMAT
+            if new_value != value:
+                updates.append((new_value, row_id))
+
+        if updates:
+            if table == "attendance":
+                # نفس الطالب قد يكون له سجل بالتنسيقين لنفس اليوم: نحتفظ بالسجل الموجود بالفعل بتنسيق ISO
+                # rowcount لا يشمل تعديلات الـ triggers (أرقام إصدارات الجداول مثلاً)، بعكس total_changes
+                c.executemany(f"UPDATE OR IGNORE {table} SET {column} = ? WHERE id = ?", updates)
+                changed = c.rowcount
+                c.executemany(f"DELETE FROM {table} WHERE {column} != ? AND id = ?", updates)
+                stats["duplicates"] += len(updates) - changed
+                stats["updated"] += changed
+            else:
+                c.executemany(f"UPDATE {table} SET {column} = ? WHERE id = ?", updates)
+                stats["updated"] += len(updates)
+        if commit:
+            commit()
+
+    logging.info(
+        f"{table}.{column}: {stats['total']} سجل، تم تحديث {stats['updated']}، "
+        f"مكرر {stats['duplicates']}، غير صالح {stats['invalid']}، الأنماط {dict(stats['by_format'])}"
+    )
+    return stats
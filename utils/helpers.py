@@ -3,8 +3,10 @@ import flet as ft
 import logging
 import sqlite3
 import asyncio
-from utils.database import students_db_path
+from utils.database import students_db_path, get_connection
 from utils.telegram_bot import send_telegram_message,send_telegram_photo,send_telegram_video
+from utils.telegram_outbox import enqueue_message
+from utils.lookups import LookupCache
 
 
 def format_phone_number(phone):
@@ -75,14 +77,9 @@ def show_under_development_dialog(page):
     under_dev_dialog.open = True
     page.update()
 
-# دالة عامة لجلب المجموعات من قاعدة البيانات
+# دالة عامة لخيارات المجموعات، من الذاكرة ما لم يتغير جدول المجموعات
 def get_groups():
-    conn = sqlite3.connect(students_db_path)
-    c = conn.cursor()
-    c.execute('SELECT id, name, days FROM groups')
-    groups = c.fetchall()
-    conn.close()
-    return [ft.dropdown.Option(key=str(g[0]), text=f"{g[1]} ({g[2]})") for g in groups]
+    return [ft.dropdown.Option(key=str(g[0]), text=f"{g[1]} ({g[2]})") for g in LookupCache().groups()]
 
 
 def extract_unique_code(full_code: str) -> str:
@@ -154,16 +151,12 @@ def send_telegrem_messege(student_data, message, to_value="ولي الأمر", p
             show_error_dialog(page, error_msg)
         return False, error_msg
     
-    # إرسال الرسالة
-    try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        success, response_message = loop.run_until_complete(send_telegram_message(chat_id, message))
-    finally:
-        loop.close()
+    # إضافة الرسالة لصندوق الصادر، والإرسال يتم في الخلفية بدون انتظار الشبكة
+    success = enqueue_message(chat_id, message)
+    response_message = "Message queued" if success else "Failed to queue message"
 
     if success:
-        success_msg = f" تم إرسال الرسالة بنجاح إلى {recipient_type}"
+        success_msg = f" تمت جدولة الرسالة للإرسال إلى {recipient_type}"
         print(success_msg)
         if page:
             show_success_dialog(page, success_msg)
@@ -0,0 +1,69 @@
+"""
+جداول البحث الصغيرة في الذاكرة - Lookups
+
+قوائم المجموعات تُعرض في كل صفحة تقريباً (إضافة طالب، الحضور، الباركود، الرسائل...)،
+وبدلاً من قراءة جدول groups مع كل عرض تُحفظ صفوفه في الذاكرة وتُعاد قراءتها فقط
+عندما يتغير رقم إصدار الجدول في table_versions (تزيده triggers مع كل تعديل، حتى من عملية أخرى).
+
+فحص الإصدار قراءة واحدة بالمفتاح الأساسي، فالقائمة صحيحة دائماً حتى بعد تعديل تم للتو.
+
+الصفوف فقط هي المحفوظة: عناصر Flet لا يجوز أن يكون لها أكثر من أب، فكل قائمة منسدلة
+تأخذ عناصر Option جديدة مبنية من الذاكرة.
+
+الاستخدام النموذجي:
+    for group_id, name, days, stage in LookupCache().groups():
+        ...
+"""
+
+import logging
+from threading import Lock
+
+from utils.database import get_connection, get_table_version
+
+
+# مراحل المجموعات الثابتة بترتيب العرض
+STAGES = ("ابتدائي", "إعدادي", "ثانوي")
+
+
+class LookupCache:
+    """صفوف جداول البحث في الذاكرة (Singleton مشترك بين الصفحات)"""
+    _instance = None
+    _lock = Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(LookupCache, cls).__new__(cls)
+                cls._instance._initialize()
+            return cls._instance
+
+    def _initialize(self):
+        self._groups = None
+        self._version = None
+        self._refresh_lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def groups(self):
+        """صفوف المجموعات (id, name, days, stage) بترتيب الإضافة"""
+        with self._refresh_lock:
+            conn = get_connection()
+            version = get_table_version(conn, "groups")
+            if self._groups is not None and version is not None and version == self._version:
+                self.hits += 1
+                return self._groups
+
+            self.misses += 1
+            rows = conn.execute("SELECT id, name, days, stage FROM groups ORDER BY id").fetchall()
+            if conn.in_transaction:
+                # تعديل لم يُحفظ بعد في هذا الخيط: لا تُحفظ نسخة قد يتم التراجع عنها
+                return rows
+            self._groups = rows
+            self._version = version
+            logging.info(f"تم تحميل {len(rows)} مجموعة في الذاكرة")
+            return rows
+
+    def invalidate(self):
+        with self._refresh_lock:
+            self._groups = None
+            self._version = None
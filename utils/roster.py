@@ -0,0 +1,151 @@
+# utils/roster.py
+# طبقة استعلامات قائمة الطلاب: كل أعمدة الجدول في استعلام واحد بدل استعلامات لكل طالب
+from datetime import datetime
+
+from utils.database import cached_fetchall
+from utils.student_search import order_by_ids
+
+
+ROSTER_QUERY = '''
+    WITH exam_counts AS (
+        SELECT student_id, COUNT(*) AS tests_count
+        FROM exams
+        GROUP BY student_id
+    ),
+    group_dates AS (
+        SELECT DISTINCT s.group_id, a.attendance_date
+        FROM attendance a
+        JOIN students s ON a.student_id = s.id
+        WHERE s.group_id IS NOT NULL
+    ),
+    group_sessions AS (
+        SELECT group_id, COUNT(*) AS total_att
+        FROM group_dates
+        GROUP BY group_id
+    ),
+    present_counts AS (
+        -- الحضور في حصص المجموعة الحالية للطالب فقط، مثل مقام النسبة
+        SELECT a.student_id, COUNT(*) AS attended
+        FROM attendance a
+        JOIN students s ON a.student_id = s.id
+        JOIN group_dates gd ON gd.group_id = s.group_id AND gd.attendance_date = a.attendance_date
+        WHERE a.status = 'حاضر'
+        GROUP BY a.student_id
+    )
+    SELECT s.id, s.code, s.first_name, s.father_name, s.family_name,
+           s.phone, s.guardian_phone, s.grade, g.name AS group_name,
+           COALESCE(p.status, 'لم يدفع') AS payment_status,
+           COALESCE(ec.tests_count, 0) AS tests_count,
+           COALESCE(pc.attended, 0) AS attended,
+           COALESCE(gs.total_att, 0) AS total_att
+    FROM students s
+    LEFT JOIN groups g ON s.group_id = g.id
+    LEFT JOIN payments p ON p.student_id = s.id AND p.month = ?
+    LEFT JOIN exam_counts ec ON ec.student_id = s.id
+    LEFT JOIN present_counts pc ON pc.student_id = s.id
+    LEFT JOIN group_sessions gs ON gs.group_id = s.group_id
+'''
+ROSTER_TABLES = ("students", "groups", "payments", "exams", "attendance")
+
+
+def fetch_roster(conn, grade=None, student_ids=None, month=None, after=None, limit=None):
+    """
+    جلب قائمة الطلاب مع حالة الدفع وعدد الاختبارات ونسبة الحضور في استعلام واحد.
+    - grade: تصفية حسب المرحلة.
+    - student_ids: نتائج البحث (search_students)، وتُرجع السجلات بنفس ترتيبها.
+    - month: شهر الدفع بتنسيق YYYY-MM (افتراضي: الشهر الحالي).
+    - after/limit: صفحة keyset تبدأ بعد المفتاح after (قيمة sort_key لآخر سجل في الصفحة السابقة).
+    """
+    if month is None:
+        month = datetime.now().strftime('%Y-%m')
+
+    query = ROSTER_QUERY
+    params = [month]
+    where = []
+
+    if grade:
+        where.append("s.grade = ?")
+        params.append(grade)
+
+    if student_ids is not None:
+        if not student_ids:
+            return []
+        where.append(f"s.id IN ({','.join('?' * len(student_ids))})")
+        params += list(student_ids)
+
+    if after is not None:
+        where.append("(s.first_name, s.father_name, s.family_name, s.id) > (?, ?, ?, ?)")
+        params += list(after)
+
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY s.first_name, s.father_name, s.family_name, s.id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    result = []
+    for row in cached_fetchall(conn, query, params, ROSTER_TABLES):
+        (student_id, code, first_name, father_name, family_name, phone, guardian_phone,
+         grade_value, group_name, payment_status, tests_count, attended, total_att) = row
+
+        # حصص المجموعة تُحسب فقط لمن له مجموعة
+        attendance = f"{attended}/{total_att}" if total_att > 0 else "-"
+
+        result.append({
+            "id": student_id,
+            "code": code,
+            "name": f"{first_name} {father_name} {family_name}",
+            "group": group_name or "-",
+            "student_phone": phone,
+            "parent_phone": guardian_phone,
+            "grade": grade_value,
+            "payment_status": payment_status,
+            "tests_count": tests_count,
+            "attendance": attendance,
+            "sort_key": (first_name, father_name, family_name, student_id),
+        })
+    if student_ids is not None:
+        result = order_by_ids(result, student_ids)
+    return result
+
+
+# تفاصيل طلاب مجموعة واحدة: الحضور يُجمع بـ GROUP BY و SUM(CASE ...) في نفس الاستعلام،
+# وآخر دفع وعدد الاختبارات يُقرآن من فهارس تغطي الأعمدة المطلوبة بدون الرجوع للجداول
+GROUP_DETAILS_QUERY = '''
+    SELECT s.id, s.first_name, s.father_name, s.family_name, s.phone, s.guardian_phone, s.grade,
+           (SELECT p.status FROM payments p WHERE p.student_id = s.id
+            ORDER BY p.month DESC LIMIT 1) AS payment_status,
+           (SELECT COUNT(*) FROM exams e WHERE e.student_id = s.id) AS tests_count,
+           SUM(CASE WHEN a.status = 'حاضر' THEN 1 ELSE 0 END) AS attended,
+           COUNT(a.student_id) AS total_att
+    FROM students s
+    LEFT JOIN attendance a ON a.student_id = s.id
+    WHERE s.group_id = ?
+    GROUP BY s.id
+    ORDER BY s.id
+'''
+GROUP_DETAILS_TABLES = ("students", "payments", "exams", "attendance")
+
+
+def fetch_group_details(conn, group_id):
+    """
+    طلاب المجموعة مع آخر حالة دفع وعدد الاختبارات والحضور في استعلام واحد.
+    الحضور "حضر/كل سجلاته" أو "-" إذا لم يكن له سجلات.
+    """
+    result = []
+    for row in cached_fetchall(conn, GROUP_DETAILS_QUERY, (group_id,), GROUP_DETAILS_TABLES):
+        (student_id, first_name, father_name, family_name, phone, guardian_phone, grade,
+         payment_status, tests_count, attended, total_att) = row
+        result.append({
+            "id": student_id,
+            "name": f"{first_name} {father_name} {family_name}",
+            "student_phone": phone,
+            "parent_phone": guardian_phone,
+            "grade": grade,
+            "payment_status": payment_status or "-",
+            "tests_count": tests_count,
+            "attendance": f"{attended}/{total_att}" if total_att else "-",
+            "group_id": group_id,
+        })
+    return result
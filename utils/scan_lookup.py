@@ -0,0 +1,143 @@
+"""
+قراءة الباركود - Scan Lookup
+
+يحول قيمة الباركود الممسوحة إلى بيانات الطالب بدون استعلام لكل مسحة:
+- decode_scan: يفك قيمة EAN-13 (12 رقماً مبطنة بالأصفار + رقم تحقق) إلى الكود الصحيح
+- CodeDirectory: خريطة في الذاكرة {الكود: الطالب} تُحمّل مرة واحدة من عمود code_int،
+  وتُعاد قراءتها فقط عندما يتغير رقم إصدار جدول الطلاب في table_versions
+
+فحص الإصدار قراءة واحدة بالمفتاح الأساسي ولا يتم أكثر من مرة كل VERSION_CHECK_INTERVAL ثانية،
+إلا إذا لم يوجد الكود في الخريطة (طالب أضيف للتو مثلاً) فيُفحص فوراً.
+
+الاستخدام النموذجي:
+    student = resolve_scan("0000000012343")
+    if student:
+        print(student["id"], student["name"])
+"""
+
+import logging
+import time
+from threading import Lock
+
+from utils.database import get_connection, get_table_version
+from utils.student_search import ARABIC_DIGIT_MAP
+
+
+# المدخلات الرقمية بهذا الطول أو أكثر تُعامل كباركود ممسوح (EAN-13) لا كجزء من هاتف أو كود
+BARCODE_MIN_LENGTH = 12
+EAN13_LENGTH = 13
+
+_DIGITS = str.maketrans(ARABIC_DIGIT_MAP)
+
+
+def ean13_check_digit(digits12):
+    """رقم التحقق لأول 12 رقماً من EAN-13"""
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits12))
+    return (10 - total % 10) % 10
+
+
+def looks_like_barcode(value):
+    """هل المدخل قيمة باركود ممسوحة (وليس كوداً أو جزءاً من رقم هاتف مكتوباً باليد)"""
+    value = str(value or "").strip().translate(_DIGITS)
+    return value.isdigit() and len(value) >= BARCODE_MIN_LENGTH
+
+
+def decode_scan(value):
+    """
+    كود الطالب (int) من قيمة ممسوحة أو مكتوبة، أو None إذا كانت غير صالحة.
+    - 13 رقماً: EAN-13 كاملاً، يُتحقق من رقم التحقق ثم يُحذف
+    - 12 رقماً: إما القيمة بدون رقم التحقق، أو UPC-A (قارئ يحذف الصفر الأول من EAN-13)
+    - أقل من ذلك: كود مكتوب باليد
+    """
+    digits = str(value or "").strip().translate(_DIGITS)
+    if not digits.isdigit() or len(digits) > EAN13_LENGTH:
+        return None
+    if len(digits) == EAN13_LENGTH:
+        if ean13_check_digit(digits[:12]) != int(digits[12]):
+            return None
+        digits = digits[:12]
+    elif len(digits) == EAN13_LENGTH - 1 and ean13_check_digit("0" + digits[:11]) == int(digits[11]):
+        digits = digits[:11]
+    return int(digits)
+
+
+class CodeDirectory:
+    """
+    خريطة الأكواد في الذاكرة (Singleton مشترك بين الصفحات).
+    كل طالب: {"id", "code", "name", "group_id", "grade", "guardian_chat_id"}
+    """
+    _instance = None
+    _lock = Lock()
+
+    VERSION_CHECK_INTERVAL = 1.0  # ثوانٍ
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(CodeDirectory, cls).__new__(cls)
+                cls._instance._initialize()
+            return cls._instance
+
+    def _initialize(self):
+        self._by_code = {}
+        self._by_id = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._refresh_lock = Lock()
+
+    def _reload(self, conn, version):
+        rows = conn.execute('''SELECT code_int, id, code, full_name, group_id, grade, guardian_chat_id
+                               FROM students WHERE code_int IS NOT NULL''').fetchall()
+        by_code = {}
+        for code_int, student_id, code, name, group_id, grade, guardian_chat_id in rows:
+            if code_int in by_code:
+                logging.warning(f"الكود {code} مكرر، سيتم استخدام أول طالب فقط")
+                continue
+            by_code[code_int] = {
+                "id": student_id,
+                "code": code,
+                "name": name,
+                "group_id": group_id,
+                "grade": grade,
+                "guardian_chat_id": guardian_chat_id if guardian_chat_id and guardian_chat_id != "None" else None,
+            }
+        # استبدال الخريطة كاملة مرة واحدة، فالقراءة من خيوط أخرى لا ترى خريطة نصف محملة
+        self._by_code = by_code
+        self._by_id = {student["id"]: student for student in by_code.values()}
+        self._version = version
+        logging.info(f"تم تحميل {len(by_code)} كود طالب في الذاكرة")
+
+    def refresh(self, force=False):
+        """إعادة التحميل إذا تغير جدول الطلاب منذ آخر تحميل"""
+        with self._refresh_lock:
+            conn = get_connection()
+            version = get_table_version(conn, "students")
+            if force or version is None or version != self._version:
+                self._reload(conn, version)
+            self._checked_at = time.monotonic()
+
+    def lookup(self, code):
+        """الطالب بالكود (int) أو None"""
+        if time.monotonic() - self._checked_at > self.VERSION_CHECK_INTERVAL:
+            self.refresh()
+        student = self._by_code.get(code)
+        if student is None:
+            # ربما أضيف الطالب بعد آخر فحص
+            self.refresh()
+            student = self._by_code.get(code)
+        return student
+
+    def by_id(self, student_id):
+        """الطالب بمعرفه إذا كان له كود، أو None"""
+        if time.monotonic() - self._checked_at > self.VERSION_CHECK_INTERVAL:
+            self.refresh()
+        return self._by_id.get(student_id)
+
+    def resolve(self, value):
+        """الطالب من قيمة الباركود الممسوحة أو الكود المكتوب، أو None"""
+        code = decode_scan(value)
+        return self.lookup(code) if code is not None else None
+
+
+def resolve_scan(value):
+    return CodeDirectory().resolve(value)
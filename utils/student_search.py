@@ -0,0 +1,123 @@
+# utils/student_search.py
+# بحث الطلاب بفهرس FTS5 بدلاً من LIKE '%...%' على عدة أعمدة
+#
+# - الجدول students_search (rowid = students.id) يحوي الاسم والهواتف والكود بعد توحيد الحروف العربية،
+#   وتحدّثه triggers على جدول students (تُنشأ في ترحيل قاعدة البيانات)
+# - التوحيد نفسه يُطبق في SQL داخل الـ triggers وفي Python على نص البحث من نفس الجدول ARABIC_CHAR_MAP،
+#   فلا يختلف ما يُفهرس عما يُبحث عنه
+# - كل كلمة في البحث تُطابق كبادئة (محم* تطابق محمد ومحمود)، والنتائج مرتبة بـ bm25 ومحدودة بـ LIMIT
+import re
+
+
+SEARCH_TABLE = "students_search"
+SEARCH_LIMIT = 50
+
+# حروف تُكتب بأكثر من شكل وتُوحد قبل الفهرسة والبحث
+ARABIC_CHAR_MAP = {
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ئ": "ي",
+    "ؤ": "و",
+    "ة": "ه",
+    "ـ": "",  # التطويل
+    # التشكيل (الفتحة .. السكون والألف الخنجرية)
+    "ً": "", "ٌ": "", "ٍ": "", "َ": "",
+    "ُ": "", "ِ": "", "ّ": "", "ْ": "", "ٰ": "",
+}
+# الأرقام الهندية والفارسية تُحول لأرقام عادية كما تُخزن الأكواد والهواتف
+ARABIC_DIGIT_MAP = {chr(0x0660 + i): str(i) for i in range(10)}
+ARABIC_DIGIT_MAP.update({chr(0x06F0 + i): str(i) for i in range(10)})
+
+_TRANSLATION = str.maketrans({**ARABIC_CHAR_MAP, **ARABIC_DIGIT_MAP})
+_TOKEN_RE = re.compile(r"\w+")
+
+# وزن كل عمود في ترتيب bm25: (الاسم، الهواتف، الكود)
+RANK_WEIGHTS = (10.0, 1.0, 5.0)
+
+
+def normalize_arabic(text):
+    """توحيد النص العربي بنفس قواعد الفهرس"""
+    return " ".join(str(text or "").translate(_TRANSLATION).split())
+
+
+def sql_normalize(expr, char_map=ARABIC_CHAR_MAP):
+    """
+    نفس normalize_arabic كتعبير SQL (replace متداخلة) لاستخدامه في الـ triggers.
+    كل عمود يُطبق عليه الجزء الذي يخصه فقط (حروف للاسم، أرقام للهواتف)
+    لأن محلل SQLite لا يحتمل تداخلاً أعمق من ذلك.
+    """
+    for source, target in char_map.items():
+        expr = f"replace({expr}, '{source}', '{target}')"
+    return expr
+
+
+def search_columns_sql(alias):
+    """قيم أعمدة الفهرس (الاسم، الهواتف، الكود) لصف طالب باسم alias في SQL"""
+    name = f"{alias}.first_name || ' ' || {alias}.father_name || ' ' || {alias}.family_name"
+    phones = f"coalesce({alias}.phone, '') || ' ' || coalesce({alias}.guardian_phone, '')"
+    code = f"coalesce({alias}.code, '')"
+    return sql_normalize(name), sql_normalize(phones, ARABIC_DIGIT_MAP), code
+
+
+def build_match_query(term):
+    """تحويل نص البحث إلى تعبير MATCH: كل كلمة بادئة، وكل الكلمات مطلوبة"""
+    tokens = _TOKEN_RE.findall(normalize_arabic(term))
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+def search_students(conn, term, limit=SEARCH_LIMIT, grade=None, group_id=None):
+    """
+    معرفات الطلاب المطابقين لنص البحث مرتبة بالأقرب، بحد أقصى limit.
+    - grade / group_id: تصفية إضافية تُطبق قبل LIMIT
+    """
+    match = build_match_query(term)
+    if not match:
+        return []
+
+    query = f'''SELECT s.id FROM {SEARCH_TABLE} f
+                JOIN students s ON s.id = f.rowid
+                WHERE {SEARCH_TABLE} MATCH ?'''
+    params = [match]
+    if grade:
+        query += " AND s.grade = ?"
+        params.append(grade)
+    if group_id:
+        query += " AND s.group_id = ?"
+        params.append(group_id)
+    query += f" ORDER BY bm25({SEARCH_TABLE}, {', '.join(map(str, RANK_WEIGHTS))}), s.full_name LIMIT ?"
+    params.append(limit)
+    return [row[0] for row in conn.execute(query, params)]
+
+
+def order_by_ids(records, student_ids):
+    """ترتيب سجلات (dict فيها id) بنفس ترتيب نتائج البحث"""
+    position = {student_id: index for index, student_id in enumerate(student_ids)}
+    return sorted(records, key=lambda record: position.get(record["id"], len(position)))
+
+
+def create_search_index(c):
+    """إنشاء جدول FTS5 والـ triggers وملؤه من جدول students (يُستدعى من ترحيل قاعدة البيانات)"""
+    c.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        name, phones, code,
+        tokenize = "unicode61 remove_diacritics 2",
+        prefix = '2 3'
+    )''')
+
+    new_name, new_phones, new_code = search_columns_sql("new")
+    insert_new = (f"INSERT INTO {SEARCH_TABLE} (rowid, name, phones, code) "
+                  f"VALUES (new.id, {new_name}, {new_phones}, {new_code});")
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ai AFTER INSERT ON students BEGIN
+        {insert_new}
+    END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_ad AFTER DELETE ON students BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_au
+        AFTER UPDATE OF first_name, father_name, family_name, phone, guardian_phone, code ON students BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+        {insert_new}
+    END''')
+
+    s_name, s_phones, s_code = search_columns_sql("s")
+    c.execute(f"DELETE FROM {SEARCH_TABLE}")
+    c.execute(f'''INSERT INTO {SEARCH_TABLE} (rowid, name, phones, code)
+                  SELECT s.id, {s_name}, {s_phones}, {s_code} FROM students s''')
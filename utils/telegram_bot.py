@@ -7,7 +7,7 @@ from telegram import Update
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 from telegram.error import NetworkError
 
-from utils.database import students_db_path
+from utils.database import students_db_path, get_connection
 from utils.connection_manager import ConnectionManager
 
 TOKEN = "8256652647:AAHqakKvqgWiKqsm0qI61pXPKa_ETKwfyfE"
@@ -61,7 +61,7 @@ def save_chat_id(code: str, role: str, chat_id: int):
         return False
 
     try:
-        with sqlite3.connect(students_db_path) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
             c.execute("SELECT code FROM students WHERE code = ?", (code,))
             if not c.fetchone():
@@ -109,7 +109,8 @@ async def send_telegram_message(chat_id: int, text: str):
     try:
         url = BASE_URL + "/sendMessage"
         params = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
-        resp = requests.get(url, params=params, timeout=10)
+        # requests متزامنة: تنفيذها في خيط حتى لا تحجز حلقة الأحداث
+        resp = await asyncio.to_thread(requests.get, url, params=params, timeout=10)
         if resp.status_code == 200:
             return True, "Message sent successfully"
         else:
@@ -248,36 +249,6 @@ async def initialize_bot(app: Application):
         print(f"Unexpected error during initialization: {str(e)}")
         return False, f"Error: {str(e)}"
 
-@retry_on_network_error(max_retries=3, delay=1)
-async def send_pending_notifications():
-    conn_manager = ConnectionManager()
-    if not conn_manager.is_online:
-        print("No internet connection for sending pending notifications")
-        return False, "No internet connection"
-
-    try:
-        with sqlite3.connect(students_db_path) as conn:
-            c = conn.cursor()
-            c.execute('SELECT id, chat_id, message FROM pending_notifications')
-            notifications = c.fetchall()
-            sent_count = 0
-            for notif_id, chat_id, message in notifications:
-                success, error_msg = await send_telegram_message(chat_id, message)
-                if success:
-                    print(f"Pending notification (ID: {notif_id}) sent to {chat_id}")
-                    c.execute('DELETE FROM pending_notifications WHERE id = ?', (notif_id,))
-                    sent_count += 1
-                else:
-                    print(f"Failed to send pending notification (ID: {notif_id}): {error_msg}")
-            conn.commit()
-            if sent_count > 0:
-                return True, f"Sent {sent_count} pending notifications"
-            else:
-                return True, "No pending notifications"
-    except sqlite3.Error as e:
-        print(f"Database error while processing pending notifications: {str(e)}")
-        return False, f"Error: {str(e)}"
-
 def run_telegram_bot():
     print("Starting Telegram bot...")
 
@@ -307,9 +278,8 @@ def run_telegram_bot():
                 print(message)
                 return
 
+            # الإشعارات المؤجلة يرسلها صندوق الصادر في عملية الواجهة (utils/telegram_outbox.py)
             print("Starting to receive messages...")
-            success, message = await send_pending_notifications()
-            print(message)
 
             await app.run_polling(
                 drop_pending_updates=True,
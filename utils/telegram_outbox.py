@@ -0,0 +1,366 @@
+"""
+صندوق الصادر لرسائل تيليجرام - Telegram Outbox
+
+كل رسالة تُحفظ أولاً في جدول pending_notifications ثم ترجع الدالة فوراً،
+وخيط خلفي واحد (بحلقة asyncio خاصة به) يتولى الإرسال:
+
+1. enqueue_message / enqueue_messages: إضافة رسائل للصادر وإيقاظ المُرسل (بدون انتظار الشبكة)
+2. مجموعة عمال asyncio تشترك في جلسة aiohttp واحدة
+3. محدد معدل يحترم حدود تيليجرام (30 رسالة/ثانية إجمالاً، ورسالة/ثانية لكل محادثة)
+4. إعادة المحاولة بتأخير متزايد عند أخطاء الشبكة، واحترام retry_after عند 429،
+   وتعليم الرسالة كفاشلة نهائياً عند أخطاء مثل حظر البوت أو محادثة غير موجودة
+
+حالات الرسالة في العمود status: pending → sending → (تُحذف عند الإرسال) / failed
+الرسائل الفاشلة تبقى للمراجعة FAILED_RETENTION_DAYS يوماً ثم تُحذف عند تشغيل المُرسل.
+
+الاستخدام النموذجي:
+    from utils.telegram_outbox import enqueue_message
+    enqueue_message(guardian_chat_id, message)
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+
+import aiohttp
+
+from utils.database import get_connection
+from utils.connection_manager import ConnectionManager
+
+# نفس رابط البوت المستخدم في utils/telegram_bot.py
+from utils.telegram_bot import BASE_URL
+
+
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"        # قديمة: الرسائل المرسلة تُحذف الآن ولا تبقى بهذه الحالة
+STATUS_FAILED = "failed"
+
+# أخطاء لا فائدة من إعادة المحاولة معها (محادثة غير موجودة، البوت محظور...)
+PERMANENT_ERROR_CODES = {400, 401, 403, 404}
+
+FAILED_RETENTION_DAYS = 30
+
+
+class RateLimiter:
+    """
+    محدد معدل غير متزامن:
+    - دلو رموز عام بمعدل global_rate رسالة في الثانية
+    - حد أدنى per_chat_interval ثانية بين رسالتين لنفس المحادثة
+    """
+
+    def __init__(self, global_rate=30, per_chat_interval=1.0):
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self._tokens = float(global_rate)
+        self._last_refill = time.monotonic()
+        self._chat_next = {}
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, chat_id):
+        while True:
+            await self._take_global_token()
+            # فحص دور المحادثة وحجزه بدون await بينهما، فلا يتسابق عاملان على نفس المحادثة
+            now = time.monotonic()
+            chat_next = self._chat_next.get(chat_id, 0.0)
+            if chat_next <= now:
+                self._chat_next[chat_id] = now + self.per_chat_interval
+                break
+            # المحادثة غير متاحة بعد: إعادة الرمز والانتظار
+            self._tokens = min(self.global_rate, self._tokens + 1)
+            await asyncio.sleep(chat_next - now)
+
+        if len(self._chat_next) > 10000:
+            self._forget_idle_chats()
+
+    async def _take_global_token(self):
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.global_rate, self._tokens + (now - self._last_refill) * self.global_rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.global_rate
+            await asyncio.sleep(wait)
+
+    def _forget_idle_chats(self):
+        now = time.monotonic()
+        self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+
+
+class TelegramOutbox:
+    """
+    المُرسل الخلفي لصندوق الصادر (Singleton لكل عملية).
+    يُشغَّل تلقائياً عند أول enqueue، ويمكن تشغيله صراحة عند بدء التطبيق.
+    """
+    _instance = None
+    _lock = Lock()
+
+    WORKERS = 8
+    POLL_INTERVAL = 30        # ثوانٍ: أقصى مدة نوم عندما لا يوجد ما يُرسل
+    MAX_ATTEMPTS = 8
+    BACKOFF_BASE = 5          # ثوانٍ، يتضاعف مع كل محاولة
+    BACKOFF_MAX = 3600
+    REQUEST_TIMEOUT = 15
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(TelegramOutbox, cls).__new__(cls)
+                cls._instance._initialize()
+            return cls._instance
+
+    def _initialize(self):
+        self._loop = None
+        self._thread = None
+        self._wake_event = None
+        self._queue = None
+        self._running = False
+        self._started = Lock()
+
+    # ================= واجهة الخيوط الأخرى =================
+    def start(self):
+        """تشغيل خيط الإرسال إذا لم يكن يعمل"""
+        with self._started:
+            if self._running:
+                return
+            self._running = True
+            self._thread = Thread(target=self._run, name="telegram-outbox", daemon=True)
+            self._thread.start()
+
+            conn_manager = ConnectionManager()
+            conn_manager.start_monitoring()
+            conn_manager.add_status_listener(self._on_connection_change)
+
+    def stop(self):
+        """إيقاف خيط الإرسال، والرسائل غير المرسلة تبقى في الصادر للمرة القادمة"""
+        if not self._running or self._loop is None:
+            return
+        self._running = False
+        self._loop.call_soon_threadsafe(self._wake_event.set)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def wake(self):
+        """إيقاظ المُرسل بعد إضافة رسائل جديدة"""
+        if not self._running:
+            self.start()
+        loop = self._loop
+        if loop is not None and self._wake_event is not None:
+            loop.call_soon_threadsafe(self._wake_event.set)
+
+    def _on_connection_change(self, is_online):
+        if is_online:
+            self.wake()
+
+    # ================= حلقة الإرسال =================
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        try:
+            loop.run_until_complete(self._main())
+        except Exception as e:
+            logging.error(f"خطأ في خيط صندوق صادر تيليجرام: {e}", exc_info=True)
+        finally:
+            self._loop = None
+            loop.close()
+            self._running = False
+
+    async def _main(self):
+        self._wake_event = asyncio.Event()
+        self._queue = asyncio.Queue()
+        limiter = RateLimiter()
+        requeue_stale()
+        prune_outbox()
+
+        timeout = aiohttp.ClientTimeout(total=self.REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            workers = [
+                asyncio.create_task(self._worker(session, limiter))
+                for _ in range(self.WORKERS)
+            ]
+            try:
+                await self._dispatch()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _dispatch(self):
+        while self._running:
+            self._wake_event.clear()
+            next_due = None
+
+            if ConnectionManager().is_online:
+                capacity = self.WORKERS * 4 - self._queue.qsize()
+                if capacity > 0:
+                    for row in self._claim_due(capacity):
+                        self._queue.put_nowait(row)
+                next_due = self._next_due_in()
+
+            sleep_for = self.POLL_INTERVAL if next_due is None else min(self.POLL_INTERVAL, max(next_due, 0.05))
+            if self._queue.qsize() >= self.WORKERS * 4:
+                sleep_for = min(sleep_for, 0.5)
+            try:
+                await asyncio.wait_for(self._wake_event.wait(), timeout=sleep_for)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self, session, limiter):
+        while True:
+            notif_id, chat_id, message, attempts = await self._queue.get()
+            try:
+                await limiter.acquire(chat_id)
+                ok, error_code, retry_after, error = await self._post(session, chat_id, message)
+                if ok:
+                    self._mark_sent(notif_id)
+                elif error_code in PERMANENT_ERROR_CODES:
+                    self._mark_failed(notif_id, attempts + 1, error)
+                else:
+                    self._mark_retry(notif_id, attempts + 1, error, retry_after)
+            except asyncio.CancelledError:
+                # الرسالة ترجع للانتظار ليعاد إرسالها عند التشغيل القادم
+                self._mark_retry(notif_id, attempts, "cancelled", 0)
+                raise
+            except Exception as e:
+                self._mark_retry(notif_id, attempts + 1, str(e), None)
+            finally:
+                self._queue.task_done()
+                self._wake_event.set()
+
+    async def _post(self, session, chat_id, message):
+        """إرجاع (نجاح، كود الخطأ، retry_after، نص الخطأ)"""
+        payload = {"chat_id": chat_id, "text": message, "parse_mode": "HTML"}
+        try:
+            async with session.post(BASE_URL + "/sendMessage", json=payload) as resp:
+                try:
+                    data = await resp.json(content_type=None)
+                except (aiohttp.ContentTypeError, ValueError):
+                    data = {}
+                if resp.status == 200 and data.get("ok", True):
+                    return True, None, None, None
+                retry_after = (data.get("parameters") or {}).get("retry_after")
+                return False, resp.status, retry_after, data.get("description") or f"HTTP {resp.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return False, None, None, f"Network error: {e}"
+
+    # ================= عمليات قاعدة البيانات (داخل خيط الإرسال فقط) =================
+    def _claim_due(self, limit):
+        conn = get_connection()
+        c = conn.cursor()
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            c.execute(
+                '''SELECT id, chat_id, message, attempts FROM pending_notifications
+                   WHERE status = ? AND (next_attempt_at IS NULL OR next_attempt_at <= ?)
+                   ORDER BY id LIMIT ?''',
+                (STATUS_PENDING, time.time(), limit)
+            )
+            rows = c.fetchall()
+            c.executemany(
+                "UPDATE pending_notifications SET status = ? WHERE id = ?",
+                [(STATUS_SENDING, row[0]) for row in rows]
+            )
+            conn.commit()
+            return rows
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"خطأ أثناء قراءة صندوق الصادر: {e}")
+            return []
+
+    def _next_due_in(self):
+        row = get_connection().execute(
+            "SELECT MIN(COALESCE(next_attempt_at, 0)) FROM pending_notifications WHERE status = ?",
+            (STATUS_PENDING,)
+        ).fetchone()
+        if not row or row[0] is None:
+            return None
+        return row[0] - time.time()
+
+    def _mark_sent(self, notif_id):
+        # الرسالة المرسلة لا حاجة لها، حتى لا يكبر الجدول مع كل إشعار
+        with get_connection() as conn:
+            conn.execute("DELETE FROM pending_notifications WHERE id = ?", (notif_id,))
+
+    def _mark_failed(self, notif_id, attempts, error):
+        logging.warning(f"فشل نهائي لإشعار تيليجرام (ID: {notif_id}): {error}")
+        with get_connection() as conn:
+            conn.execute(
+                "UPDATE pending_notifications SET status = ?, attempts = ?, last_error = ? WHERE id = ?",
+                (STATUS_FAILED, attempts, error, notif_id)
+            )
+
+    def _mark_retry(self, notif_id, attempts, error, retry_after):
+        if attempts >= self.MAX_ATTEMPTS:
+            self._mark_failed(notif_id, attempts, error)
+            return
+        if retry_after is None:
+            retry_after = min(self.BACKOFF_BASE * (2 ** max(attempts - 1, 0)), self.BACKOFF_MAX)
+        with get_connection() as conn:
+            conn.execute(
+                '''UPDATE pending_notifications
+                   SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?
+                   WHERE id = ?''',
+                (STATUS_PENDING, attempts, error, time.time() + retry_after, notif_id)
+            )
+
+
+# ================= واجهة الإضافة للصادر =================
+def enqueue_messages(messages):
+    """
+    إضافة مجموعة رسائل [(chat_id, نص)...] للصادر في معاملة واحدة وإرجاع عددها.
+    ترجع فوراً، والإرسال يتم في الخلفية.
+    """
+    rows = [(str(chat_id), text) for chat_id, text in messages if chat_id and str(chat_id).strip() not in ("", "None")]
+    if not rows:
+        return 0
+    created_at = datetime.now().isoformat(timespec="seconds")
+    with get_connection() as conn:
+        conn.executemany(
+            '''INSERT INTO pending_notifications (chat_id, message, created_at, status, attempts)
+               VALUES (?, ?, ?, ?, 0)''',
+            [(chat_id, text, created_at, STATUS_PENDING) for chat_id, text in rows]
+        )
+    TelegramOutbox().wake()
+    return len(rows)
+
+
+def enqueue_message(chat_id, text):
+    """إضافة رسالة واحدة للصادر، ترجع True إذا تمت الإضافة"""
+    return enqueue_messages([(chat_id, text)]) == 1
+
+
+def requeue_stale():
+    """إرجاع الرسائل العالقة في حالة sending (بعد إغلاق مفاجئ) إلى الانتظار"""
+    with get_connection() as conn:
+        cur = conn.execute(
+            "UPDATE pending_notifications SET status = ? WHERE status = ?",
+            (STATUS_PENDING, STATUS_SENDING)
+        )
+        return cur.rowcount
+
+
+def prune_outbox(days=FAILED_RETENTION_DAYS):
+    """حذف الرسائل المرسلة (من الإصدارات التي كانت تحتفظ بها) والفاشلة الأقدم من days يوماً"""
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds")
+    with get_connection() as conn:
+        cur = conn.execute(
+            "DELETE FROM pending_notifications WHERE status = ? OR (status = ? AND created_at < ?)",
+            (STATUS_SENT, STATUS_FAILED, cutoff)
+        )
+        if cur.rowcount:
+            logging.info(f"تم حذف {cur.rowcount} رسالة قديمة من صادر تيليجرام")
+        return cur.rowcount
+
+
+def outbox_stats():
+    """عدد الرسائل في كل حالة"""
+    rows = get_connection().execute(
+        "SELECT status, COUNT(*) FROM pending_notifications GROUP BY status"
+    ).fetchall()
+    return dict(rows)